@@ -0,0 +1,51 @@
+from __future__ import print_function
+import collections
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(100000)
+PIPELINE = benchutils.to_json([
+    {'$match': {'likes': ['cats']}},
+    {'$group': {'_id': '$city',
+                'people': {'$count': {}},
+                'average_age': {'$avg': '$age'},
+                'oldest': {'$max': '$age'}}},
+    {'$sort': [{'people': -1}]}
+])
+
+
+class AggregateBenchmark(benchutils.Benchmark):
+    """Counting people who like cats in each city, with their average and
+    maximum age, by fetching the matching documents and grouping them in
+    Python, versus with a bq_aggregate pipeline, which groups them on the
+    server in one query.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+
+    def bench_find_and_group_in_client(self):
+        self.cur.execute("""
+        select bq_find('people', '{"likes": ["cats"]}')
+        """)
+        groups = collections.defaultdict(list)
+        for (doc,) in self.cur.fetchall():
+            groups[doc['city']].append(doc['age'])
+        self.conn.commit()
+        sorted(({'_id': city,
+                 'people': len(ages),
+                 'average_age': float(sum(ages)) / len(ages),
+                 'oldest': max(ages)}
+                for city, ages in groups.items()),
+               key=lambda d: -d['people'])
+
+    def bench_aggregate(self):
+        self.cur.execute("select bq_aggregate('people', %s)", (PIPELINE,))
+        self.cur.fetchall()
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    AggregateBenchmark().run()
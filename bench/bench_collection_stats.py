@@ -0,0 +1,60 @@
+from __future__ import print_function
+import os
+import benchutils
+
+
+# Number of collections in the database, overridable with
+# BEDQUILT_BENCH_COLLECTIONS.
+COLLECTION_COUNT = int(os.environ.get('BEDQUILT_BENCH_COLLECTIONS', 4000))
+CALLS = 20
+
+
+class CollectionStatsBenchmark(benchutils.Benchmark):
+    """Listing collections in a database with thousands of them, from the
+    collection registry, against the information_schema query which
+    bq_list_collections used to run, and polling bq_collection_stats for
+    all of them.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        for start in range(0, COLLECTION_COUNT, 100):
+            for i in range(start, min(start + 100, COLLECTION_COUNT)):
+                self.cur.execute(
+                    "select bq_create_collection(%s, '{\"gin\": false}')",
+                    ('things_{}'.format(i),))
+            self.conn.commit()
+        benchutils.load_docs(self, 'things_0', 10000)
+
+    def teardown(self):
+        # in batches, to stay within max_locks_per_transaction
+        for start in range(0, COLLECTION_COUNT, 100):
+            for i in range(start, min(start + 100, COLLECTION_COUNT)):
+                self.cur.execute("select bq_delete_collection(%s)",
+                                 ('things_{}'.format(i),))
+            self.conn.commit()
+
+    def bench_collection_stats(self):
+        for _ in range(CALLS):
+            self._query("select * from bq_collection_stats()")
+
+    def bench_list_collections(self):
+        for _ in range(CALLS):
+            self._query("select bq_list_collections()")
+
+    def bench_list_collections_information_schema(self):
+        for _ in range(CALLS):
+            self._query("""
+            select table_name::text
+            from information_schema.columns
+            where column_name = 'bq_jdoc'
+            and data_type = 'jsonb'
+            and not exists(select 1 from pg_inherits
+                           where inhrelid = format('%I.%I', table_schema, table_name)::regclass)
+            order by format('%I.%I', table_schema, table_name)::regclass::oid
+            """)
+
+
+if __name__ == '__main__':
+    CollectionStatsBenchmark().run()
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(20000)
+FIELDS = 30
+
+
+def make_doc(i):
+    doc = dict(('field_{}'.format(f), 'value_{}'.format(i)) for f in range(FIELDS))
+    doc['n'] = i
+    return doc
+
+
+class ConstraintsBenchmark(benchutils.Benchmark):
+    """Inserting documents with 30 fields into collections with no
+    constraints, and with $required, $notnull and $type constraints on
+    10 and 30 of the fields, which bq_add_constraints compiles into a
+    single check. For comparison, also into a collection with one check
+    constraint per field and rule, as earlier versions added.
+    """
+
+    def setup(self):
+        spec = dict(('field_{}'.format(f),
+                     {'$required': True, '$notnull': True, '$type': 'string'})
+                    for f in range(FIELDS))
+        # without GIN indexes, which would dwarf the cost of the checks
+        for collection in ['no_constraints', 'constraints_10',
+                           'constraints_30', 'legacy_constraints']:
+            self._query("""
+            select bq_create_collection(%s, '{"gin": false}')
+            """, (collection,))
+        for count in [10, 30]:
+            self._query("select bq_add_constraints(%s, %s)", (
+                'constraints_{}'.format(count),
+                benchutils.to_json(dict(list(sorted(spec.items()))[:count]))))
+        checks = []
+        for f in range(FIELDS):
+            field = 'field_{}'.format(f)
+            checks.extend([
+                """add constraint "bqcn:{0}:required"
+                   check (bq_jdoc ? '{0}')""".format(field),
+                """add constraint "bqcn:{0}:notnull"
+                   check (jsonb_typeof(bq_jdoc->'{0}') <> 'null')""".format(field),
+                """add constraint "bqcn:{0}:type:string"
+                   check (jsonb_typeof(bq_jdoc->'{0}') in ('string', 'null'))
+                """.format(field)])
+        self._query("alter table legacy_constraints " + ', '.join(checks))
+        self.docs = benchutils.to_json([make_doc(i) for i in range(DOC_COUNT)])
+
+    def _insert(self, collection):
+        self._query("select bq_insert_many(%s, %s)", (collection, self.docs))
+
+    def bench_insert_no_constraints(self):
+        self._insert('no_constraints')
+
+    def bench_insert_10_constrained_fields(self):
+        self._insert('constraints_10')
+
+    def bench_insert_30_constrained_fields(self):
+        self._insert('constraints_30')
+
+    def bench_insert_30_fields_one_check_per_rule(self):
+        self._insert('legacy_constraints')
+
+
+if __name__ == '__main__':
+    ConstraintsBenchmark().run()
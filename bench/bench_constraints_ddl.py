@@ -0,0 +1,48 @@
+from __future__ import print_function
+import time
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+SPEC = {
+    'name': {'$required': True, '$notnull': True, '$type': 'string'},
+    'age': {'$required': True, '$notnull': True, '$type': 'number'},
+    'city': {'$required': True, '$notnull': True, '$type': 'string'},
+    'likes': {'$type': 'array'}
+}
+
+
+class ConstraintsDdlBenchmark(benchutils.Benchmark):
+    """Adding ten constraints to a collection in one bq_add_constraints
+    call, which checks the documents in a single scan, versus one call per
+    constraint, each of which scans the collection, as with one ALTER TABLE
+    per constraint. Also removing them all again, in one call, which
+    doesn't scan the collection at all.
+    """
+
+    def setup(self):
+        self._query("select bq_create_collection('people', '{\"gin\": false}')")
+        benchutils.load_docs(self, 'people', DOC_COUNT, padding=200)
+
+    def bench_add_10_constraints_in_one_call(self):
+        self._query("select bq_add_constraints('people', %s)",
+                    (benchutils.to_json(SPEC),))
+
+    def bench_add_10_constraints_one_at_a_time(self):
+        for field, field_spec in sorted(SPEC.items()):
+            for op, value in sorted(field_spec.items()):
+                self._query("select bq_add_constraints('people', %s)",
+                            (benchutils.to_json({field: {op: value}}),))
+
+    def bench_remove_10_constraints(self):
+        self._query("select bq_add_constraints('people', %s)",
+                    (benchutils.to_json(SPEC),))
+        start = time.time()
+        self._query("select bq_remove_constraints('people', %s)",
+                    (benchutils.to_json(SPEC),))
+        benchutils.report('remove_10_constraints',
+                          (time.time() - start) * 1000, 'ms')
+
+
+if __name__ == '__main__':
+    ConstraintsDdlBenchmark().run()
@@ -0,0 +1,79 @@
+from __future__ import print_function
+import os
+import benchutils
+
+
+# Number of collections in the database, overridable with
+# BEDQUILT_BENCH_COLLECTIONS.
+COLLECTION_COUNT = int(os.environ.get('BEDQUILT_BENCH_COLLECTIONS', 4000))
+CALLS = 200
+SPEC = benchutils.to_json({
+    'name': {'$required': True, '$type': 'string'}
+})
+
+
+class ManyCollectionsConstraintsBenchmark(benchutils.Benchmark):
+    """Constraint lookups in a database with thousands of collections:
+    bq_constraint_name_exists, which reads pg_constraint, against the
+    function it replaced, which read information_schema, and
+    bq_add_constraints and bq_remove_constraints, which use it, on 200 of
+    the collections.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        for start in range(0, COLLECTION_COUNT, 100):
+            for i in range(start, min(start + 100, COLLECTION_COUNT)):
+                self.cur.execute(
+                    "select bq_create_collection(%s, '{\"gin\": false}')",
+                    ('things_{}'.format(i),))
+            self.conn.commit()
+        self.collections = ['things_{}'.format(i) for i in range(CALLS)]
+        self._query("""
+        create function pg_temp.information_schema_constraint_name_exists(
+          i_coll text, i_name text)
+        returns boolean as $$
+        begin
+          return exists(
+            select * from information_schema.constraint_column_usage
+            where table_name = i_coll
+            and constraint_name = i_name
+          );
+        end
+        $$ language plpgsql;
+        """)
+
+    def teardown(self):
+        # in batches, to stay within max_locks_per_transaction
+        for start in range(0, COLLECTION_COUNT, 100):
+            for i in range(start, min(start + 100, COLLECTION_COUNT)):
+                self.cur.execute("select bq_delete_collection(%s)",
+                                 ('things_{}'.format(i),))
+            self.conn.commit()
+
+    def bench_1_add_constraints(self):
+        for collection in self.collections:
+            self._query("select bq_add_constraints(%s, %s)",
+                        (collection, SPEC))
+
+    def bench_2_remove_constraints(self):
+        for collection in self.collections:
+            self._query("select bq_remove_constraints(%s, %s)",
+                        (collection, SPEC))
+
+    def bench_constraint_name_exists(self):
+        for collection in self.collections:
+            self._query("select bq_constraint_name_exists(%s, 'validate_id')",
+                        (collection,))
+
+    def bench_constraint_name_exists_information_schema(self):
+        for collection in self.collections:
+            self._query("""
+            select pg_temp.information_schema_constraint_name_exists(
+              %s, 'validate_id')
+            """, (collection,))
+
+
+if __name__ == '__main__':
+    ManyCollectionsConstraintsBenchmark().run()
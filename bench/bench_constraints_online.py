@@ -0,0 +1,45 @@
+from __future__ import print_function
+import time
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+BATCH_SIZE = 10000
+SPEC = benchutils.to_json({
+    'name': {'$required': True, '$type': 'string'},
+    'age': {'$notnull': True, '$type': 'number'}
+})
+
+
+class OnlineConstraintsBenchmark(benchutils.Benchmark):
+    """Adding constraints to a collection which already holds documents,
+    with bq_add_constraints, which checks them while the collection is
+    locked against reads and writes, versus with i_online true followed by
+    bq_validate_constraints in batches. Reports the longest time the
+    collection is locked against writes in each case.
+    """
+
+    def setup(self):
+        self._query("select bq_create_collection('people', '{\"gin\": false}')")
+        benchutils.load_docs(self, 'people', DOC_COUNT, padding=200)
+
+    def _report_lock(self, label, seconds):
+        benchutils.report(label + '_max_write_lock', seconds * 1000, 'ms')
+
+    def bench_add_constraints(self):
+        start = time.time()
+        self._query("select bq_add_constraints('people', %s)", (SPEC,))
+        self._report_lock('add', time.time() - start)
+
+    def bench_add_constraints_online(self):
+        start = time.time()
+        self._query("select bq_add_constraints('people', %s, true)", (SPEC,))
+        self._report_lock('add_online', time.time() - start)
+        # batches only take an ACCESS SHARE lock on the collection
+        while self._query("select bq_validate_constraints('people', %s)",
+                          (BATCH_SIZE,))[0][0]:
+            pass
+
+
+if __name__ == '__main__':
+    OnlineConstraintsBenchmark().run()
@@ -0,0 +1,61 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(500000)
+
+
+class CountBenchmark(benchutils.Benchmark):
+    """Counting a whole collection with each mode of bq_count: an exact
+    count, an estimate from the table statistics, and the cached count
+    kept by triggers. Also reports how far the estimates are off, and what
+    keeping the count costs each insert statement.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        self._query("""
+        select bq_create_collection('people', '{"cached_count": true}')
+        """)
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+        for query in ['{}', '{"city": "Glasgow"}']:
+            estimate = self._query("""
+            select bq_count('people', %s, 'estimated')
+            """, (query,))[0][0]
+            exact = self._query("select bq_count('people', %s)", (query,))[0][0]
+            benchutils.report('estimate_error ' + query,
+                              100.0 * abs(estimate - exact) / exact, '%')
+        self._query("""
+        select bq_create_collection('counted', '{"cached_count": true}');
+        select bq_create_collection('uncounted');
+        """)
+
+    def bench_exact_count(self):
+        self._query("select bq_count('people', '{}')")
+
+    def bench_estimated_count(self):
+        self._query("select bq_count('people', '{}', 'estimated')")
+
+    def bench_estimated_count_with_query(self):
+        self._query("""
+        select bq_count('people', '{"city": "Glasgow"}', 'estimated')
+        """)
+
+    def bench_cached_count(self):
+        self._query("select bq_count('people', '{}', 'cached')")
+
+    def _insert_docs(self, collection):
+        for i in range(200):
+            self._query("select bq_insert(%s, %s)",
+                        (collection, benchutils.to_json(benchutils.make_doc(i))))
+
+    def bench_inserts_with_cached_count(self):
+        self._insert_docs('counted')
+
+    def bench_inserts_without_cached_count(self):
+        self._insert_docs('uncounted')
+
+
+if __name__ == '__main__':
+    CountBenchmark().run()
@@ -0,0 +1,42 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+
+
+class DistinctBenchmark(benchutils.Benchmark):
+    """Listing the distinct cities of a collection, by fetching every
+    document and de-duplicating on the client, versus with bq_distinct,
+    both with a scan of the collection and with a loose index scan over
+    an index on the city.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+        benchutils.load_docs(self, 'indexed_people', DOC_COUNT)
+        self._query("""
+        select bq_add_index('indexed_people', '{"city": 1}')
+        """)
+        self._query("analyze indexed_people")
+
+    def bench_find_and_dedupe_in_client(self):
+        self.cur.execute("select bq_find('people', '{}')")
+        sorted(set(doc['city'] for (doc,) in self.cur.fetchall()))
+        self.conn.commit()
+
+    def bench_distinct_without_index(self):
+        self.cur.execute("select bq_distinct('people', 'city')")
+        self.cur.fetchall()
+        self.conn.commit()
+
+    def bench_distinct_with_index(self):
+        self.cur.execute("select bq_distinct('indexed_people', 'city')")
+        self.cur.fetchall()
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    DistinctBenchmark().run()
@@ -0,0 +1,73 @@
+from __future__ import print_function
+import time
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(1000000)
+BATCH_SIZE = 1000
+
+
+def temp_bytes(bench):
+    return bench._query(
+        "select temp_bytes from pg_stat_database "
+        "where datname = current_database()")[0][0]
+
+
+class FindCursorBenchmark(benchutils.Benchmark):
+    """Exporting a whole collection, through bq_find, which gathers the
+    result up on the server first, versus fetching in batches from the
+    cursor opened by bq_find_cursor.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT, padding=200)
+
+    def bench_find_first_row(self):
+        start = time.time()
+        cur = self.conn.cursor('find_export')
+        cur.itersize = BATCH_SIZE
+        cur.execute("select bq_find('people', '{}')")
+        next(iter(cur))
+        benchutils.report('find_first_row', time.time() - start, 's')
+        cur.close()
+        self.conn.commit()
+
+    def bench_find_export(self):
+        before = temp_bytes(self)
+        cur = self.conn.cursor('find_export')
+        cur.itersize = BATCH_SIZE
+        cur.execute("select bq_find('people', '{}')")
+        for _ in cur:
+            pass
+        cur.close()
+        self.conn.commit()
+        benchutils.report('find_export_temp_bytes',
+                          (temp_bytes(self) - before) / 1048576.0, 'MB')
+
+    def bench_find_cursor_first_row(self):
+        start = time.time()
+        self.cur.execute(
+            "select bq_find_cursor('people', '{}', 0, null, null, 'c')")
+        self.cur.execute("fetch {} from c".format(BATCH_SIZE))
+        self.cur.fetchall()
+        benchutils.report('find_cursor_first_row',
+                          time.time() - start, 's')
+        self.conn.commit()
+
+    def bench_find_cursor_export(self):
+        before = temp_bytes(self)
+        self.cur.execute(
+            "select bq_find_cursor('people', '{}', 0, null, null, 'c')")
+        while True:
+            self.cur.execute("fetch {} from c".format(BATCH_SIZE))
+            if not self.cur.fetchall():
+                break
+        self.conn.commit()
+        benchutils.report('find_cursor_export_temp_bytes',
+                          (temp_bytes(self) - before) / 1048576.0, 'MB')
+
+
+if __name__ == '__main__':
+    FindCursorBenchmark().run()
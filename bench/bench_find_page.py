@@ -0,0 +1,45 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+PAGE_SIZE = 100
+DEEP_PAGE = DOC_COUNT // PAGE_SIZE - 1
+
+
+class FindPageBenchmark(benchutils.Benchmark):
+    """Fetch a deep page by OFFSET with bq_find, and by cursor with
+    bq_find_page, over a collection with an index on the sort key.
+    """
+
+    shared_setup = True
+    repeat = 5
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+        self._query("""
+        create index people_age on people ((bq_jdoc#>'{age}'), _id)
+        """)
+        # walk to the deep page once, to find its cursor
+        self.cursor = None
+        for _ in range(DEEP_PAGE):
+            rows = self._query("""
+            select bq_cursor from bq_find_page(
+                'people', '{}', '[{"age": 1}]', %s, %s)
+            offset %s
+            """, (self.cursor, PAGE_SIZE, PAGE_SIZE - 1))
+            self.cursor = rows[0][0]
+
+    def bench_deep_page_offset(self):
+        self._query("""
+        select bq_find('people', '{}', %s, %s, '[{"age": 1}]')
+        """, (DEEP_PAGE * PAGE_SIZE, PAGE_SIZE))
+
+    def bench_deep_page_cursor(self):
+        self._query("""
+        select bq_find_page('people', '{}', '[{"age": 1}]', %s, %s)
+        """, (self.cursor, PAGE_SIZE))
+
+
+if __name__ == '__main__':
+    FindPageBenchmark().run()
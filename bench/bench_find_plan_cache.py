@@ -0,0 +1,92 @@
+from __future__ import print_function
+import json
+import time
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(1000000)
+QUERY_COUNT = 2000
+SHAPE_COUNT = 5000
+
+
+def planning_time(bench, statement):
+    bench.cur.execute(
+        "explain (analyze, format json) {}".format(statement))
+    plan = bench.cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    bench.conn.rollback()
+    return plan[0]['Planning Time']
+
+
+class FindPlanCacheBenchmark(benchutils.Benchmark):
+    """Repeated @> lookups, planned every time versus through the
+    prepared statements that bq_find_one and bq_count keep per query shape.
+    Also lookups by _id in a session which has run queries of thousands of
+    other shapes, of which only the most recent are kept prepared.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+
+    def _queries(self):
+        return [benchutils.to_json({'name': 'user_{}'.format(i)})
+                for i in range(QUERY_COUNT)]
+
+    def bench_find_one_planned_every_call(self):
+        for q in self._queries():
+            self.cur.execute(
+                "select bq_jdoc::json from people "
+                "where bq_jdoc @> %s::jsonb limit 1", (q,))
+            self.cur.fetchall()
+        self.conn.commit()
+
+    def bench_find_one_prepared(self):
+        for q in self._queries():
+            self.cur.execute("select bq_find_one('people', %s)", (q,))
+            self.cur.fetchall()
+        self.conn.commit()
+
+    def bench_count_prepared(self):
+        for q in self._queries():
+            self.cur.execute("select bq_count('people', %s)", (q,))
+            self.cur.fetchall()
+        self.conn.commit()
+
+    def bench_find_one_by_id_after_many_shapes(self):
+        self._query("select bq_create_collection('shapes')")
+        for i in range(SHAPE_COUNT):
+            self.cur.execute("select bq_count('shapes', %s)", (
+                benchutils.to_json({'field_{}'.format(i): {'$exists': True}}),))
+        self.conn.commit()
+        start = time.time()
+        for i in range(QUERY_COUNT):
+            self.cur.execute("select bq_find_one_by_id('people', %s)",
+                             ('user_{}'.format(i),))
+            self.cur.fetchall()
+        self.conn.commit()
+        benchutils.report('find_one_by_id_per_call',
+                          (time.time() - start) * 1e6 / QUERY_COUNT, 'us')
+
+    def teardown(self):
+        q = '\'{"name": "user_7"}\''
+        self.cur.execute("select bq_find_one('people', {})".format(q))
+        self.cur.fetchall()
+        self.cur.execute(
+            "select name from pg_prepared_statements "
+            "where statement like '%LIMIT 1%' and name like 'bq_%'")
+        name = self.cur.fetchone()[0]
+        before = planning_time(
+            self, "select bq_jdoc::json from people "
+            "where bq_jdoc @> {}::jsonb limit 1".format(q))
+        after = planning_time(
+            self, 'execute "{}"({})'.format(name, q))
+        benchutils.report('planning_time_before', before, 'ms')
+        benchutils.report('planning_time_after', after, 'ms')
+        super(FindPlanCacheBenchmark, self).teardown()
+
+
+if __name__ == '__main__':
+    FindPlanCacheBenchmark().run()
@@ -0,0 +1,33 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+
+
+class GinOpclassBenchmark(benchutils.Benchmark):
+    """Insert throughput and GIN index size, for each choice of the
+    gin option to bq_create_collection.
+    """
+
+    def _load(self, options, label):
+        self._query("select bq_create_collection('people', %s)", (options,))
+        benchutils.load_docs(self, 'people', DOC_COUNT, batch_size=1000)
+        if '"gin": false' not in options:
+            benchutils.report(
+                label + '_index_size',
+                benchutils.relation_size_mb(self, 'idx_people_bq_jdoc'),
+                'MB')
+
+    def bench_insert_jsonb_ops(self):
+        self._load('{"gin": "jsonb_ops"}', 'jsonb_ops')
+
+    def bench_insert_jsonb_path_ops(self):
+        self._load('{"gin": "jsonb_path_ops"}', 'jsonb_path_ops')
+
+    def bench_insert_no_gin_index(self):
+        self._load('{"gin": false}', 'no_gin_index')
+
+
+if __name__ == '__main__':
+    GinOpclassBenchmark().run()
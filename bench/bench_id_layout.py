@@ -0,0 +1,39 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+
+
+class IdLayoutBenchmark(benchutils.Benchmark):
+    """Insert throughput and table plus index size, for the earlier
+    collection layout with a unique index on bq_jdoc->>'_id', and for the
+    current layout, which keeps _id in step with a check constraint.
+    """
+
+    def _load(self, label):
+        benchutils.load_docs(self, 'people', DOC_COUNT, batch_size=1000)
+        size = self._query("""
+        select pg_total_relation_size('people') / 1048576.0
+        """)[0][0]
+        benchutils.report(label + '_total_size', size, 'MB')
+
+    def bench_insert_earlier_layout(self):
+        self._query("select bq_create_collection('people')")
+        self.cur.execute("""
+        alter table people
+          drop constraint validate_id,
+          add constraint validate_id check ((bq_jdoc->>'_id') is not null);
+        create unique index idx_people_bq_jdoc_id
+          on people ((bq_jdoc->>'_id'));
+        """)
+        self.conn.commit()
+        self._load('earlier_layout')
+
+    def bench_insert_current_layout(self):
+        self._query("select bq_create_collection('people')")
+        self._load('current_layout')
+
+
+if __name__ == '__main__':
+    IdLayoutBenchmark().run()
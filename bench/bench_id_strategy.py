@@ -0,0 +1,52 @@
+from __future__ import print_function
+import time
+import benchutils
+
+
+# The benefit of time-ordered ids shows once the _id index no longer
+# fits in shared_buffers, so run this with enough documents for that,
+# or a small shared_buffers.
+DOC_COUNT = benchutils.doc_count(20000000)
+BATCH_SIZE = 10000
+WINDOWS = 5
+
+
+class IdStrategyBenchmark(benchutils.Benchmark):
+    """Sustained insert rate into a growing collection, with random ids
+    and with time-ordered ids. The rate is reported for each fifth of the
+    load, so any slow-down as the _id index grows shows in the later
+    windows.
+    """
+
+    def _load(self, strategy):
+        self._query("""
+        select bq_create_collection('people', %s)
+        """, (benchutils.to_json({'id': strategy, 'gin': False}),))
+        window = max(BATCH_SIZE, DOC_COUNT // WINDOWS)
+        for window_start in range(0, DOC_COUNT, window):
+            start = time.time()
+            window_end = min(window_start + window, DOC_COUNT)
+            for batch_start in range(window_start, window_end, BATCH_SIZE):
+                docs = [benchutils.make_doc(i) for i in
+                        range(batch_start,
+                              min(batch_start + BATCH_SIZE, window_end))]
+                self.cur.execute("select bq_insert_many('people', %s)",
+                                 (benchutils.to_json(docs),))
+                self.conn.commit()
+            benchutils.report(
+                '{}_rate_to_{}'.format(strategy, window_end),
+                (window_end - window_start) / (time.time() - start),
+                '/s')
+        benchutils.report('{}_pkey_size'.format(strategy),
+                          benchutils.relation_size_mb(self, 'people_pkey'),
+                          'MB')
+
+    def bench_insert_random_ids(self):
+        self._load('random')
+
+    def bench_insert_time_ids(self):
+        self._load('time')
+
+
+if __name__ == '__main__':
+    IdStrategyBenchmark().run()
@@ -0,0 +1,30 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = 10000
+BATCH_SIZE = 1000
+
+
+class InsertManyBenchmark(benchutils.Benchmark):
+    """Compare looping bq_insert against batched bq_insert_many."""
+
+    def bench_insert_loop(self):
+        for i in range(DOC_COUNT):
+            self.cur.execute(
+                "select bq_insert('things', %s)",
+                (benchutils.to_json(benchutils.make_doc(i)),))
+        self.conn.commit()
+
+    def bench_insert_many(self):
+        for start in range(0, DOC_COUNT, BATCH_SIZE):
+            docs = [benchutils.make_doc(i)
+                    for i in range(start, start + BATCH_SIZE)]
+            self.cur.execute(
+                "select bq_insert_many('things', %s)",
+                (benchutils.to_json(docs),))
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    InsertManyBenchmark().run()
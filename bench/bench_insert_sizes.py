@@ -0,0 +1,72 @@
+from __future__ import print_function
+import benchutils
+
+
+SIZES_KB = [1, 10, 100, 1024]
+TOTAL_KB = 32 * 1024
+
+
+# A document of roughly %(size)s KB, made of many small fields, which is
+# the worst case for exploding the document into its fields. Documents
+# are built on the server, so the timings leave out the client.
+DOC_SQL = """
+(select json_object_agg('field_' || f, repeat('v', 24))
+ from generate_series(1, %(size)s * 1024 / 40) as f)
+"""
+
+
+# The way bq_doc_set_key used to add an _id: explode the document with
+# json_each and reassemble it as text.
+REASSEMBLE_SQL = """
+select (select concat('{', string_agg(to_json("key") || ':' || "value", ','),
+                      '}')::json
+        from (select * from json_each(d.doc) where key <> '_id'
+              union all select '_id', to_json(bq_generate_id())) as fields)
+from {doc} as d(doc), generate_series(1, %(count)s)
+"""
+
+
+INSERT_SQL = """
+select bq_insert('things', d.doc)
+from {doc} as d(doc), generate_series(1, %(count)s)
+"""
+
+
+class InsertSizesBenchmark(benchutils.Benchmark):
+    """Inserting documents without an _id, from 1KB to 1MB, which is when
+    the _id gets added to the document on the server. Each size writes
+    the same total volume. The reassemble_* timings repeat the old
+    json_each based _id injection on its own, for comparison.
+    """
+
+    def _run(self, sql, size_kb):
+        params = {'size': size_kb, 'count': TOTAL_KB // size_kb}
+        self._query(sql.replace('{doc}', DOC_SQL), params)
+
+    def bench_insert_0001kb(self):
+        self._run(INSERT_SQL, 1)
+
+    def bench_insert_0010kb(self):
+        self._run(INSERT_SQL, 10)
+
+    def bench_insert_0100kb(self):
+        self._run(INSERT_SQL, 100)
+
+    def bench_insert_1024kb(self):
+        self._run(INSERT_SQL, 1024)
+
+    def bench_reassemble_0001kb(self):
+        self._run(REASSEMBLE_SQL, 1)
+
+    def bench_reassemble_0010kb(self):
+        self._run(REASSEMBLE_SQL, 10)
+
+    def bench_reassemble_0100kb(self):
+        self._run(REASSEMBLE_SQL, 100)
+
+    def bench_reassemble_1024kb(self):
+        self._run(REASSEMBLE_SQL, 1024)
+
+
+if __name__ == '__main__':
+    InsertSizesBenchmark().run()
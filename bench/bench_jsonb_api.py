@@ -0,0 +1,62 @@
+from __future__ import print_function
+import psycopg2.extras
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(100000)
+FIELD_COUNT = 100
+
+
+def wide_doc(i):
+    doc = benchutils.make_doc(i)
+    for f in range(FIELD_COUNT):
+        doc['field_{}'.format(f)] = {'value': i * f, 'label': 'x' * 20}
+    return doc
+
+
+class JsonbApiBenchmark(benchutils.Benchmark):
+    """Reading and writing wide documents through the json API, which
+    converts every document between jsonb and json text on the server,
+    versus through the _jsonb functions, which don't.
+    """
+
+    repeat = 3
+    shared_setup = True
+
+    def setup(self):
+        for start in range(0, DOC_COUNT, 1000):
+            docs = [wide_doc(i)
+                    for i in range(start, min(start + 1000, DOC_COUNT))]
+            self.cur.execute("select bq_insert_many('people', %s)",
+                             (benchutils.to_json(docs),))
+        self.conn.commit()
+        self.cur.execute("analyze people")
+        self.conn.commit()
+        self.docs = [benchutils.to_json(wide_doc(i)) for i in range(1000)]
+        # Leave documents as text on the client, to time the server side
+        psycopg2.extras.register_default_json(
+            self.conn, loads=lambda x: x)
+        psycopg2.extras.register_default_jsonb(
+            self.conn, loads=lambda x: x)
+
+    def bench_find_json(self):
+        self._query("select bq_find('people', '{}')")
+
+    def bench_find_jsonb(self):
+        self._query("select bq_find_jsonb('people', '{}')")
+
+    def bench_insert_json(self):
+        for doc in self.docs:
+            self.cur.execute("select bq_insert('writes_json', %s::json)",
+                             (doc,))
+        self.conn.commit()
+
+    def bench_insert_jsonb(self):
+        for doc in self.docs:
+            self.cur.execute("select bq_insert_jsonb('writes_jsonb', %s::jsonb)",
+                             (doc,))
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    JsonbApiBenchmark().run()
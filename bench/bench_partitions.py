@@ -0,0 +1,51 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(400000)
+MONTHS = ['2016-01-01', '2016-02-01', '2016-03-01', '2016-04-01', '2016-05-01']
+
+
+class PartitionBenchmark(benchutils.Benchmark):
+    """Expiring the oldest month of four months of events, with a DELETE
+    on a plain collection, versus dropping a partition of a collection
+    which is partitioned on the created timestamp.
+    """
+
+    def setup(self):
+        self._query("""
+        select bq_create_collection('events');
+        select bq_create_collection('partitioned_events',
+                                    '{"partition": {"range": "created"}}');
+        """)
+        for start, end in zip(MONTHS, MONTHS[1:]):
+            self._query("select bq_add_partition('partitioned_events', %s, %s)",
+                        (start, end))
+        for collection in ['events', 'partitioned_events']:
+            self.cur.execute("""
+            insert into {} (_id, bq_jdoc, created)
+            select id,
+                   jsonb_build_object('_id', id, 'n', i, 'padding', repeat('x', 200)),
+                   bq_time_id_timestamp(id)
+            from (select i, bq_generate_time_id(
+                    '2016-01-01'::timestamptz + i * (interval '120 days' / %s)) as id
+                  from generate_series(0, %s - 1) as i) d
+            """.format(collection), (DOC_COUNT, DOC_COUNT))
+            self.conn.commit()
+            self.cur.execute("analyze {}".format(collection))
+            self.conn.commit()
+
+    def bench_delete_old_documents(self):
+        self._query("delete from events where created < '2016-02-01'")
+        self.conn.autocommit = True
+        self.cur.execute("vacuum events")
+        self.conn.autocommit = False
+
+    def bench_drop_old_partition(self):
+        self._query("""
+        select bq_drop_partitions_before('partitioned_events', '2016-02-01')
+        """)
+
+
+if __name__ == '__main__':
+    PartitionBenchmark().run()
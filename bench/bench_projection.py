@@ -0,0 +1,43 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(20000)
+PADDING = 200 * 1024
+PROJECTION = '{"name": 1, "city": 1}'
+
+
+class ProjectionBenchmark(benchutils.Benchmark):
+    """Listing two fields of large documents, by fetching whole documents
+    versus with a projection, which builds the slim documents on the
+    server. Also reports the bytes sent for each.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT,
+                             batch_size=100, padding=PADDING)
+        whole, projected = self._query("""
+        select sum(octet_length(d::text)),
+               sum(octet_length(bq_project(d::jsonb, %s)::text))
+        from bq_find('people', '{}') as d
+        """, (PROJECTION,))[0]
+        benchutils.report('whole_documents_size', whole / 1048576.0, 'MB')
+        benchutils.report('projected_size', projected / 1048576.0, 'MB')
+
+    def bench_find_whole_documents(self):
+        self.cur.execute("select bq_find('people', '{}')")
+        self.cur.fetchall()
+        self.conn.commit()
+
+    def bench_find_with_projection(self):
+        self.cur.execute("""
+        select bq_find('people', '{}', 0, null, null, %s)
+        """, (PROJECTION,))
+        self.cur.fetchall()
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    ProjectionBenchmark().run()
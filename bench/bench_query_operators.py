@@ -0,0 +1,47 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(1000000)
+QUERY_COUNT = 20
+
+
+class QueryOperatorsBenchmark(benchutils.Benchmark):
+    """A range query on an indexed field, run through bq_find with an
+    operator clause, versus fetching every document and filtering on the
+    client, which was the only option before query operators.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+        self._query("select bq_add_index('people', '{\"age\": 1}')")
+        self._query("analyze people")
+
+    def bench_range_filtered_on_client(self):
+        for i in range(QUERY_COUNT):
+            self.cur.execute("select bq_find('people', '{}')")
+            docs = [row[0] for row in self.cur.fetchall()
+                    if row[0]['age'] >= 88]
+        self.conn.commit()
+
+    def bench_range_operator(self):
+        for i in range(QUERY_COUNT):
+            self.cur.execute(
+                "select bq_find('people', %s)",
+                (benchutils.to_json({'age': {'$gte': 88}}),))
+            docs = self.cur.fetchall()
+        self.conn.commit()
+
+    def bench_in_operator(self):
+        for i in range(QUERY_COUNT):
+            self.cur.execute(
+                "select bq_find('people', %s)",
+                (benchutils.to_json({'age': {'$in': [3, 30, 60]}}),))
+            docs = self.cur.fetchall()
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    QueryOperatorsBenchmark().run()
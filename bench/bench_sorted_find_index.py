@@ -0,0 +1,37 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(5000000)
+SORT = '[{"city": 1}, {"age": -1}]'
+
+
+class SortedFindIndexBenchmark(benchutils.Benchmark):
+    """A sorted, limited find, before and after bq_add_index adds an
+    index matching the sort.
+    """
+
+    shared_setup = True
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT)
+
+    def _sorted_find(self):
+        self._query("""
+        select bq_find('people', '{}', 0, 20, %s)
+        """, (SORT,))
+
+    def bench_1_sorted_find_without_index(self):
+        self._sorted_find()
+
+    def bench_2_add_index(self):
+        self._query("""
+        select bq_add_index('people', '{"city": 1, "age": -1}')
+        """)
+
+    def bench_3_sorted_find_with_index(self):
+        self._sorted_find()
+
+
+if __name__ == '__main__':
+    SortedFindIndexBenchmark().run()
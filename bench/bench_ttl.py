@@ -0,0 +1,61 @@
+from __future__ import print_function
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(200000)
+BATCH_SIZE = 5000
+
+
+class TtlBenchmark(benchutils.Benchmark):
+    """Expiring the older half of a collection, with one DELETE of every
+    expired document, versus with bq_purge_expired called until nothing is
+    left to purge. Reports the largest amount of WAL written by a single
+    transaction in each case.
+    """
+
+    def setup(self):
+        self._query("""
+        select bq_create_collection('events', '{"ttl": {"seconds": 86400}}')
+        """)
+        benchutils.load_docs(self, 'events', DOC_COUNT, padding=200)
+        self._query("""
+        update events set created = current_timestamp - interval '2 days'
+        where _id < '8'
+        """)
+        self.conn.autocommit = True
+        self.cur.execute("vacuum analyze events")
+        self.conn.autocommit = False
+
+    def _wal_lsn(self):
+        return self._query("select pg_current_wal_lsn()")[0][0]
+
+    def _wal_written(self, start, end):
+        return self._query("select pg_wal_lsn_diff(%s, %s)",
+                           (end, start))[0][0]
+
+    def _report_wal(self, label, written):
+        benchutils.report(label + '_max_wal_per_transaction',
+                          float(written) / 1048576, 'MB')
+
+    def bench_delete_expired(self):
+        start = self._wal_lsn()
+        self._query("""
+        delete from events
+        where created <= current_timestamp - interval '1 day'
+        """)
+        self._report_wal('delete', self._wal_written(start, self._wal_lsn()))
+
+    def bench_purge_expired(self):
+        largest = 0
+        while True:
+            start = self._wal_lsn()
+            purged = self._query("select bq_purge_expired('events', %s)",
+                                 (BATCH_SIZE,))[0][0]
+            largest = max(largest, self._wal_written(start, self._wal_lsn()))
+            if purged < BATCH_SIZE:
+                break
+        self._report_wal('purge', largest)
+
+
+if __name__ == '__main__':
+    TtlBenchmark().run()
@@ -0,0 +1,65 @@
+from __future__ import print_function
+import threading
+import benchutils
+
+
+DOC_COUNT = benchutils.doc_count(10000)
+CLIENTS = 4
+INCREMENTS = 500
+
+
+class UpdateBenchmark(benchutils.Benchmark):
+    """Several clients incrementing a counter on one hot document, with a
+    read-modify-write through bq_find_one_by_id and bq_save, versus with
+    $inc through bq_update. Reports how many increments were lost to
+    races in each case.
+    """
+
+    def setup(self):
+        benchutils.load_docs(self, 'people', DOC_COUNT, padding=10000)
+        self._query("select bq_save('people', %s)",
+                    (benchutils.to_json({'_id': 'hot', 'count': 0}),))
+
+    def _run_clients(self, increment):
+        def client():
+            conn = benchutils.get_pg_connection()
+            cur = conn.cursor()
+            for _ in range(INCREMENTS):
+                increment(cur)
+                conn.commit()
+            conn.close()
+        threads = [threading.Thread(target=client) for _ in range(CLIENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _report_lost(self, label):
+        count = self._query("""
+        select bq_jdoc->>'count' from people where _id = 'hot'
+        """)[0][0]
+        benchutils.report(label + '_lost_increments',
+                          CLIENTS * INCREMENTS - int(count), '')
+
+    def bench_read_modify_write(self):
+        def increment(cur):
+            cur.execute("select bq_find_one_by_id('people', 'hot')")
+            doc = cur.fetchone()[0]
+            doc['count'] += 1
+            cur.execute("select bq_save('people', %s)",
+                        (benchutils.to_json(doc),))
+        self._run_clients(increment)
+        self._report_lost('read_modify_write')
+
+    def bench_update_inc(self):
+        def increment(cur):
+            cur.execute("""
+            select bq_update('people', '{"_id": "hot"}',
+                             '{"$inc": {"count": 1}}')
+            """)
+        self._run_clients(increment)
+        self._report_lost('update_inc')
+
+
+if __name__ == '__main__':
+    UpdateBenchmark().run()
@@ -0,0 +1,119 @@
+from __future__ import print_function
+import psycopg2
+import os
+import getpass
+import json
+import time
+
+
+# Benchmarks run against the same `bedquilt_test` database as the tests,
+# unless BEDQUILT_BENCH_DB is set.
+
+
+def get_pg_connection():
+    return psycopg2.connect(
+        database=os.environ.get('BEDQUILT_BENCH_DB', 'bedquilt_test'),
+        user=getpass.getuser()
+    )
+
+
+def clean_database(conn):
+    cur = conn.cursor()
+    cur.execute("select bq_list_collections();")
+    result = cur.fetchall()
+    if result is not None:
+        for collection in result:
+            cur.execute(
+                "select bq_delete_collection('{}')".format(collection[0]))
+    conn.commit()
+
+
+class Benchmark(object):
+    """Base class for benchmarks.
+    Subclasses implement `setup` and any number of `bench_*` methods,
+    each of which is timed and reported by `run`.
+    With `shared_setup`, the database is set up once for all methods,
+    which suits read benchmarks over large collections.
+    """
+
+    repeat = 1
+    shared_setup = False
+
+    def __init__(self):
+        self.conn = get_pg_connection()
+        self.cur = self.conn.cursor()
+
+    def _query(self, query, params=None):
+        self.cur.execute(query, params)
+        self.conn.commit()
+        if self.cur.description is None:
+            return None
+        return self.cur.fetchall()
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        clean_database(self.conn)
+
+    def run(self):
+        print('>> {}'.format(self.__class__.__name__))
+        names = sorted(n for n in dir(self) if n.startswith('bench_'))
+        if self.shared_setup:
+            clean_database(self.conn)
+            self.setup()
+        for name in names:
+            if not self.shared_setup:
+                clean_database(self.conn)
+                self.setup()
+            timings = []
+            for _ in range(self.repeat):
+                start = time.time()
+                getattr(self, name)()
+                timings.append(time.time() - start)
+            print('   {:<40} {:>10.3f}s'.format(name, min(timings)))
+        self.teardown()
+        self.conn.close()
+
+
+def report(name, value, unit):
+    """Report a measurement other than a timing, alongside the timings."""
+    print('   {:<40} {:>10.3f}{}'.format(name, value, unit))
+
+
+def relation_size_mb(bench, relation):
+    return bench._query(
+        "select pg_relation_size(%s) / 1048576.0", (relation,))[0][0]
+
+
+def doc_count(default):
+    """Number of documents to use, overridable with BEDQUILT_BENCH_DOCS."""
+    return int(os.environ.get('BEDQUILT_BENCH_DOCS', default))
+
+
+def load_docs(bench, collection, count, batch_size=10000, padding=0):
+    for start in range(0, count, batch_size):
+        docs = [make_doc(i, padding)
+                for i in range(start, min(start + batch_size, count))]
+        bench.cur.execute(
+            "select bq_insert_many(%s, %s)",
+            (collection, to_json(docs)))
+    bench.conn.commit()
+    bench.cur.execute("analyze {}".format(collection))
+    bench.conn.commit()
+
+
+def make_doc(i, padding=0):
+    doc = {
+        'name': 'user_{}'.format(i),
+        'age': i % 90,
+        'city': ['Glasgow', 'Edinburgh', 'Manchester', 'Dublin'][i % 4],
+        'likes': ['code', 'cats', 'crochet'][:(i % 3) + 1]
+    }
+    if padding:
+        doc['padding'] = 'x' * padding
+    return doc
+
+
+def to_json(value):
+    return json.dumps(value)
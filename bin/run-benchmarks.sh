@@ -0,0 +1,20 @@
+#! /usr/bin/env sh
+
+echo ">> Enabling bedquilt on localhost/bedquilt_test..."
+psql -d bedquilt_test \
+     -c "create extension if not exists pgcrypto;
+         drop extension if exists bedquilt;
+         create extension bedquilt;"
+if [ $? -ne 0 ]
+then
+  echo ">> Error while installing bedquilt, exiting..."
+  exit 1
+fi
+
+
+echo ">> Running benchmarks..."
+cd bench
+for bench_file in bench_*.py
+do
+  python $bench_file
+done
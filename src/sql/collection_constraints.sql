@@ -15,224 +15,402 @@
  * - {$type: '<type>'} : if the field is present and has a non-null value,
  *       then the type of that value must match the specified type.
  *       Valid types are "string", "number", "object", "array", "boolean".
+ * The constraints of a collection are kept together, in the collection
+ * registry, and enforced by a single check constraint, which reads each
+ * field of a document once, however many constraints it has. Adding
+ * constraints checks the existing documents against them in one pass,
+ * during which reads and writes of the collection are blocked.
+ * With i_online true, the constraints are added without checking the
+ * existing documents, so the collection is only locked for a moment, and
+ * apply to documents written from then on. The existing documents are
+ * then checked in batches by bq_validate_constraints, and the constraints
+ * are listed as 'validating' by bq_list_constraints(i_coll, true) until
+ * it has checked all of them.
  * Returns a boolean indicating whether any of the constraints newly applied.
  */
-CREATE OR REPLACE FUNCTION bq_add_constraints(i_coll text, i_jdoc json)
+CREATE OR REPLACE FUNCTION bq_add_constraints(i_coll text, i_jdoc json, i_online boolean DEFAULT false)
 RETURNS boolean AS $$
 DECLARE
-  jdoc_keys RECORD;
-  field_name text;
-  spec json;
-  spec_keys RECORD;
+  field RECORD;
   op text;
-  new_constraint_name text;
   s_type text;
-  result boolean;
+  field_spec jsonb;
+  current_spec jsonb;
+  new_spec jsonb;
 BEGIN
-  result := false;
+  PERFORM bq_create_collection(i_coll);
+  current_spec := bq_collection_constraints(i_coll);
+  new_spec := current_spec;
   -- loop over the field names
-  FOR jdoc_keys IN SELECT * FROM json_object_keys(i_jdoc) LOOP
-    field_name := jdoc_keys.json_object_keys;
-    spec := i_jdoc->field_name;
+  FOR field IN SELECT key, value FROM json_each(i_jdoc) LOOP
+    IF json_typeof(field.value) <> 'object'
+    THEN
+      RAISE EXCEPTION 'Invalid constraint spec for field "%"', field.key
+      USING HINT = 'A constraint spec should be an object, like {"$required": true}';
+    END IF;
+    field_spec := coalesce(new_spec->field.key, '{}');
 
-    -- for each field name, loop over the constrant ops
-    FOR spec_keys IN SELECT * FROM json_object_keys(spec) LOOP
-      op := spec_keys.json_object_keys;
+    -- for each field name, loop over the constraint ops
+    FOR op IN SELECT * FROM json_object_keys(field.value) LOOP
       CASE op
       -- $required : the key must be present in the json object
-      WHEN '$required' THEN
-        new_constraint_name := format(
-          'bqcn:%s:required',
-          field_name);
-        PERFORM bq_create_collection(i_coll);
-        IF bq_constraint_name_exists(i_coll, new_constraint_name) = false
-        THEN
-          IF field_name LIKE '%.%' THEN
-            EXECUTE format(
-              'alter table %I
-              add constraint "%s"
-              check (bq_path_exists(''%s'', bq_jdoc));',
-              i_coll,
-              new_constraint_name,
-              field_name);
-            result := true;
-          ELSE
-            EXECUTE format(
-              'alter table %I
-              add constraint "%s"
-              check (bq_jdoc ? ''%s'');',
-              i_coll,
-              new_constraint_name,
-              field_name);
-            result := true;
-          END IF;
-        END IF;
-      -- $notnull : the key must be present in the json object
-      WHEN '$notnull' THEN
-        new_constraint_name := format(
-          'bqcn:%s:notnull',
-          field_name);
-        PERFORM bq_create_collection(i_coll);
-        IF bq_constraint_name_exists(i_coll, new_constraint_name) = false
-        THEN
-          EXECUTE format(
-            'alter table %I
-            add constraint "%s"
-            check (
-              jsonb_typeof((bq_jdoc#>''%s'')::jsonb) <> ''null''
-            );',
-            i_coll,
-            new_constraint_name,
-            regexp_split_to_array(field_name, '\.'));
-          result := true;
-        END IF;
+      -- $notnull : if the key is present, its value must not be null
+      WHEN '$required', '$notnull' THEN
+        field_spec := field_spec || jsonb_build_object(op, true);
       -- $type: enforce type of the specified field
       --   valid values are:
       --   'string' | 'number' | 'object' | 'array' | 'boolean'
       WHEN '$type' THEN
-        s_type := spec->>op;
-        new_constraint_name := format(
-          'bqcn:%s:type:%s',
-          field_name, s_type);
-        PERFORM bq_create_collection(i_coll);
-        IF bq_constraint_name_exists(i_coll, new_constraint_name) = false
+        s_type := field.value->>op;
+        IF s_type IS NULL
+           OR s_type NOT IN ('string','object','array','boolean','number')
         THEN
-          IF s_type NOT IN ('string','object','array','boolean','number')
-          THEN
-            RAISE EXCEPTION
-            'Invalid $type ("%") specified for field "%"',
-            s_type, field_name
-            USING HINT = 'Please specify the name of a json type';
-          END IF;
-          -- check if we've got a type constraint already
-          IF EXISTS(
-            SELECT constraint_name
-            FROM information_schema.constraint_column_usage
-            WHERE table_name = i_coll
-            AND constraint_name LIKE 'bqcn:'
-            || field_name
-            ||':type:%')
-          THEN
-            RAISE EXCEPTION
-            'Contradictory $type "%" constraint on field "%"',
-            s_type, field_name
-            USING HINT = 'Please remove existing $type constraint';
-          END IF;
-          EXECUTE format(
-            'alter table %I
-            add constraint "%s"
-            check (
-              jsonb_typeof(bq_jdoc#>''%s'') in (''%s'', ''null'')
-            );',
-            i_coll,
-            new_constraint_name,
-            regexp_split_to_array(field_name, '\.'),
-            s_type);
-          result := true;
+          RAISE EXCEPTION
+          'Invalid $type ("%") specified for field "%"',
+          s_type, field.key
+          USING HINT = 'Please specify the name of a json type';
         END IF;
+        -- check if we've got a type constraint already
+        IF field_spec->>'$type' <> s_type
+        THEN
+          RAISE EXCEPTION
+          'Contradictory $type "%" constraint on field "%"',
+          s_type, field.key
+          USING HINT = 'Please remove existing $type constraint';
+        END IF;
+        field_spec := field_spec || jsonb_build_object(op, s_type);
+      ELSE
+        RAISE EXCEPTION 'Invalid constraint "%" on field "%"', op, field.key
+        USING HINT = 'Valid constraints are $required, $notnull and $type';
       END CASE;
-
     END LOOP;
 
+    IF field_spec <> '{}'
+    THEN
+      new_spec := new_spec || jsonb_build_object(field.key, field_spec);
+    END IF;
   END LOOP;
 
-  RETURN result;
+  IF new_spec = current_spec
+  THEN
+    RETURN false;
+  END IF;
+  PERFORM bq_apply_constraints(i_coll, new_spec, i_online);
+  RETURN true;
 END
 $$ LANGUAGE plpgsql;
 
 
-/* private - check if a constraint name exists
+/* Check the existing documents of a collection against constraints which
+ * were added with i_online true.
+ * Each call checks the next batch of up to i_batch_size documents, in _id
+ * order, and records how far it got, so that the documents can be checked
+ * in a series of short transactions, none of which blocks writes to the
+ * collection. Call it until it returns 0, at which point the constraints
+ * are valid. The call which checks the last batch also marks the check
+ * constraint as validated, which scans the collection once more but
+ * still does not block writes.
+ * If a document does not meet the constraints, an exception is raised
+ * which names it. Fix or remove the document and call this again to carry
+ * on from where it stopped, or remove the constraints.
+ * Returns the number of documents checked.
+ */
+CREATE OR REPLACE FUNCTION bq_validate_constraints(i_coll text, i_batch_size integer DEFAULT 10000)
+RETURNS integer AS $$
+DECLARE
+  validation jsonb;
+  last_id text;
+  checked integer;
+  invalid_id text;
+BEGIN
+  validation := bq_collection_constraints_validation(i_coll);
+  IF validation IS NULL
+  THEN
+    RETURN 0;
+  END IF;
+  EXECUTE format(
+    'WITH batch AS
+       (SELECT _id, bq_jdoc FROM %I
+        WHERE _id > coalesce($1, %L)
+        ORDER BY _id
+        LIMIT $2)
+     SELECT max(_id), count(*)::integer,
+            min(_id) FILTER (WHERE (%s) IS FALSE)
+     FROM batch',
+    i_coll, '', bq_constraints_to_text(validation->'pending'))
+  INTO last_id, checked, invalid_id
+  USING validation->>'after', i_batch_size;
+  IF invalid_id IS NOT NULL
+  THEN
+    RAISE EXCEPTION 'Document "%" does not meet the constraints of collection "%"',
+      invalid_id, i_coll
+    USING HINT = 'Fix or remove the document, or remove the constraints',
+          ERRCODE = 'check_violation';
+  END IF;
+  IF checked < i_batch_size AND bq_constraint_name_exists(i_coll, 'bq_constraints')
+  THEN
+    EXECUTE format('ALTER TABLE %I VALIDATE CONSTRAINT bq_constraints', i_coll);
+  END IF;
+  UPDATE bq_collections
+  SET options = CASE
+    WHEN checked < i_batch_size THEN options - 'constraints_validation'
+    ELSE options || jsonb_build_object(
+      'constraints_validation', validation || jsonb_build_object(
+        'after', last_id,
+        'checked', (validation->>'checked')::bigint + checked))
+    END
+  WHERE schema_name = current_schema()
+  AND collection_name = i_coll;
+  RETURN checked;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* private - check if a constraint name exists on a collection in the
+ * current schema. Reads pg_constraint directly, rather than through
+ * information_schema, whose views are slow on databases with many tables.
  */
 CREATE OR REPLACE FUNCTION bq_constraint_name_exists(i_coll text, i_name text)
 RETURNS boolean AS $$
 BEGIN
   RETURN EXISTS(
-    SELECT * FROM information_schema.constraint_column_usage
-    WHERE table_name = i_coll
-    AND constraint_name = i_name
+    SELECT 1 FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = current_schema()
+    AND t.relname = i_coll
+    AND c.conname = i_name
   );
 END
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE plpgsql STABLE;
+
+
+/* private - get the constraint spec of a collection.
+ * The spec is a json object in the form {field: constraint_spec}, as
+ * for bq_add_constraints, where each constraint_spec holds $required and
+ * $notnull as true, and $type as the name of a type.
+ * The spec is kept both in the registry and as the comment on the check
+ * constraint, so that it survives the registry being rebuilt, as when the
+ * extension is dropped and created again. When the registry has lost it,
+ * the comment is used, and when the two disagree, an exception is raised
+ * rather than guessing which one describes the check.
+ */
+CREATE OR REPLACE FUNCTION bq_collection_constraints(i_coll text)
+RETURNS jsonb AS $$
+DECLARE
+  registry_spec jsonb;
+  has_check boolean;
+  table_spec jsonb;
+BEGIN
+  SELECT options->'constraints' INTO registry_spec
+  FROM bq_collections
+  WHERE schema_name = current_schema()
+  AND collection_name = i_coll;
+  SELECT true, obj_description(c.oid, 'pg_constraint')::jsonb
+  INTO has_check, table_spec
+  FROM pg_constraint c
+  JOIN pg_class t ON t.oid = c.conrelid
+  JOIN pg_namespace n ON n.oid = t.relnamespace
+  WHERE n.nspname = current_schema()
+  AND t.relname = i_coll
+  AND c.conname = 'bq_constraints';
+  IF has_check AND table_spec IS NULL AND registry_spec IS NULL
+  THEN
+    RAISE EXCEPTION 'Constraints of collection "%" are unknown', i_coll
+    USING HINT = 'The bq_constraints check has no spec in its comment or in the registry; drop the check and add the constraints again';
+  END IF;
+  IF (has_check IS NULL AND registry_spec IS NOT NULL)
+  OR (table_spec IS NOT NULL AND registry_spec IS NOT NULL
+      AND table_spec <> registry_spec)
+  THEN
+    RAISE EXCEPTION 'Constraints of collection "%" differ between the registry and the table', i_coll
+    USING HINT = 'Compare options->''constraints'' in bq_collections with the comment on the bq_constraints check';
+  END IF;
+  RETURN coalesce(table_spec, registry_spec, '{}');
+END
+$$ LANGUAGE plpgsql STABLE;
+
+
+/* private - get the state of checking the existing documents of a
+ * collection against constraints added with i_online true, from the
+ * registry, or null if there is nothing left to check. This is a json
+ * object holding the spec of the constraints still to be checked, as
+ * "pending", the number of documents checked so far, as "checked", and
+ * the _id of the last of them, as "after".
+ */
+CREATE OR REPLACE FUNCTION bq_collection_constraints_validation(i_coll text)
+RETURNS jsonb AS $$
+BEGIN
+  RETURN (SELECT options->'constraints_validation' FROM bq_collections
+          WHERE schema_name = current_schema()
+          AND collection_name = i_coll);
+END
+$$ LANGUAGE plpgsql STABLE;
+
+
+/* private - compile a constraint spec into the expression of a check
+ * constraint. Each field is read from the document once, and its
+ * constraints are tested together on the json type of its value, which
+ * is null when the field is missing.
+ */
+CREATE OR REPLACE FUNCTION bq_constraints_to_text(i_spec jsonb)
+RETURNS text AS $$
+DECLARE
+  field RECORD;
+  field_text text;
+  type_text text;
+  predicates text[] = '{}';
+BEGIN
+  FOR field IN SELECT key, value FROM jsonb_each(i_spec) ORDER BY key LOOP
+    field_text := format('(bq_jdoc#>%L)', regexp_split_to_array(field.key, '\.'));
+    IF field.value ? '$type'
+    THEN
+      type_text := format(
+        'jsonb_typeof%s IN (%L%s)',
+        field_text, field.value->>'$type',
+        CASE WHEN field.value ? '$notnull' THEN '' ELSE ', ''null''' END);
+    ELSIF field.value ? '$notnull'
+    THEN
+      type_text := format('jsonb_typeof%s <> ''null''', field_text);
+    ELSE
+      type_text := null;
+    END IF;
+    predicates := predicates || CASE
+      WHEN type_text IS NULL THEN format('%s IS NOT NULL', field_text)
+      ELSE format('coalesce(%s, %s)', type_text,
+                  CASE WHEN field.value ? '$required' THEN 'false' ELSE 'true' END)
+    END;
+  END LOOP;
+  RETURN array_to_string(predicates, ' AND ');
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - replace the check constraint of a collection with one for
+ * the supplied constraint spec, in a single ALTER TABLE, and keep the
+ * spec in the registry and as the comment on the check.
+ * With i_online true, the check is added as NOT VALID, and the constraints
+ * which are new to the spec are recorded as pending, for
+ * bq_validate_constraints to check against the existing documents, along
+ * with any that were already pending. Otherwise the check is validated as
+ * it is added, and nothing is left pending.
+ */
+CREATE OR REPLACE FUNCTION bq_apply_constraints(i_coll text, i_spec jsonb, i_online boolean DEFAULT false)
+RETURNS void AS $$
+DECLARE
+  alterations text[] = '{}';
+  current_spec jsonb;
+  field RECORD;
+  new_ops jsonb;
+  pending jsonb;
+  validation jsonb;
+BEGIN
+  IF i_online
+  THEN
+    current_spec := bq_collection_constraints(i_coll);
+    validation := coalesce(
+      bq_collection_constraints_validation(i_coll),
+      '{"pending": {}, "checked": 0}');
+    pending := '{}';
+    FOR field IN SELECT key, value FROM jsonb_each(i_spec) LOOP
+      -- constraints still pending, and those new to the spec
+      SELECT jsonb_object_agg(o.key, o.value) INTO new_ops
+      FROM jsonb_each(field.value) AS o
+      WHERE current_spec->field.key->o.key IS DISTINCT FROM o.value
+      OR validation->'pending'->field.key->o.key = o.value;
+      IF new_ops IS NOT NULL
+      THEN
+        pending := pending || jsonb_build_object(field.key, new_ops);
+      END IF;
+    END LOOP;
+    IF pending = '{}'
+    THEN
+      validation := null;
+    ELSIF NOT current_spec @> i_spec
+    THEN
+      -- the documents checked so far weren't checked for the new constraints
+      validation := jsonb_build_object('pending', pending, 'checked', 0);
+    ELSE
+      validation := validation || jsonb_build_object('pending', pending);
+    END IF;
+  END IF;
+  IF bq_constraint_name_exists(i_coll, 'bq_constraints')
+  THEN
+    alterations := alterations || 'DROP CONSTRAINT bq_constraints'::text;
+  END IF;
+  IF i_spec <> '{}'
+  THEN
+    alterations := alterations || format(
+      'ADD CONSTRAINT bq_constraints CHECK (%s)%s', bq_constraints_to_text(i_spec),
+      CASE WHEN i_online THEN ' NOT VALID' ELSE '' END);
+  END IF;
+  IF alterations <> '{}'
+  THEN
+    EXECUTE format('ALTER TABLE %I %s', i_coll, array_to_string(alterations, ', '));
+  END IF;
+  IF i_spec <> '{}'
+  THEN
+    EXECUTE format('COMMENT ON CONSTRAINT bq_constraints ON %I IS %L', i_coll, i_spec);
+  END IF;
+  UPDATE bq_collections
+  SET options = options - 'constraints' - 'constraints_validation'
+    || CASE WHEN i_spec = '{}' THEN '{}'
+            ELSE jsonb_build_object('constraints', i_spec) END
+    || CASE WHEN validation IS NULL THEN '{}'
+            ELSE jsonb_build_object('constraints_validation', validation) END
+  WHERE schema_name = current_schema()
+  AND collection_name = i_coll;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
 
 
 /* Remove constraints from collection.
  * The supplied json document should match the spec for existing constraints.
+ * The remaining constraints are applied in a single ALTER TABLE, without
+ * checking the documents in the collection again.
  * Returns True if any of the constraints were removed, False otherwise.
  */
 CREATE OR REPLACE FUNCTION bq_remove_constraints(i_coll text, i_jdoc json)
 RETURNS boolean AS $$
 DECLARE
-  jdoc_keys RECORD;
-  field_name text;
-  spec json;
-  spec_keys RECORD;
+  field RECORD;
   op text;
-  target_constraint text;
-  s_type text;
-  result boolean;
+  field_spec jsonb;
+  current_spec jsonb;
+  new_spec jsonb;
 BEGIN
-
-  result := false;
+  current_spec := bq_collection_constraints(i_coll);
+  new_spec := current_spec;
   -- loop over the field names
-  FOR jdoc_keys IN SELECT * FROM json_object_keys(i_jdoc) LOOP
-    field_name := jdoc_keys.json_object_keys;
-    spec := i_jdoc->field_name;
-
-    -- for each field name, loop over the constrant ops
-    FOR spec_keys IN SELECT * FROM json_object_keys(spec) LOOP
-      op := spec_keys.json_object_keys;
-      CASE op
-      WHEN '$required' THEN
-        target_constraint := format(
-          'bqcn:%s:required',
-          field_name);
-        IF bq_constraint_name_exists(i_coll, target_constraint)
-        THEN
-          EXECUTE format(
-            'alter table %I
-            drop constraint "%s";',
-            i_coll,
-            target_constraint
-          );
-          result := true;
-        END IF;
-
-      WHEN '$notnull' THEN
-        target_constraint := format(
-          'bqcn:%s:notnull',
-          field_name);
-        IF bq_constraint_name_exists(i_coll, target_constraint)
-        THEN
-          EXECUTE format(
-            'alter table %I
-            drop constraint "%s";',
-            i_coll,
-            target_constraint
-          );
-          result := true;
-        END IF;
-
-      WHEN '$type' THEN
-        s_type := spec->>op;
-        target_constraint := format(
-          'bqcn:%s:type:%s',
-          field_name, s_type);
-        IF bq_constraint_name_exists(i_coll, target_constraint)
-        THEN
-          EXECUTE format(
-            'alter table %I
-            drop constraint "%s";',
-            i_coll,
-            target_constraint
-          );
-          result := true;
-        END IF;
-      END CASE;
+  FOR field IN SELECT key, value FROM json_each(i_jdoc) LOOP
+    field_spec := new_spec->field.key;
+    CONTINUE WHEN field_spec IS NULL OR json_typeof(field.value) <> 'object';
 
+    -- for each field name, loop over the constraint ops
+    FOR op IN SELECT * FROM json_object_keys(field.value) LOOP
+      IF op <> '$type' OR field_spec->>op = field.value->>op
+      THEN
+        field_spec := field_spec - op;
+      END IF;
     END LOOP;
+
+    IF field_spec = '{}'
+    THEN
+      new_spec := new_spec - field.key;
+    ELSE
+      new_spec := new_spec || jsonb_build_object(field.key, field_spec);
+    END IF;
   END LOOP;
 
-  RETURN result;
+  IF new_spec = current_spec
+  THEN
+    RETURN false;
+  END IF;
+  -- the remaining constraints were already enforced by the check being
+  -- replaced, so the documents aren't checked again. Any which are still
+  -- pending stay that way, for bq_validate_constraints
+  PERFORM bq_apply_constraints(i_coll, new_spec, true);
+  RETURN true;
 END
 $$ LANGUAGE plpgsql;
 
@@ -242,11 +420,47 @@ $$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION bq_list_constraints(i_coll text)
 RETURNS setof text AS $$
 BEGIN
-RETURN QUERY SELECT
-  substring(constraint_name from 6)::text
-  FROM information_schema.constraint_column_usage
-  WHERE table_name = i_coll
-  AND constraint_name LIKE 'bqcn:%'
+RETURN QUERY SELECT d.description
+  FROM jsonb_each(bq_collection_constraints(i_coll)) AS f,
+  LATERAL (VALUES
+    (CASE WHEN f.value ? '$required' THEN f.key || ':required' END),
+    (CASE WHEN f.value ? '$notnull' THEN f.key || ':notnull' END),
+    (CASE WHEN f.value ? '$type' THEN f.key || ':type:' || (f.value->>'$type') END)
+  ) AS d(description)
+  WHERE d.description IS NOT NULL
+  order by 1;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* Get a list of text descriptions of constraints on this collection, with
+ * their status if i_with_status is true: 'valid', or 'validating' for
+ * constraints added with i_online true, until bq_validate_constraints has
+ * checked all of the existing documents against them. For those,
+ * documents_checked is the number of documents checked so far.
+ * With i_with_status false, status and documents_checked are null.
+ */
+CREATE OR REPLACE FUNCTION bq_list_constraints(i_coll text, i_with_status boolean)
+RETURNS table(constraint_description text, status text, documents_checked bigint) AS $$
+DECLARE
+  validation jsonb;
+BEGIN
+IF i_with_status
+THEN
+  validation := bq_collection_constraints_validation(i_coll);
+END IF;
+RETURN QUERY SELECT d.description,
+  CASE WHEN NOT i_with_status THEN null
+       WHEN v.pending THEN 'validating' ELSE 'valid' END,
+  CASE WHEN v.pending THEN (validation->>'checked')::bigint END
+  FROM jsonb_each(bq_collection_constraints(i_coll)) AS f,
+  LATERAL (VALUES
+    (CASE WHEN f.value ? '$required' THEN f.key || ':required' END, '$required'),
+    (CASE WHEN f.value ? '$notnull' THEN f.key || ':notnull' END, '$notnull'),
+    (CASE WHEN f.value ? '$type' THEN f.key || ':type:' || (f.value->>'$type') END, '$type')
+  ) AS d(description, op),
+  LATERAL (SELECT coalesce(validation->'pending'->f.key ? d.op, false)) AS v(pending)
+  WHERE d.description IS NOT NULL
   order by 1;
 END
 $$ LANGUAGE plpgsql;
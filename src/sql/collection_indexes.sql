@@ -0,0 +1,228 @@
+-- # -- # -- # -- # -- #
+-- Indexes
+-- # -- # -- # -- # -- #
+
+
+/* private - expand an index spec into sort keys, in order.
+ * An index spec is a json object in the form {field: direction},
+ * which is the same as a sort spec, folded into a single object.
+ */
+CREATE OR REPLACE FUNCTION bq_index_keys(i_spec json)
+RETURNS table(sort_path text[], sort_direction text) AS $$
+BEGIN
+  IF json_typeof(i_spec) IS DISTINCT FROM 'object'
+     OR NOT EXISTS(SELECT 1 FROM json_object_keys(i_spec))
+  THEN
+    RAISE EXCEPTION 'Invalid index spec "%"', i_spec
+    USING HINT = 'An index spec should be a json object, like {"age": 1}';
+  END IF;
+  RETURN QUERY SELECT * FROM bq_sort_keys(
+    (SELECT json_agg(json_build_object(s.key, s.value) ORDER BY s.n)
+     FROM json_each(i_spec) WITH ORDINALITY AS s(key, value, n)));
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - get the name of the index for an index spec.
+ * The name is derived from the fields and directions of the spec,
+ * so the same spec always maps to the same index. Only the start of the
+ * collection name fits in the name, so the whole of it goes into the
+ * hash, which keeps collections with long names from sharing index names.
+ */
+CREATE OR REPLACE FUNCTION bq_index_name(i_coll text, i_spec json)
+RETURNS text AS $$
+BEGIN
+  RETURN format(
+    'idx_%s_bq_%s',
+    left(i_coll, 40),
+    left(md5(i_coll || ':' || (SELECT string_agg(array_to_string(sort_path, '.')
+                                                 || ':' || sort_direction, ',')
+                               FROM bq_index_keys(i_spec))), 12));
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - check whether a table has an index of the given name.
+ */
+CREATE OR REPLACE FUNCTION bq_index_exists(i_table text, i_index_name text)
+RETURNS boolean AS $$
+BEGIN
+  RETURN EXISTS(
+    SELECT 1 FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = to_regclass(quote_ident(i_table))
+    AND c.relname = i_index_name);
+END
+$$ LANGUAGE plpgsql STABLE;
+
+
+/* private - build the CREATE INDEX statements for an index spec.
+ * Each key is indexed with the same expression that bq_sort_to_text and
+ * bq_find use, and non-unique indexes end with the _id tie-breaker,
+ * so that they can serve sorted finds without a separate sort step.
+ * PostgreSQL cannot build the index of a partitioned table concurrently,
+ * so for a partitioned collection the index is created on the collection
+ * alone, then built concurrently on each partition and attached to it.
+ * Indexes which the collection or a partition already has are skipped.
+ */
+CREATE OR REPLACE FUNCTION bq_index_statements(i_coll text, i_spec json, i_options json, i_concurrently boolean)
+RETURNS setof text AS $$
+DECLARE
+  is_unique boolean = coalesce((i_options->>'unique')::boolean, false);
+  is_partitioned boolean = bq_collection_partitioning(i_coll) IS NOT NULL;
+  key_list text;
+  target_partition text;
+BEGIN
+  SELECT string_agg(format('(bq_jdoc#>%L) %s', sort_path, sort_direction), ', ')
+  FROM bq_index_keys(i_spec)
+  INTO key_list;
+  IF is_unique AND is_partitioned
+  THEN
+    RAISE EXCEPTION 'Collection "%" is partitioned, so cannot have a unique index', i_coll
+    USING HINT = 'PostgreSQL only enforces uniqueness across partitions on the partition key';
+  END IF;
+  IF NOT is_unique
+  THEN
+    key_list := key_list || ', _id';
+  END IF;
+  IF NOT (is_partitioned AND i_concurrently)
+  THEN
+    IF NOT bq_index_exists(i_coll, bq_index_name(i_coll, i_spec))
+    THEN
+      RETURN NEXT format(
+        'CREATE %sINDEX %s%I ON %I (%s)',
+        CASE WHEN is_unique THEN 'UNIQUE ' ELSE '' END,
+        CASE WHEN i_concurrently THEN 'CONCURRENTLY ' ELSE '' END,
+        bq_index_name(i_coll, i_spec),
+        i_coll,
+        key_list);
+    END IF;
+    RETURN;
+  END IF;
+  IF NOT bq_index_exists(i_coll, bq_index_name(i_coll, i_spec))
+  THEN
+    RETURN NEXT format(
+      'CREATE INDEX %I ON ONLY %I (%s)',
+      bq_index_name(i_coll, i_spec), i_coll, key_list);
+  END IF;
+  FOR target_partition IN
+    SELECT p.partition_name FROM bq_list_partitions(i_coll) AS p
+  LOOP
+    IF NOT bq_index_exists(target_partition, bq_index_name(target_partition, i_spec))
+    THEN
+      RETURN NEXT format(
+        'CREATE INDEX CONCURRENTLY %I ON %I (%s)',
+        bq_index_name(target_partition, i_spec), target_partition, key_list);
+    END IF;
+    -- attaching an index which is already attached does nothing
+    RETURN NEXT format(
+      'ALTER INDEX %I ATTACH PARTITION %I',
+      bq_index_name(i_coll, i_spec), bq_index_name(target_partition, i_spec));
+  END LOOP;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* Add an index to the collection.
+ * The supplied json document should be in the form {field: direction},
+ * where field is a (possibly dotted) path and direction is either
+ * 1 (ascending) or -1 (descending), for example:
+ *   {"address.city": 1, "age": -1}
+ * The index can serve finds which sort on the same fields in the same
+ * directions, as well as range queries on the first field.
+ * Options:
+ * - {"unique": true} : no two documents may have the same values
+ *       for the indexed fields.
+ * Returns a boolean indicating whether the index was newly created.
+ * There can only be one index per spec, whatever its options.
+ */
+CREATE OR REPLACE FUNCTION bq_add_index(i_coll text, i_spec json, i_options json DEFAULT '{}')
+RETURNS boolean AS $$
+DECLARE
+  statement text;
+BEGIN
+  PERFORM bq_create_collection(i_coll);
+  IF bq_index_exists(i_coll, bq_index_name(i_coll, i_spec))
+  THEN
+    RETURN false;
+  END IF;
+  FOR statement IN
+    SELECT * FROM bq_index_statements(i_coll, i_spec, i_options, false)
+  LOOP
+    EXECUTE statement;
+  END LOOP;
+  RETURN true;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* Get the statements which build an index without blocking writes.
+ * Takes the same parameters as bq_add_index, and returns a
+ * CREATE INDEX CONCURRENTLY statement for the index. For a partitioned
+ * collection it returns a CREATE INDEX statement for the collection
+ * itself, followed by a CREATE INDEX CONCURRENTLY and an ALTER INDEX ...
+ * ATTACH PARTITION statement for each partition. PostgreSQL cannot
+ * build an index concurrently from inside a function, so the client
+ * should run the returned statements itself, in order and outside of
+ * a transaction.
+ */
+CREATE OR REPLACE FUNCTION bq_add_index_statement(i_coll text, i_spec json, i_options json DEFAULT '{}')
+RETURNS setof text AS $$
+BEGIN
+  RETURN QUERY SELECT * FROM bq_index_statements(i_coll, i_spec, i_options, true);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* Remove an index from the collection.
+ * The supplied json document should match the spec of an existing index.
+ * Returns a boolean indicating whether the index was removed.
+ */
+CREATE OR REPLACE FUNCTION bq_remove_index(i_coll text, i_spec json)
+RETURNS boolean AS $$
+DECLARE
+  target_index text = bq_index_name(i_coll, i_spec);
+BEGIN
+  IF NOT bq_index_exists(i_coll, target_index)
+  THEN
+    RETURN false;
+  END IF;
+  EXECUTE format('DROP INDEX %I', target_index);
+  RETURN true;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* Get a list of the indexes on this collection.
+ * Each index is described by its name, its spec as passed to bq_add_index,
+ * and whether it is unique.
+ * The default indexes which every collection has are not listed.
+ */
+CREATE OR REPLACE FUNCTION bq_list_indexes(i_coll text)
+RETURNS table(index_name text, index_spec json, is_unique boolean) AS $$
+BEGIN
+  IF NOT (SELECT bq_collection_exists(i_coll))
+  THEN
+    RETURN;
+  END IF;
+  RETURN QUERY
+  SELECT c.relname::text,
+         (SELECT json_object_agg(
+                   array_to_string(
+                     replace(
+                       substring(pg_get_indexdef(i.indexrelid, k.n, true)
+                                 from '^\(bq_jdoc #> ''(.*)''::text\[\]\)$'),
+                       '''''', '''')::text[],
+                     '.'),
+                   CASE WHEN i.indoption[k.n - 1] & 1 = 1 THEN -1 ELSE 1 END
+                   ORDER BY k.n)
+          FROM generate_series(1, i.indnatts) AS k(n)
+          WHERE pg_get_indexdef(i.indexrelid, k.n, true) LIKE '(bq_jdoc #> %'),
+         i.indisunique
+  FROM pg_index i
+  JOIN pg_class c ON c.oid = i.indexrelid
+  WHERE i.indrelid = quote_ident(i_coll)::regclass
+  AND pg_get_indexdef(i.indexrelid, 1, true) LIKE '(bq_jdoc #> %'
+  ORDER BY c.relname;
+END
+$$ LANGUAGE plpgsql;
@@ -3,24 +3,197 @@
 -- # -- # -- # -- # -- #
 
 
+-- Registry of collections, keyed on schema and collection name.
+-- This is what bq_collection_exists consults, rather than pg_class.
+-- The options column holds per-collection settings, such as the
+-- id strategy.
+CREATE TABLE IF NOT EXISTS bq_collections (
+    schema_name text NOT NULL,
+    collection_name text NOT NULL,
+    created timestamptz default current_timestamp,
+    options jsonb NOT NULL default '{}',
+    PRIMARY KEY (schema_name, collection_name)
+);
+SELECT pg_catalog.pg_extension_config_dump('bq_collections', '');
+
+-- Source of the sequence part of time-ordered ids.
+-- Cycles within the 48 bits available to it.
+CREATE SEQUENCE IF NOT EXISTS bq_id_seq MAXVALUE 281474976710655 CYCLE;
+
+-- Document counts of collections with cached counts, for bq_count.
+-- Kept up to date by the triggers which bq_set_cached_count creates.
+CREATE TABLE IF NOT EXISTS bq_collection_counts (
+    schema_name text NOT NULL,
+    collection_name text NOT NULL,
+    doc_count bigint NOT NULL,
+    PRIMARY KEY (schema_name, collection_name),
+    FOREIGN KEY (schema_name, collection_name)
+      REFERENCES bq_collections ON DELETE CASCADE
+);
+SELECT pg_catalog.pg_extension_config_dump('bq_collection_counts', '');
+
+-- Register any collections which pre-date the registry, restoring their
+-- constraint spec from the comment on their check constraint.
+INSERT INTO bq_collections (schema_name, collection_name, options)
+SELECT table_schema, table_name,
+       coalesce((SELECT jsonb_build_object(
+                          'constraints', obj_description(c.oid, 'pg_constraint')::jsonb)
+                 FROM pg_constraint c
+                 WHERE c.conrelid = format('%I.%I', table_schema, table_name)::regclass
+                 AND c.conname = 'bq_constraints'
+                 AND obj_description(c.oid, 'pg_constraint') IS NOT NULL),
+                '{}')
+FROM information_schema.columns
+WHERE column_name = 'bq_jdoc'
+AND data_type = 'jsonb'
+AND NOT EXISTS(SELECT 1 FROM pg_inherits
+               WHERE inhrelid = format('%I.%I', table_schema, table_name)::regclass)
+ON CONFLICT DO NOTHING;
+
+
+/* private - Remove dropped tables from the collection registry.
+ * Keeps the registry in step with collections dropped by plain DDL,
+ * rather than by bq_delete_collection.
+ * This fires for every table dropped in the database, whatever the
+ * search_path of the session, so the registry is found through the
+ * schema of the extension.
+ */
+CREATE OR REPLACE FUNCTION bq_collections_on_drop()
+RETURNS event_trigger AS $$
+DECLARE
+  registry_schema text;
+BEGIN
+  SELECT n.nspname INTO registry_schema
+  FROM pg_catalog.pg_extension e
+  JOIN pg_catalog.pg_namespace n ON n.oid = e.extnamespace
+  WHERE e.extname = 'bedquilt';
+  IF registry_schema IS NULL
+  THEN
+    RETURN;
+  END IF;
+  EXECUTE format('
+    DELETE FROM %I.bq_collections c
+    USING pg_catalog.pg_event_trigger_dropped_objects() d
+    WHERE d.object_type = ''table''
+    AND c.schema_name = d.schema_name
+    AND c.collection_name = d.object_name
+    ', registry_schema);
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE EVENT TRIGGER bq_collections_on_drop ON sql_drop
+WHEN TAG IN ('DROP TABLE', 'DROP SCHEMA', 'DROP OWNED')
+EXECUTE PROCEDURE bq_collections_on_drop();
+
+
 /* Create a collection with the specified name
+ * The _id column is the primary key, and a check constraint keeps it
+ * equal to the '_id' field of the document.
+ * Options:
+ * - {"gin": "jsonb_path_ops"} : the operator class of the GIN index on
+ *       documents, which serves the containment queries of bq_find.
+ *       Either "jsonb_path_ops" (the default, which is smaller and faster)
+ *       or "jsonb_ops". A value of false creates no GIN index at all,
+ *       which suits collections that are written far more than read.
+ * - {"id": "random"} : how _id values are generated for documents which
+ *       lack one. Either "random" (the default), or "time", for ids that
+ *       start with a timestamp and increase, so that inserts append to
+ *       the end of the _id index rather than landing all over it.
+ * - {"cached_count": true} : keep a count of the documents, so that
+ *       bq_count can read it in the 'cached' mode. See bq_set_cached_count.
+ * - {"ttl": {"seconds": 86400}} : expire documents a number of seconds
+ *       after they were created, or after the time in a field, as in
+ *       {"seconds": 0, "path": "expires"}. See bq_set_ttl.
+ * - {"partition": {"hash": 8}} : create the collection as a partitioned
+ *       table, split into the given number of partitions on a hash of _id.
+ *       Lookups by _id only visit one partition, and each partition is
+ *       vacuumed and indexed on its own.
+ * - {"partition": {"range": "created"}} : create the collection as a
+ *       table partitioned on the 'created' timestamp of documents, with
+ *       partitions added by bq_add_partition. Old documents can then be
+ *       removed a partition at a time, with bq_drop_partitions_before.
+ *       Such a collection always has the "time" id strategy, and the
+ *       'created' timestamp of each document is the time in its _id, so
+ *       the (_id, created) primary key keeps _id unique across all the
+ *       partitions. Documents saved with an _id of their own need one
+ *       from bq_generate_time_id.
  */
-CREATE OR REPLACE FUNCTION bq_create_collection(i_coll text)
+CREATE OR REPLACE FUNCTION bq_create_collection(i_coll text, i_options json DEFAULT '{}')
 RETURNS BOOLEAN AS $$
+DECLARE
+  gin_opclass text;
+  id_strategy text;
+  partition_option jsonb;
+  partition_index int;
 BEGIN
 IF NOT (SELECT bq_collection_exists(i_coll))
 THEN
+    gin_opclass := bq_gin_opclass_option(i_options);
+    id_strategy := bq_id_strategy_option(i_options->'id');
+    partition_option := bq_partition_option(i_options->'partition');
+    IF partition_option ? 'range'
+    THEN
+      IF i_options->'id' IS NOT NULL AND id_strategy <> 'time'
+      THEN
+        RAISE EXCEPTION 'Collection "%" cannot have the "%" id strategy', i_coll, id_strategy
+        USING HINT = 'Collections partitioned on created take their created timestamp from a "time" id';
+      END IF;
+      id_strategy := 'time';
+    END IF;
     EXECUTE format('
     CREATE TABLE IF NOT EXISTS %1$I (
-        _id varchar(256) PRIMARY KEY NOT NULL,
+        _id varchar(256) NOT NULL,
         bq_jdoc jsonb NOT NULL,
         created timestamptz default current_timestamp,
         updated timestamptz default current_timestamp,
-        CONSTRAINT validate_id CHECK ((bq_jdoc->>''_id'') IS NOT NULL)
-    );
-    CREATE INDEX idx_%1$I_bq_jdoc ON %1$I USING gin (bq_jdoc);
-    CREATE UNIQUE INDEX idx_%1$I_bq_jdoc_id ON %1$I ((bq_jdoc->>''_id''));
-    ', i_coll);
+        CONSTRAINT validate_id CHECK (_id IS NOT DISTINCT FROM (bq_jdoc->>''_id'')),
+        %2$s
+        PRIMARY KEY (%3$s)
+    ) %4$s;
+    ', i_coll,
+    CASE WHEN partition_option ? 'range'
+      THEN 'CONSTRAINT validate_created CHECK (coalesce(created = bq_time_id_timestamp(_id), false)),'
+      ELSE ''
+    END,
+    CASE WHEN partition_option ? 'range' THEN '_id, created' ELSE '_id' END,
+    CASE
+      WHEN partition_option ? 'hash' THEN 'PARTITION BY HASH (_id)'
+      WHEN partition_option ? 'range' THEN 'PARTITION BY RANGE (created)'
+      ELSE ''
+    END);
+    IF partition_option ? 'hash'
+    THEN
+      FOR partition_index IN 0 .. (partition_option->>'hash')::int - 1 LOOP
+        EXECUTE format(
+          'CREATE TABLE %I PARTITION OF %I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+          format('%s_p%s', i_coll, partition_index), i_coll,
+          partition_option->>'hash', partition_index);
+      END LOOP;
+    ELSIF partition_option ? 'range'
+    THEN
+      -- catches documents created outside of any added partition
+      EXECUTE format(
+        'CREATE TABLE %I PARTITION OF %I DEFAULT',
+        format('%s_default', i_coll), i_coll);
+    END IF;
+    IF gin_opclass IS NOT NULL
+    THEN
+      EXECUTE format(
+        'CREATE INDEX %I ON %I USING gin (bq_jdoc %s)',
+        bq_gin_index_name(i_coll), i_coll, gin_opclass);
+    END IF;
+    INSERT INTO bq_collections (schema_name, collection_name, options)
+    VALUES (current_schema(), i_coll, jsonb_strip_nulls(jsonb_build_object(
+      'id', id_strategy, 'partition', partition_option)));
+    IF coalesce((i_options->>'cached_count')::boolean, false)
+    THEN
+      PERFORM bq_set_cached_count(i_coll, true);
+    END IF;
+    IF i_options->'ttl' IS NOT NULL
+    THEN
+      PERFORM bq_set_ttl(
+        i_coll, (i_options#>>'{ttl,seconds}')::int, i_options#>>'{ttl,path}');
+    END IF;
     RETURN true;
 ELSE
     RETURN false;
@@ -29,16 +202,729 @@ END
 $$ LANGUAGE plpgsql SECURITY DEFINER;
 
 
+/* Bring an existing collection up to date with the current layout.
+ * Collections created by earlier versions of bedquilt have a unique index
+ * on the '_id' field of the document, as well as the _id primary key.
+ * This replaces that index with a check that the two are equal, so
+ * that inserts and updates maintain only one btree over _id.
+ * Earlier versions also added a check constraint per field and rule for
+ * bq_add_constraints. These are folded into the constraint spec of the
+ * collection, which is enforced by a single check constraint.
+ * The GIN index is renamed from the name earlier versions gave it, which
+ * could clash between collections with long names.
+ * Returns a boolean indicating whether the collection was changed.
+ */
+CREATE OR REPLACE FUNCTION bq_migrate_collection(i_coll text)
+RETURNS BOOLEAN AS $$
+DECLARE
+  id_index regclass = to_regclass(quote_ident(format('idx_%s_bq_jdoc_id', i_coll)));
+  gin_index text;
+  legacy RECORD;
+  legacy_drops text[] = '{}';
+  spec jsonb;
+  changed boolean = false;
+BEGIN
+  IF NOT (SELECT bq_collection_exists(i_coll))
+  THEN
+    RETURN false;
+  END IF;
+  IF id_index IS NOT NULL
+  THEN
+    EXECUTE format('
+      ALTER TABLE %1$I
+        DROP CONSTRAINT IF EXISTS validate_id,
+        ADD CONSTRAINT validate_id CHECK (_id IS NOT DISTINCT FROM (bq_jdoc->>''_id''));
+      DROP INDEX %2$s;
+      ', i_coll, id_index);
+    changed := true;
+  END IF;
+  SELECT c.relname::text
+  FROM pg_index i
+  JOIN pg_class c ON c.oid = i.indexrelid
+  WHERE i.indrelid = quote_ident(i_coll)::regclass
+  AND c.relname = format('idx_%s_bq_jdoc', i_coll)::name
+  INTO gin_index;
+  IF gin_index IS NOT NULL
+  THEN
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', gin_index, bq_gin_index_name(i_coll));
+    changed := true;
+  END IF;
+  spec := bq_collection_constraints(i_coll);
+  FOR legacy IN
+    SELECT c.conname, m[1] AS field_name, m[2] AS rule, m[3] AS s_type
+    FROM pg_constraint c,
+    regexp_match(c.conname, '^bqcn:(.+):(required|notnull|type:(\w+))$') AS m
+    WHERE c.conrelid = quote_ident(i_coll)::regclass
+    AND m IS NOT NULL
+  LOOP
+    spec := spec || jsonb_build_object(
+      legacy.field_name,
+      coalesce(spec->legacy.field_name, '{}') || CASE legacy.rule
+        WHEN 'required' THEN '{"$required": true}'
+        WHEN 'notnull' THEN '{"$notnull": true}'
+        ELSE jsonb_build_object('$type', legacy.s_type)
+      END);
+    legacy_drops := legacy_drops || format('DROP CONSTRAINT %I', legacy.conname);
+  END LOOP;
+  IF legacy_drops <> '{}'
+  THEN
+    EXECUTE format('ALTER TABLE %I %s', i_coll, array_to_string(legacy_drops, ', '));
+    PERFORM bq_apply_constraints(i_coll, spec);
+    changed := true;
+  END IF;
+  RETURN changed;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* Change the GIN index on documents in an existing collection.
+ * The i_opclass parameter is either "jsonb_path_ops" or "jsonb_ops",
+ * or null to remove the GIN index.
+ * The new index is built alongside the old one, which is only dropped
+ * once the new one is ready, so reads carry on using an index throughout.
+ * Writes wait while the new index builds; to avoid that, run the statements
+ * from bq_set_gin_index_statements instead.
+ * Returns a boolean indicating whether the index was changed.
+ */
+CREATE OR REPLACE FUNCTION bq_set_gin_index(i_coll text, i_opclass text)
+RETURNS BOOLEAN AS $$
+DECLARE
+  statement text;
+  changed boolean = false;
+BEGIN
+  FOR statement IN
+    SELECT * FROM bq_gin_index_statements(i_coll, i_opclass, false)
+  LOOP
+    EXECUTE statement;
+    changed := true;
+  END LOOP;
+  RETURN changed;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* Get the statements which change the GIN index on documents
+ * without blocking reads or writes.
+ * Takes the same parameters as bq_set_gin_index, and returns the
+ * CREATE INDEX CONCURRENTLY, DROP INDEX CONCURRENTLY and ALTER INDEX
+ * statements which make the change. PostgreSQL cannot run these from
+ * inside a function, so the client should run them itself, in order
+ * and outside of a transaction.
+ */
+CREATE OR REPLACE FUNCTION bq_set_gin_index_statements(i_coll text, i_opclass text)
+RETURNS setof text AS $$
+BEGIN
+  RETURN QUERY SELECT * FROM bq_gin_index_statements(i_coll, i_opclass, true);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* private - the statements which change the GIN index of a collection
+ * to the specified operator class, or drop it if that is null.
+ * PostgreSQL cannot build or drop the index of a partitioned table
+ * concurrently, so for a partitioned collection the new index is created
+ * on the collection alone, then built concurrently on each partition and
+ * attached to it, and the old index is dropped without CONCURRENTLY,
+ * which holds off queries for as long as the drop takes.
+ */
+CREATE OR REPLACE FUNCTION bq_gin_index_statements(i_coll text, i_opclass text, i_concurrently boolean)
+RETURNS setof text AS $$
+DECLARE
+  current_index text;
+  current_opclass text;
+  concurrently_text text = CASE WHEN i_concurrently THEN 'CONCURRENTLY ' ELSE '' END;
+  partitions text[] = '{}';
+  target_partition text;
+BEGIN
+  IF NOT (SELECT bq_collection_exists(i_coll))
+  THEN
+    RAISE EXCEPTION 'Collection "%" does not exist', i_coll;
+  END IF;
+  IF i_opclass IS NOT NULL
+  THEN
+    PERFORM bq_gin_opclass_option(json_build_object('gin', i_opclass));
+  END IF;
+  -- collections not yet migrated have the GIN index of earlier versions
+  SELECT c.relname::text, opc.opcname::text
+  FROM pg_index i
+  JOIN pg_class c ON c.oid = i.indexrelid
+  JOIN pg_opclass opc ON opc.oid = i.indclass[0]
+  WHERE i.indrelid = quote_ident(i_coll)::regclass
+  AND c.relname IN (bq_gin_index_name(i_coll)::name, format('idx_%s_bq_jdoc', i_coll)::name)
+  INTO current_index, current_opclass;
+  IF current_opclass IS NOT DISTINCT FROM i_opclass
+  THEN
+    RETURN;
+  END IF;
+  IF i_concurrently AND bq_collection_partitioning(i_coll) IS NOT NULL
+  THEN
+    SELECT coalesce(array_agg(p.partition_name), '{}')
+    FROM bq_list_partitions(i_coll) AS p
+    INTO partitions;
+    concurrently_text := '';
+  END IF;
+  -- an index left by a build which did not finish may be invalid, or of
+  -- another operator class, so it is dropped rather than reused
+  IF bq_index_exists(i_coll, bq_gin_index_name(i_coll) || '_new')
+  THEN
+    RETURN NEXT format(
+      'DROP INDEX %sIF EXISTS %I',
+      concurrently_text, bq_gin_index_name(i_coll) || '_new');
+  END IF;
+  FOREACH target_partition IN ARRAY partitions LOOP
+    IF bq_index_exists(target_partition, bq_gin_index_name(target_partition) || '_new')
+    THEN
+      RETURN NEXT format(
+        'DROP INDEX CONCURRENTLY IF EXISTS %I',
+        bq_gin_index_name(target_partition) || '_new');
+    END IF;
+  END LOOP;
+  IF i_opclass IS NOT NULL
+  THEN
+    RETURN NEXT format(
+      'CREATE INDEX %s%I ON %s%I USING gin (bq_jdoc %s)',
+      concurrently_text, bq_gin_index_name(i_coll) || '_new',
+      CASE WHEN cardinality(partitions) > 0 THEN 'ONLY ' ELSE '' END,
+      i_coll, i_opclass);
+    FOREACH target_partition IN ARRAY partitions LOOP
+      RETURN NEXT format(
+        'CREATE INDEX CONCURRENTLY %I ON %I USING gin (bq_jdoc %s)',
+        bq_gin_index_name(target_partition) || '_new', target_partition, i_opclass);
+      RETURN NEXT format(
+        'ALTER INDEX %I ATTACH PARTITION %I',
+        bq_gin_index_name(i_coll) || '_new',
+        bq_gin_index_name(target_partition) || '_new');
+    END LOOP;
+  END IF;
+  IF current_opclass IS NOT NULL
+  THEN
+    RETURN NEXT format(
+      'DROP INDEX %sIF EXISTS %I',
+      concurrently_text, current_index);
+  END IF;
+  IF i_opclass IS NOT NULL
+  THEN
+    RETURN NEXT format(
+      'ALTER INDEX %I RENAME TO %I',
+      bq_gin_index_name(i_coll) || '_new', bq_gin_index_name(i_coll));
+    FOREACH target_partition IN ARRAY partitions LOOP
+      RETURN NEXT format(
+        'ALTER INDEX %I RENAME TO %I',
+        bq_gin_index_name(target_partition) || '_new',
+        bq_gin_index_name(target_partition));
+    END LOOP;
+  END IF;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* private - get the name of the GIN index of a collection.
+ * As for bq_index_name, long collection names are cut short and a hash
+ * of the whole name is added, leaving room for a "_new" suffix within
+ * the 63 bytes of a PostgreSQL name.
+ */
+CREATE OR REPLACE FUNCTION bq_gin_index_name(i_coll text)
+RETURNS text AS $$
+BEGIN
+  RETURN format('idx_%s_bq_jdoc_%s', left(i_coll, 32), left(md5(i_coll), 12));
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - get the GIN operator class from collection options,
+ * or null if the collection should have no GIN index.
+ */
+CREATE OR REPLACE FUNCTION bq_gin_opclass_option(i_options json)
+RETURNS text AS $$
+DECLARE
+  gin_option json = i_options->'gin';
+BEGIN
+  IF gin_option IS NULL OR gin_option::text = 'true'
+  THEN
+    RETURN 'jsonb_path_ops';
+  ELSIF gin_option::text IN ('false', 'null')
+  THEN
+    RETURN null;
+  ELSIF gin_option::text IN ('"jsonb_path_ops"', '"jsonb_ops"')
+  THEN
+    RETURN i_options->>'gin';
+  END IF;
+  RAISE EXCEPTION 'Invalid gin option %', gin_option
+  USING HINT = 'The gin option should be "jsonb_path_ops", "jsonb_ops" or false';
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - get the id strategy from the "id" collection option,
+ * which defaults to "random".
+ */
+CREATE OR REPLACE FUNCTION bq_id_strategy_option(i_option json)
+RETURNS text AS $$
+BEGIN
+  IF i_option IS NULL OR i_option::text = 'null'
+  THEN
+    RETURN 'random';
+  ELSIF i_option::text IN ('"random"', '"time"')
+  THEN
+    RETURN i_option#>>'{}';
+  END IF;
+  RAISE EXCEPTION 'Invalid id option %', i_option
+  USING HINT = 'The id option should be "random" or "time"';
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - check the "partition" collection option, which is either
+ * null, for an ordinary table, or an object with a "hash" or "range" key.
+ */
+CREATE OR REPLACE FUNCTION bq_partition_option(i_option json)
+RETURNS jsonb AS $$
+BEGIN
+  IF i_option IS NULL OR i_option::text = 'null'
+  THEN
+    RETURN null;
+  ELSIF json_typeof(i_option) = 'object'
+  THEN
+    IF i_option::jsonb = '{"range": "created"}'
+       OR (i_option::jsonb - 'hash' = '{}'
+           AND json_typeof(i_option->'hash') = 'number'
+           AND (i_option->>'hash') ~ '^[1-9]\d*$')
+    THEN
+      RETURN i_option::jsonb;
+    END IF;
+  END IF;
+  RAISE EXCEPTION 'Invalid partition option %', i_option
+  USING HINT = 'The partition option should be like {"hash": 8} or {"range": "created"}';
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - get the partition option of a collection, or null if it is
+ * not partitioned.
+ */
+CREATE OR REPLACE FUNCTION bq_collection_partitioning(i_coll text)
+RETURNS jsonb AS $$
+BEGIN
+  RETURN (SELECT options->'partition' FROM bq_collections
+          WHERE schema_name = current_schema()
+          AND collection_name = i_coll);
+END
+$$ LANGUAGE plpgsql STABLE;
+
+
+/* Add a partition to a collection which is partitioned on the 'created'
+ * timestamp, for the documents created from i_from up to (but not
+ * including) i_to. Partitions should be added ahead of time; documents
+ * created outside of every partition are kept in a default partition,
+ * and while that holds any documents in the new range, adding the
+ * partition fails.
+ * Returns a boolean indicating whether the partition was newly added.
+ */
+CREATE OR REPLACE FUNCTION bq_add_partition(i_coll text, i_from timestamptz, i_to timestamptz)
+RETURNS boolean AS $$
+DECLARE
+  partition_name text = format(
+    '%s_%s', i_coll, to_char(i_from AT TIME ZONE 'UTC', 'YYYYMMDD"T"HH24MISS'));
+BEGIN
+  IF NOT coalesce(bq_collection_partitioning(i_coll) ? 'range', false)
+  THEN
+    RAISE EXCEPTION 'Collection "%" is not partitioned on created', i_coll
+    USING HINT = 'Create the collection with {"partition": {"range": "created"}}';
+  END IF;
+  IF to_regclass(quote_ident(partition_name)) IS NOT NULL
+  THEN
+    RETURN false;
+  END IF;
+  EXECUTE format(
+    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+    partition_name, i_coll, i_from, i_to);
+  RETURN true;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* Drop the partitions of a collection which only hold documents created
+ * before i_before, which removes those documents far more cheaply than
+ * deleting them. The default partition is never dropped.
+ * If the collection has a cached count, the documents in each partition
+ * are counted before it is dropped, and taken off the cached count.
+ * Returns the number of partitions dropped.
+ */
+CREATE OR REPLACE FUNCTION bq_drop_partitions_before(i_coll text, i_before timestamptz)
+RETURNS integer AS $$
+DECLARE
+  target_partition text;
+  dropped int = 0;
+  dropped_docs bigint;
+  cached_count boolean = EXISTS(SELECT 1 FROM bq_collection_counts
+                                WHERE schema_name = current_schema()
+                                AND collection_name = i_coll);
+BEGIN
+  FOR target_partition IN
+    SELECT p.partition_name FROM bq_list_partitions(i_coll) AS p
+    WHERE p.partition_to <= i_before
+  LOOP
+    IF cached_count
+    THEN
+      -- dropping a partition fires no delete trigger, so take its
+      -- documents off the count here, with writes to it held off
+      EXECUTE format('LOCK TABLE %I IN ACCESS EXCLUSIVE MODE', target_partition);
+      EXECUTE format('SELECT count(*) FROM %I', target_partition) INTO dropped_docs;
+      UPDATE bq_collection_counts SET doc_count = doc_count - dropped_docs
+      WHERE schema_name = current_schema()
+      AND collection_name = i_coll;
+    END IF;
+    EXECUTE format('DROP TABLE %I', target_partition);
+    dropped := dropped + 1;
+  END LOOP;
+  RETURN dropped;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* Get a list of the partitions of a collection.
+ * Each partition is described by its name and its bounds, as reported by
+ * PostgreSQL. For collections partitioned on 'created', partition_from and
+ * partition_to are the range of timestamps which the partition holds, and
+ * are null for the default partition.
+ */
+CREATE OR REPLACE FUNCTION bq_list_partitions(i_coll text)
+RETURNS table(partition_name text, partition_bound text, partition_from timestamptz, partition_to timestamptz) AS $$
+BEGIN
+  IF bq_collection_partitioning(i_coll) IS NULL
+  THEN
+    RETURN;
+  END IF;
+  RETURN QUERY
+  SELECT c.relname::text,
+         b.bound,
+         substring(b.bound from '^FOR VALUES FROM \(''(.*)''\) TO')::timestamptz,
+         substring(b.bound from ' TO \(''(.*)''\)$')::timestamptz
+  FROM pg_inherits i
+  JOIN pg_class c ON c.oid = i.inhrelid
+  CROSS JOIN pg_get_expr(c.relpartbound, c.oid) AS b(bound)
+  WHERE i.inhparent = quote_ident(i_coll)::regclass
+  ORDER BY 3 NULLS LAST, c.relname;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* Change how _id values are generated for an existing collection.
+ * The i_strategy parameter is either "random" or "time", as for the "id"
+ * option of bq_create_collection. Existing documents keep their _id.
+ * Collections partitioned on created can only have the "time" strategy.
+ * Returns a boolean indicating whether the strategy was changed.
+ */
+CREATE OR REPLACE FUNCTION bq_set_id_strategy(i_coll text, i_strategy text)
+RETURNS BOOLEAN AS $$
+DECLARE
+  id_strategy text = bq_id_strategy_option(to_json(i_strategy));
+BEGIN
+  IF id_strategy <> 'time'
+  AND coalesce(bq_collection_partitioning(i_coll) ? 'range', false)
+  THEN
+    RAISE EXCEPTION 'Collection "%" cannot have the "%" id strategy', i_coll, id_strategy
+    USING HINT = 'Collections partitioned on created take their created timestamp from a "time" id';
+  END IF;
+  UPDATE bq_collections
+  SET options = options || jsonb_build_object('id', id_strategy)
+  WHERE schema_name = current_schema()
+  AND collection_name = i_coll
+  AND options->>'id' IS DISTINCT FROM id_strategy;
+  RETURN FOUND;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* private - get the id strategy of a collection.
+ */
+CREATE OR REPLACE FUNCTION bq_collection_id_strategy(i_coll text)
+RETURNS text AS $$
+BEGIN
+  RETURN coalesce(
+    (SELECT options->>'id' FROM bq_collections
+     WHERE schema_name = current_schema()
+     AND collection_name = i_coll),
+    'random');
+END
+$$ LANGUAGE plpgsql STABLE;
+
+
+/* Expire documents from a collection some time after they were created,
+ * or after a time held in the documents themselves.
+ * With i_path null, documents expire i_seconds after their 'created'
+ * timestamp. Otherwise they expire i_seconds after the time in the
+ * (dotted) field i_path, which should be an ISO 8601 string, read as UTC
+ * if it has no offset, or a number of seconds since the epoch. Documents
+ * without a valid time in that field never expire.
+ * Expired documents are removed by bq_purge_expired, not as they expire.
+ * An index on the expiry time is kept, so that each purge only visits the
+ * documents it removes. A null i_seconds removes the setting and index.
+ * Returns a boolean indicating whether the setting was changed.
+ */
+CREATE OR REPLACE FUNCTION bq_set_ttl(i_coll text, i_seconds integer, i_path text DEFAULT null)
+RETURNS BOOLEAN AS $$
+DECLARE
+  ttl jsonb;
+BEGIN
+  IF NOT (SELECT bq_collection_exists(i_coll))
+  THEN
+    RAISE EXCEPTION 'Collection "%" does not exist', i_coll;
+  END IF;
+  IF i_seconds < 0
+  THEN
+    RAISE EXCEPTION 'Invalid ttl of % seconds', i_seconds
+    USING HINT = 'The ttl should be zero or more seconds, or null to remove it';
+  END IF;
+  IF i_seconds IS NOT NULL
+  THEN
+    ttl := jsonb_strip_nulls(jsonb_build_object('seconds', i_seconds, 'path', i_path));
+  END IF;
+  IF (SELECT options->'ttl' FROM bq_collections
+      WHERE schema_name = current_schema()
+      AND collection_name = i_coll) IS NOT DISTINCT FROM ttl
+  THEN
+    RETURN false;
+  END IF;
+  EXECUTE format('DROP INDEX IF EXISTS %I', bq_ttl_index_name(i_coll));
+  IF ttl IS NOT NULL
+  THEN
+    EXECUTE format(
+      'CREATE INDEX %I ON %I (%s)',
+      bq_ttl_index_name(i_coll), i_coll, bq_ttl_expiry_text(ttl));
+  END IF;
+  UPDATE bq_collections
+  SET options = CASE WHEN ttl IS NULL THEN options - 'ttl'
+                     ELSE options || jsonb_build_object('ttl', ttl) END
+  WHERE schema_name = current_schema()
+  AND collection_name = i_coll;
+  RETURN true;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* private - get the name of the expiry index of a collection.
+ * As for bq_gin_index_name, long collection names are cut short and a
+ * hash of the whole name is added.
+ */
+CREATE OR REPLACE FUNCTION bq_ttl_index_name(i_coll text)
+RETURNS text AS $$
+BEGIN
+  RETURN format('idx_%s_bq_ttl_%s', left(i_coll, 32), left(md5(i_coll), 12));
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - the expression for the time from which documents count
+ * towards their ttl, which the expiry index is built on.
+ */
+CREATE OR REPLACE FUNCTION bq_ttl_expiry_text(i_ttl jsonb)
+RETURNS text AS $$
+BEGIN
+  IF i_ttl ? 'path'
+  THEN
+    RETURN format(
+      'bq_ttl_expiry(bq_jdoc#>%L)',
+      regexp_split_to_array(i_ttl->>'path', '\.'));
+  END IF;
+  RETURN 'created';
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - read a time from a document field, for the expiry index.
+ * Strings are read as ISO 8601 timestamps, like "2016-01-01T12:00:00+01:00",
+ * in UTC if they have no offset, and numbers as seconds since the epoch,
+ * within the years 1 to 9999. Anything else reads as null.
+ * Strings are checked against a pattern before they are cast, so that
+ * bad values read as null rather than raising an error.
+ */
+CREATE OR REPLACE FUNCTION bq_ttl_expiry(i_value jsonb)
+RETURNS timestamptz AS $$
+DECLARE
+  value_text text = i_value#>>'{}';
+BEGIN
+  IF jsonb_typeof(i_value) = 'number'
+  THEN
+    IF value_text::numeric >= -62135596800 AND value_text::numeric < 253402300800
+    THEN
+      RETURN to_timestamp(value_text::double precision);
+    END IF;
+  ELSIF jsonb_typeof(i_value) = 'string'
+        AND value_text ~ '^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])([T ]([01]\d|2[0-3]):[0-5]\d(:[0-5]\d(\.\d+)?)?(Z|[+-]([01]\d|2[0-3])(:?[0-5]\d)?)?)?$'
+        AND left(value_text, 4) <> '0000'
+  THEN
+    -- the pattern allows up to 31 days in any month
+    IF substr(value_text, 9, 2)::int <= extract(day from
+         make_date(left(value_text, 4)::int, substr(value_text, 6, 2)::int, 1)
+         + interval '1 month - 1 day')
+    THEN
+      -- with an explicit offset, the cast does not depend on the TimeZone
+      -- of the session
+      IF substr(value_text, 11) !~ '[Z+-]'
+      THEN
+        value_text := value_text || 'Z';
+      END IF;
+      RETURN value_text::timestamptz;
+    END IF;
+  END IF;
+  RETURN null;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+
+/* Keep a count of the documents in a collection, or stop keeping one.
+ * While it is kept, bq_count can read the count of the whole collection
+ * in the 'cached' mode, without scanning the collection. The count is kept
+ * up to date by triggers, which run once per insert or delete statement,
+ * so each write statement also updates a single row of
+ * bq_collection_counts, and concurrent writes to the collection wait on
+ * each other to do so.
+ * Returns a boolean indicating whether the setting was changed.
+ */
+CREATE OR REPLACE FUNCTION bq_set_cached_count(i_coll text, i_enabled boolean)
+RETURNS BOOLEAN AS $$
+BEGIN
+  IF NOT (SELECT bq_collection_exists(i_coll))
+  THEN
+    RAISE EXCEPTION 'Collection "%" does not exist', i_coll;
+  END IF;
+  IF i_enabled IS NULL
+  THEN
+    RAISE EXCEPTION 'Invalid cached count setting null'
+    USING HINT = 'The setting should be true to enable the cached count, or false to disable it';
+  END IF;
+  IF i_enabled = EXISTS(SELECT 1 FROM bq_collection_counts
+                        WHERE schema_name = current_schema()
+                        AND collection_name = i_coll)
+  THEN
+    RETURN false;
+  END IF;
+  IF i_enabled
+  THEN
+    -- hold off writes until the triggers are in place
+    EXECUTE format('
+      LOCK TABLE %1$I IN SHARE ROW EXCLUSIVE MODE;
+      CREATE TRIGGER bq_count_on_insert AFTER INSERT ON %1$I
+        REFERENCING NEW TABLE AS bq_changed_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE bq_count_on_change();
+      CREATE TRIGGER bq_count_on_delete AFTER DELETE ON %1$I
+        REFERENCING OLD TABLE AS bq_changed_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE bq_count_on_change();
+      CREATE TRIGGER bq_count_on_truncate AFTER TRUNCATE ON %1$I
+        FOR EACH STATEMENT EXECUTE PROCEDURE bq_count_on_change();
+      INSERT INTO bq_collection_counts (schema_name, collection_name, doc_count)
+      SELECT current_schema(), %2$L, count(*) FROM %1$I;
+      ', i_coll, i_coll);
+  ELSE
+    EXECUTE format('
+      DROP TRIGGER bq_count_on_insert ON %1$I;
+      DROP TRIGGER bq_count_on_delete ON %1$I;
+      DROP TRIGGER bq_count_on_truncate ON %1$I;
+      ', i_coll);
+    DELETE FROM bq_collection_counts
+    WHERE schema_name = current_schema()
+    AND collection_name = i_coll;
+  END IF;
+  RETURN true;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* private - Apply the rows inserted into or deleted from a collection
+ * to its cached count.
+ */
+CREATE OR REPLACE FUNCTION bq_count_on_change()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'TRUNCATE'
+  THEN
+    UPDATE bq_collection_counts SET doc_count = 0
+    WHERE schema_name = TG_TABLE_SCHEMA
+    AND collection_name = TG_TABLE_NAME;
+  ELSE
+    UPDATE bq_collection_counts
+    SET doc_count = doc_count + (
+      SELECT count(*) * CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END
+      FROM bq_changed_rows)
+    WHERE schema_name = TG_TABLE_SCHEMA
+    AND collection_name = TG_TABLE_NAME;
+  END IF;
+  RETURN null;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
 /* Get a list of existing collections.
- * This checks information_schema for tables matching the expected structure.
+ * This reads the collection registry, for the current schema, and lists
+ * collections in the order they were created.
  */
 CREATE OR REPLACE FUNCTION bq_list_collections()
 RETURNS table(collection_name text) AS $$
 BEGIN
-RETURN QUERY SELECT table_name::text
-       FROM information_schema.columns
-       WHERE column_name = 'bq_jdoc'
-       AND data_type = 'jsonb';
+RETURN QUERY SELECT b.collection_name
+       FROM bq_collections b
+       JOIN pg_namespace n ON n.nspname = b.schema_name
+       JOIN pg_class t ON t.relnamespace = n.oid AND t.relname = b.collection_name
+       WHERE b.schema_name = current_schema()
+       ORDER BY b.created, t.oid;
+END
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+
+/* Get statistics about collections.
+ * Returns a row for each collection in the current schema, or just for
+ * i_coll if it is given, in the order they were created, with:
+ * - approximate_count : the number of documents
+ * - heap_bytes, toast_bytes, index_bytes : the space taken by the table,
+ *       by the TOAST table which holds large documents, and by indexes
+ * - average_document_bytes : heap_bytes and toast_bytes per document
+ * - dead_tuple_ratio : the fraction of rows which are dead, waiting for
+ *       VACUUM to remove them
+ * - last_vacuum, last_analyze : when the collection was last vacuumed or
+ *       analyzed, by hand or by autovacuum
+ * The counts and sizes are those recorded by the last VACUUM or ANALYZE,
+ * and are read from pg_class and from the statistics functions behind
+ * pg_stat_user_tables, so this takes no locks and touches no files, and is
+ * cheap enough to poll. Partitioned collections include their partitions.
+ */
+CREATE OR REPLACE FUNCTION bq_collection_stats(i_coll text DEFAULT null)
+RETURNS table(collection_name text, approximate_count bigint, heap_bytes bigint, toast_bytes bigint, index_bytes bigint, average_document_bytes bigint, dead_tuple_ratio double precision, last_vacuum timestamptz, last_analyze timestamptz) AS $$
+DECLARE
+  block_size bigint = current_setting('block_size')::bigint;
+BEGIN
+RETURN QUERY SELECT b.collection_name,
+       sum(CASE WHEN r.reltuples >= 0 THEN r.reltuples
+                ELSE pg_stat_get_live_tuples(r.oid) END)::bigint,
+       sum(r.relpages)::bigint * block_size,
+       coalesce(sum(toast.relpages), 0)::bigint * block_size,
+       coalesce(sum(ix.pages), 0)::bigint * block_size,
+       ((sum(r.relpages) + coalesce(sum(toast.relpages), 0)) * block_size
+        / nullif(sum(greatest(r.reltuples, 0)), 0))::bigint,
+       sum(pg_stat_get_dead_tuples(r.oid))::double precision
+        / nullif(sum(pg_stat_get_live_tuples(r.oid) + pg_stat_get_dead_tuples(r.oid)), 0),
+       max(greatest(pg_stat_get_last_vacuum_time(r.oid),
+                    pg_stat_get_last_autovacuum_time(r.oid))),
+       max(greatest(pg_stat_get_last_analyze_time(r.oid),
+                    pg_stat_get_last_autoanalyze_time(r.oid)))
+       FROM bq_collections b
+       JOIN pg_namespace n ON n.nspname = b.schema_name
+       JOIN pg_class t ON t.relnamespace = n.oid AND t.relname = b.collection_name
+       -- the table, or its partitions
+       JOIN LATERAL (SELECT t.oid WHERE t.relkind <> 'p'
+                     UNION ALL
+                     SELECT i.inhrelid FROM pg_inherits i
+                     WHERE i.inhparent = t.oid) AS p(relid) ON true
+       JOIN pg_class r ON r.oid = p.relid
+       LEFT JOIN pg_class toast ON toast.oid = r.reltoastrelid
+       LEFT JOIN LATERAL (SELECT sum(c.relpages) AS pages
+                          FROM pg_index x
+                          JOIN pg_class c ON c.oid = x.indexrelid
+                          WHERE x.indrelid = r.oid) AS ix ON true
+       WHERE b.schema_name = current_schema()
+       AND (i_coll IS NULL OR b.collection_name = i_coll)
+       GROUP BY b.collection_name, b.created, t.oid
+       ORDER BY b.created, t.oid;
 END
 $$ LANGUAGE plpgsql SECURITY DEFINER;
 
@@ -52,6 +938,9 @@ BEGIN
 IF (SELECT bq_collection_exists(i_coll))
 THEN
     EXECUTE format('DROP TABLE %I CASCADE;', i_coll);
+    DELETE FROM bq_collections
+    WHERE schema_name = current_schema()
+    AND collection_name = i_coll;
     RETURN true;
 ELSE
     RETURN false;
@@ -0,0 +1,299 @@
+-- # -- # -- # -- # -- #
+-- Aggregation
+-- # -- # -- # -- # -- #
+
+
+/* private - the smaller of two jsonb values, for bq_jsonb_min.
+ */
+CREATE OR REPLACE FUNCTION bq_jsonb_smaller(i_left jsonb, i_right jsonb)
+RETURNS jsonb AS $$
+  SELECT least(i_left, i_right);
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+
+/* private - the larger of two jsonb values, for bq_jsonb_max.
+ */
+CREATE OR REPLACE FUNCTION bq_jsonb_larger(i_left jsonb, i_right jsonb)
+RETURNS jsonb AS $$
+  SELECT greatest(i_left, i_right);
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+
+-- Minimum and maximum of jsonb values, in the same order as sorts.
+-- The state is itself a value, so partial results from parallel workers
+-- combine with the same function.
+CREATE AGGREGATE bq_jsonb_min(jsonb) (
+    SFUNC = bq_jsonb_smaller,
+    STYPE = jsonb,
+    COMBINEFUNC = bq_jsonb_smaller,
+    PARALLEL = SAFE
+);
+
+CREATE AGGREGATE bq_jsonb_max(jsonb) (
+    SFUNC = bq_jsonb_larger,
+    STYPE = jsonb,
+    COMBINEFUNC = bq_jsonb_larger,
+    PARALLEL = SAFE
+);
+
+
+/* private - transform an operand in an aggregation pipeline into an
+ * expression. A string starting with '$' refers to a (dotted) field of
+ * the document, as in "$address.city", and any other value is a constant,
+ * which is read from the pipeline parameter, as i_param.
+ */
+CREATE OR REPLACE FUNCTION bq_aggregate_operand_to_text(i_operand jsonb, i_param text)
+RETURNS text AS $$
+BEGIN
+  IF jsonb_typeof(i_operand) = 'string' AND (i_operand#>>'{}') LIKE '$%'
+  THEN
+    RETURN format(
+      '(bq_jdoc#>%L)',
+      regexp_split_to_array(substr(i_operand#>>'{}', 2), '\.'));
+  END IF;
+  RETURN format('(%s)', i_param);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - transform the operand of a $group stage into the select
+ * list and GROUP BY expression of a query.
+ */
+CREATE OR REPLACE FUNCTION bq_group_to_text(i_group jsonb, i_param text, OUT o_select text, OUT o_group text)
+AS $$
+DECLARE
+  field RECORD;
+  accumulator text;
+  operand jsonb;
+  value_text text;
+  fields text[] = '{}';
+BEGIN
+  IF jsonb_typeof(i_group) <> 'object' OR NOT i_group ? '_id'
+  THEN
+    RAISE EXCEPTION 'Invalid $group stage %', i_group
+    USING HINT = 'A $group stage should be an object with an _id field';
+  END IF;
+  -- the group key
+  IF jsonb_typeof(i_group->'_id') = 'object'
+  THEN
+    SELECT format('jsonb_build_object(%s)', string_agg(
+             format('%L, %s', k.key, bq_aggregate_operand_to_text(
+               k.value, format('%s->''_id''->%L', i_param, k.key))),
+             ', '))
+    INTO o_group
+    FROM jsonb_each(i_group->'_id') AS k;
+  ELSE
+    o_group := bq_aggregate_operand_to_text(
+      i_group->'_id', format('%s->''_id''', i_param));
+  END IF;
+  o_group := coalesce(o_group, '''{}''::jsonb');
+  fields := fields || format('''_id'', %s', o_group);
+  -- the accumulated fields
+  FOR field IN SELECT key, value FROM jsonb_each(i_group) WHERE key <> '_id' LOOP
+    IF jsonb_typeof(field.value) <> 'object'
+       OR (SELECT count(*) FROM jsonb_object_keys(field.value)) <> 1
+    THEN
+      RAISE EXCEPTION 'Invalid $group field "%"', field.key
+      USING HINT = 'A $group field should be an accumulator, like {"$sum": "$amount"}';
+    END IF;
+    accumulator := (SELECT a FROM jsonb_object_keys(field.value) AS a);
+    operand := field.value->accumulator;
+    value_text := bq_aggregate_operand_to_text(
+      operand, format('%s->%L->%L', i_param, field.key, accumulator));
+    value_text := CASE accumulator
+      WHEN '$sum' THEN format(
+        'to_jsonb(coalesce(sum(CASE WHEN jsonb_typeof(%1$s) = ''number'' THEN (%1$s#>>''{}'')::numeric END), 0))',
+        value_text)
+      WHEN '$avg' THEN format(
+        'to_jsonb(avg(CASE WHEN jsonb_typeof(%1$s) = ''number'' THEN (%1$s#>>''{}'')::numeric END))',
+        value_text)
+      WHEN '$min' THEN format(
+        'bq_jsonb_min(nullif(%s, ''null''::jsonb))', value_text)
+      WHEN '$max' THEN format(
+        'bq_jsonb_max(nullif(%s, ''null''::jsonb))', value_text)
+      WHEN '$count' THEN
+        'to_jsonb(count(*))'
+      END;
+    IF value_text IS NULL
+    THEN
+      RAISE EXCEPTION 'Invalid $group accumulator "%"', accumulator
+      USING HINT = 'Supported accumulators are $sum, $avg, $min, $max and $count';
+    END IF;
+    fields := fields || format('%L, %s', field.key, value_text);
+  END LOOP;
+  o_select := format('jsonb_build_object(%s)', array_to_string(fields, ', '));
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - compile an aggregation pipeline into a query on a collection.
+ * The query takes the pipeline as the parameter $1, and returns
+ * documents as jsonb, in a bq_jdoc column.
+ * Consecutive stages are folded into one SELECT where the order of its
+ * clauses allows it, so that a leading $match and $sort are run directly
+ * against the collection, where they can use its indexes. Otherwise the
+ * previous stages become a subquery, which exposes the _id field of its
+ * documents as an _id column, like a collection does.
+ */
+CREATE OR REPLACE FUNCTION bq_pipeline_to_text(i_coll text, i_pipeline json)
+RETURNS text AS $$
+DECLARE
+  stage RECORD;
+  operator text;
+  operand jsonb;
+  param text;
+  stage_rank int;
+  layer_rank int = 0;
+  layer_count int = 0;
+  from_text text = quote_ident(i_coll);
+  select_text text = 'bq_jdoc';
+  where_text text[] = '{}';
+  group_text text;
+  order_text text;
+  offset_text text;
+  limit_text text;
+  layer_text text;
+BEGIN
+  IF json_typeof(i_pipeline) IS DISTINCT FROM 'array'
+  THEN
+    RAISE EXCEPTION
+    'Invalid pipeline parameter json type "%"', json_typeof(i_pipeline)
+    USING HINT = 'The pipeline should be a json array of stages';
+  END IF;
+  FOR stage IN
+    SELECT s.value, s.stage_index - 1 AS stage_index
+    FROM jsonb_array_elements(i_pipeline::jsonb) WITH ORDINALITY AS s(value, stage_index)
+  LOOP
+    IF jsonb_typeof(stage.value) <> 'object'
+       OR (SELECT count(*) FROM jsonb_object_keys(stage.value)) <> 1
+    THEN
+      RAISE EXCEPTION 'Invalid pipeline stage %', stage.value
+      USING HINT = 'A pipeline stage should be an object with a single key, like {"$limit": 10}';
+    END IF;
+    operator := (SELECT k FROM jsonb_object_keys(stage.value) AS k);
+    operand := stage.value->operator;
+    param := format('$1->%s->%L', stage.stage_index, operator);
+    stage_rank := CASE operator
+      WHEN '$match' THEN 1
+      WHEN '$group' THEN 2
+      WHEN '$project' THEN 2
+      WHEN '$sort' THEN 3
+      WHEN '$skip' THEN 4
+      WHEN '$limit' THEN 5
+    END;
+    IF stage_rank IS NULL
+    THEN
+      RAISE EXCEPTION 'Invalid pipeline stage "%"', operator
+      USING HINT = 'Supported stages are $match, $group, $sort, $skip, $limit and $project';
+    END IF;
+    -- start a new layer, if this stage can't be folded into the current one
+    IF stage_rank < layer_rank
+       OR (stage_rank = layer_rank AND stage_rank <> 1)
+       OR (stage_rank = 3 AND select_text <> 'bq_jdoc')
+    THEN
+      layer_text := bq_pipeline_layer_text(
+        from_text, select_text, where_text, group_text,
+        order_text, offset_text, limit_text);
+      from_text := format(
+        '(SELECT l.bq_jdoc, l.bq_jdoc->>''_id'' AS _id FROM (%s) AS l) AS stage_%s',
+        layer_text, layer_count);
+      layer_count := layer_count + 1;
+      select_text := 'bq_jdoc';
+      where_text := '{}';
+      group_text := null;
+      order_text := null;
+      offset_text := null;
+      limit_text := null;
+    END IF;
+    layer_rank := stage_rank;
+    CASE operator
+    WHEN '$match' THEN
+      IF jsonb_typeof(operand) <> 'object'
+      THEN
+        RAISE EXCEPTION 'Invalid $match stage %', operand
+        USING HINT = 'A $match stage should be a query document';
+      END IF;
+      where_text := where_text || bq_query_to_text(operand::json, format('(%s)', param));
+    WHEN '$group' THEN
+      SELECT g.o_select, g.o_group INTO select_text, group_text
+      FROM bq_group_to_text(operand, param) AS g;
+    WHEN '$project' THEN
+      select_text := bq_projection_to_text(operand::json);
+    WHEN '$sort' THEN
+      IF jsonb_typeof(operand) <> 'array'
+      THEN
+        RAISE EXCEPTION 'Invalid $sort stage %', operand
+        USING HINT = 'A $sort stage should be a json array, as for bq_find';
+      END IF;
+      order_text := bq_sort_to_text(operand::json);
+    WHEN '$skip', '$limit' THEN
+      IF jsonb_typeof(operand) <> 'number' OR (operand#>>'{}') !~ '^\d+$'
+      THEN
+        RAISE EXCEPTION 'Invalid % stage %', operator, operand
+        USING HINT = 'The $skip and $limit stages take a whole number, like {"$limit": 10}';
+      END IF;
+      IF operator = '$skip'
+      THEN
+        offset_text := format('offset (%s#>>''{}'')::bigint', param);
+      ELSE
+        limit_text := format('limit (%s#>>''{}'')::bigint', param);
+      END IF;
+    END CASE;
+  END LOOP;
+  RETURN bq_pipeline_layer_text(
+    from_text, select_text, where_text, group_text,
+    order_text, offset_text, limit_text);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - assemble one SELECT of a compiled aggregation pipeline.
+ */
+CREATE OR REPLACE FUNCTION bq_pipeline_layer_text(i_from text, i_select text, i_where text[], i_group text, i_order text, i_offset text, i_limit text)
+RETURNS text AS $$
+BEGIN
+  RETURN concat_ws(' ',
+    format('SELECT %s AS bq_jdoc FROM %s', i_select, i_from),
+    'WHERE ' || nullif(array_to_string(i_where, ' AND '), ''),
+    'GROUP BY ' || i_group,
+    i_order,
+    i_offset,
+    i_limit);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* aggregate documents
+ * Runs the documents of a collection through a pipeline of stages,
+ * which is compiled into a single query. The pipeline is a json array,
+ * and each stage is an object with one of the following keys:
+ * - {"$match": {...}} : keep only documents matching a query document,
+ *       as for bq_find
+ * - {"$group": {"_id": "$city", "total": {"$sum": "$amount"}}} : group
+ *       documents on the _id expression, which may be a field reference,
+ *       an object of field references, or a constant. The other fields
+ *       are accumulated over each group, with $sum, $avg, $min, $max or
+ *       $count. Operands starting with '$' refer to (dotted) fields
+ * - {"$sort": [{"total": -1}]} : sort documents, as for bq_find
+ * - {"$skip": 10} : skip a number of documents
+ * - {"$limit": 10} : limit the number of documents
+ * - {"$project": {"name": 1}} : pick out fields, as for bq_find
+ * Returns the documents which come out of the last stage.
+ */
+CREATE OR REPLACE FUNCTION bq_aggregate(i_coll text, i_pipeline json)
+RETURNS table(bq_jdoc json) AS $$
+BEGIN
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L)',
+        bq_prepared_statement(
+            format(
+                'SELECT bq_jdoc::json FROM (%s) AS pipeline',
+                bq_pipeline_to_text(i_coll, i_pipeline)),
+            'jsonb'),
+        i_pipeline
+    );
+END IF;
+END
+$$ LANGUAGE plpgsql;
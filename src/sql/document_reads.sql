@@ -4,36 +4,77 @@
 
 
 /* find one
+ * The optional i_projection parameter limits the fields of the document
+ * which are returned, as for bq_find.
  */
-CREATE OR REPLACE FUNCTION bq_find_one(i_coll text, i_json_query json)
+CREATE OR REPLACE FUNCTION bq_find_one(i_coll text, i_json_query json, i_projection json DEFAULT null)
 RETURNS table(bq_jdoc json) AS $$
 BEGIN
+RETURN QUERY SELECT d.bq_jdoc::json
+FROM bq_find_one_jsonb(i_coll, i_json_query::jsonb, i_projection) AS d;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* find one, as jsonb
+ * Like bq_find_one, but takes the query and returns the document as
+ * jsonb, saving the conversions to and from json text.
+ */
+CREATE OR REPLACE FUNCTION bq_find_one_jsonb(i_coll text, i_json_query jsonb, i_projection json DEFAULT null)
+RETURNS table(bq_jdoc jsonb) AS $$
+BEGIN
 IF (SELECT bq_collection_exists(i_coll))
 THEN
     RETURN QUERY EXECUTE format(
-        'SELECT bq_jdoc::json FROM %I
-        WHERE bq_jdoc @> (%s)::jsonb
-        LIMIT 1',
-        i_coll,
-        quote_literal(i_json_query)
+        'EXECUTE %I(%L)',
+        bq_prepared_statement(
+            format(
+                'SELECT %s FROM %I
+                WHERE %s
+                LIMIT 1',
+                bq_projection_to_text(i_projection),
+                i_coll,
+                bq_query_to_text(i_json_query::json)),
+            'jsonb'),
+        i_json_query
     );
 END IF;
 END
 $$ LANGUAGE plpgsql;
 
 
--- find one by id
-CREATE OR REPLACE FUNCTION bq_find_one_by_id(i_coll text, i_id text)
+/* find one by id
+ * The optional i_projection parameter limits the fields of the document
+ * which are returned, as for bq_find.
+ */
+CREATE OR REPLACE FUNCTION bq_find_one_by_id(i_coll text, i_id text, i_projection json DEFAULT null)
 RETURNS table(bq_jdoc json) AS $$
 BEGIN
+RETURN QUERY SELECT d.bq_jdoc::json
+FROM bq_find_one_by_id_jsonb(i_coll, i_id, i_projection) AS d;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* find one by id, as jsonb
+ * Like bq_find_one_by_id, but returns the document as jsonb.
+ */
+CREATE OR REPLACE FUNCTION bq_find_one_by_id_jsonb(i_coll text, i_id text, i_projection json DEFAULT null)
+RETURNS table(bq_jdoc jsonb) AS $$
+BEGIN
 IF (SELECT bq_collection_exists(i_coll))
 THEN
     RETURN QUERY EXECUTE format(
-        'SELECT bq_jdoc::json FROM %I
-        WHERE _id = %s
-        LIMIT 1',
-        i_coll,
-        quote_literal(i_id)
+        'EXECUTE %I(%L)',
+        bq_prepared_statement(
+            format(
+                'SELECT %s FROM %I
+                WHERE _id = $1
+                LIMIT 1',
+                bq_projection_to_text(i_projection),
+                i_coll),
+            'text'),
+        i_id
     );
 END IF;
 END
@@ -41,11 +82,106 @@ $$ LANGUAGE plpgsql;
 
 
 /* find many documents
+ * The optional i_projection parameter limits the fields of each document
+ * which are returned, so that only the fields which are needed are sent
+ * to the client. It either includes fields, as in {"name": 1, "address.city": 1},
+ * or excludes them, as in {"likes": 0}. The _id field is always
+ * included, unless excluded with {"_id": 0}.
  */
-CREATE OR REPLACE FUNCTION bq_find(i_coll text, i_json_query json, i_skip integer DEFAULT 0, i_limit integer DEFAULT null, i_sort json DEFAULT null)
+CREATE OR REPLACE FUNCTION bq_find(i_coll text, i_json_query json, i_skip integer DEFAULT 0, i_limit integer DEFAULT null, i_sort json DEFAULT null, i_projection json DEFAULT null)
 RETURNS table(bq_jdoc json) AS $$
+BEGIN
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L, %L, %L)',
+        bq_prepared_statement(
+            bq_find_to_text(i_coll, i_json_query, i_sort, i_projection, 'json'),
+            'jsonb, integer, integer'),
+        i_json_query,
+        i_limit,
+        i_skip
+    );
+END IF;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* find many documents, as jsonb
+ * Like bq_find, but takes the query and returns the documents as jsonb,
+ * saving the conversions to and from json text for every document.
+ */
+CREATE OR REPLACE FUNCTION bq_find_jsonb(i_coll text, i_json_query jsonb, i_skip integer DEFAULT 0, i_limit integer DEFAULT null, i_sort json DEFAULT null, i_projection json DEFAULT null)
+RETURNS table(bq_jdoc jsonb) AS $$
+BEGIN
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L, %L, %L)',
+        bq_prepared_statement(
+            bq_find_to_text(i_coll, i_json_query::json, i_sort, i_projection, 'jsonb'),
+            'jsonb, integer, integer'),
+        i_json_query,
+        i_limit,
+        i_skip
+    );
+END IF;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* find many documents, through a cursor
+ * Takes the same parameters as bq_find, and opens a cursor over the same
+ * documents, which the client can then FETCH from in batches, within the
+ * same transaction. Unlike bq_find, the result is never gathered up on
+ * the server, so very large results stream out in constant memory.
+ * The cursor is given the name i_cursor, if supplied.
+ * Returns the cursor.
+ */
+CREATE OR REPLACE FUNCTION bq_find_cursor(i_coll text, i_json_query json, i_skip integer DEFAULT 0, i_limit integer DEFAULT null, i_sort json DEFAULT null, i_cursor refcursor DEFAULT null)
+RETURNS refcursor AS $$
 DECLARE
-  q text = format('select bq_jdoc::json from %I where 1=1', i_coll);
+  o_cursor refcursor = i_cursor;
+BEGIN
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    OPEN o_cursor FOR EXECUTE bq_find_to_text(i_coll, i_json_query, i_sort, null, 'json')
+    USING i_json_query::jsonb, i_limit, i_skip;
+ELSE
+    OPEN o_cursor FOR SELECT null::json AS bq_jdoc WHERE false;
+END IF;
+RETURN o_cursor;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* find a page of documents, using keyset pagination
+ * Like bq_find, but rather than skipping a number of documents, each page
+ * starts after the document described by a cursor. Every document comes
+ * back with an opaque cursor string, and passing the cursor of the last
+ * document on a page as i_after_cursor fetches the next page.
+ * A cursor records the sort key values and _id of its document, so each
+ * page can be read as a range of an index on the sort keys, no matter
+ * how deep into the collection it is.
+ */
+CREATE OR REPLACE FUNCTION bq_find_page(i_coll text, i_json_query json, i_sort json DEFAULT null, i_after_cursor text DEFAULT null, i_limit integer DEFAULT null)
+RETURNS table(bq_jdoc json, bq_cursor text) AS $$
+DECLARE
+  sort_key RECORD;
+  key_exprs text[] = '{}';
+  key_directions text[] = '{}';
+  key_count integer;
+  key_expr text;
+  key_value text;
+  after_cursor jsonb;
+  after_predicate text;
+  strictly_after text;
+  equal_to text;
+  first_bound text;
+  tail_predicate text;
+  order_text text = '';
+  cursor_text text = '';
+  q text;
 BEGIN
 IF (SELECT bq_collection_exists(i_coll))
 THEN
@@ -53,49 +189,272 @@ THEN
     THEN
       RAISE EXCEPTION
       'Invalid sort parameter json type "%s"', json_typeof(i_sort)
-      USING HINT = 'The i_sort parameter to bq_find should be a json array';
+      USING HINT = 'The i_sort parameter to bq_find_page should be a json array';
     END IF;
-    -- query match
-    q := q || format(' and bq_jdoc @> (%s)::jsonb ',
-                     quote_literal(i_json_query));
-    -- sort
-    IF (i_sort IS NOT NULL)
-    THEN
-      q := q || format(' %s ', bq_sort_to_text(i_sort));
-    END IF;
-    -- skip and limit
-    IF (i_limit IS NOT NULL)
+    FOR sort_key IN SELECT * FROM bq_sort_keys(coalesce(i_sort, '[]')) LOOP
+      key_expr := format('bq_jdoc#>%L', sort_key.sort_path);
+      key_exprs := key_exprs || key_expr;
+      key_directions := key_directions || sort_key.sort_direction;
+      order_text := order_text
+        || format('%s %s, ', key_expr, sort_key.sort_direction);
+      cursor_text := cursor_text
+        || format('CASE WHEN %1$s IS NULL THEN ''[]''::jsonb
+                   ELSE jsonb_build_array(%1$s) END, ', key_expr);
+    END LOOP;
+    key_count := coalesce(array_length(key_exprs, 1), 0);
+    order_text := order_text || '_id';
+    cursor_text := format(
+      'translate(encode(convert_to(jsonb_build_array(%s_id)::text, ''UTF8''),
+                        ''base64''), E''\n'', '''')',
+      cursor_text);
+
+    IF i_after_cursor IS NULL
     THEN
-      q := q || format(' limit %s ', i_limit);
+      q := format(
+        'SELECT bq_jdoc::json, %s FROM %I
+        WHERE %s
+        ORDER BY %s
+        LIMIT $3',
+        cursor_text, i_coll, bq_query_to_text(i_json_query), order_text);
     ELSE
-      q := q || format(' limit NULL ');
+      after_cursor := convert_from(decode(i_after_cursor, 'base64'), 'UTF8');
+      IF jsonb_typeof(after_cursor) IS DISTINCT FROM 'array'
+         OR jsonb_array_length(after_cursor) <> key_count + 1
+      THEN
+        RAISE EXCEPTION 'Invalid cursor "%"', i_after_cursor
+        USING HINT = 'Cursors must come from bq_find_page, with the same sort';
+      END IF;
+      -- build the 'comes after the cursor' predicate from the last key out.
+      -- A missing (null) key sorts last when ascending, first when descending.
+      after_predicate := format('_id > ($2->>%s)', key_count);
+      FOR i IN REVERSE key_count..1 LOOP
+        key_expr := key_exprs[i];
+        key_value := format('($2->%s->0)', i - 1);
+        IF (after_cursor->(i - 1)) = '[]'::jsonb
+        THEN
+          equal_to := format('%s IS NULL', key_expr);
+          IF key_directions[i] = 'ASC' OR i = 1
+          THEN
+            strictly_after := 'false';
+          ELSE
+            strictly_after := format('%s IS NOT NULL', key_expr);
+          END IF;
+        ELSE
+          equal_to := format('%s = %s', key_expr, key_value);
+          IF key_directions[i] = 'DESC'
+          THEN
+            strictly_after := format('%s < %s', key_expr, key_value);
+          ELSIF i = 1
+          THEN
+            strictly_after := format('%s > %s', key_expr, key_value);
+          ELSE
+            strictly_after := format('(%1$s > %2$s OR %1$s IS NULL)',
+                                     key_expr, key_value);
+          END IF;
+        END IF;
+        after_predicate := format('(%s OR (%s AND %s))',
+                                  strictly_after, equal_to, after_predicate);
+      END LOOP;
+      IF key_count = 0
+      THEN
+        q := format(
+          'SELECT bq_jdoc::json, %s FROM %I
+          WHERE %s AND %s
+          ORDER BY %s
+          LIMIT $3',
+          cursor_text, i_coll, bq_query_to_text(i_json_query),
+          after_predicate, order_text);
+      ELSE
+        -- the first sort key bounds an index range scan. Documents on the
+        -- other side of that key's nulls follow on, in a second branch.
+        key_expr := key_exprs[1];
+        key_value := '($2->0->0)';
+        IF (after_cursor->0) = '[]'::jsonb
+        THEN
+          first_bound := format('%s IS NULL', key_expr);
+          IF key_directions[1] = 'DESC'
+          THEN
+            tail_predicate := format('%s IS NOT NULL', key_expr);
+          END IF;
+        ELSIF key_directions[1] = 'DESC'
+        THEN
+          first_bound := format('%s <= %s', key_expr, key_value);
+        ELSE
+          first_bound := format('%s >= %s', key_expr, key_value);
+          tail_predicate := format('%s IS NULL', key_expr);
+        END IF;
+        q := format(
+          '(SELECT bq_jdoc, _id, 1 AS bq_page_branch FROM %I
+            WHERE %s AND %s AND %s
+            ORDER BY %s
+            LIMIT $3)',
+          i_coll, bq_query_to_text(i_json_query),
+          first_bound, after_predicate, order_text);
+        IF tail_predicate IS NOT NULL
+        THEN
+          q := q || format(
+            ' UNION ALL
+            (SELECT bq_jdoc, _id, 2 AS bq_page_branch FROM %I
+              WHERE %s AND %s
+              ORDER BY %s
+              LIMIT $3)',
+            i_coll, bq_query_to_text(i_json_query),
+            tail_predicate, order_text);
+        END IF;
+        q := format(
+          'SELECT bq_jdoc::json, %s FROM (%s) page
+          ORDER BY bq_page_branch, %s
+          LIMIT $3',
+          cursor_text, q, order_text);
+      END IF;
     END IF;
-    -- final query
-    q := q || format(' offset %s ', i_skip);
-    RETURN QUERY EXECUTE q;
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L, %L, %L)',
+        bq_prepared_statement(q, 'jsonb, jsonb, integer'),
+        i_json_query,
+        after_cursor,
+        i_limit
+    );
 END IF;
 END
 $$ LANGUAGE plpgsql;
 
 
 /* count documents in collection
+ * The i_mode parameter chooses how the documents are counted:
+ * - 'exact' : count the matching documents (the default)
+ * - 'estimated' : estimate the count without reading the documents. The
+ *       count of the whole collection comes from the table statistics in
+ *       pg_class, and the count for any other query from the planner's
+ *       estimate of the rows it matches, so these are only as accurate as
+ *       the last ANALYZE of the collection.
+ * - 'cached' : read the count of the whole collection from the count which
+ *       is kept for it, if bq_set_cached_count has been called on it. Only
+ *       the empty query, {}, can be counted in this mode.
  */
-CREATE OR REPLACE FUNCTION bq_count(i_coll text, i_doc json)
+CREATE OR REPLACE FUNCTION bq_count(i_coll text, i_doc json, i_mode text DEFAULT 'exact')
 RETURNS integer AS $$
 DECLARE
   o_value int;
+  plan json;
 BEGIN
-IF (SELECT bq_collection_exists(i_coll))
+IF i_mode IS NULL OR i_mode NOT IN ('exact', 'estimated', 'cached')
+THEN
+  RAISE EXCEPTION 'Invalid count mode "%"', i_mode
+  USING HINT = 'The count mode should be "exact", "estimated" or "cached"';
+END IF;
+IF NOT (SELECT bq_collection_exists(i_coll))
+THEN
+  RETURN 0;
+END IF;
+IF i_mode = 'cached'
 THEN
+  IF i_doc::jsonb <> '{}'
+  THEN
+    RAISE EXCEPTION 'Cannot count documents matching % from the cached count', i_doc
+    USING HINT = 'Only the whole collection, with the query {}, can be counted in the cached mode';
+  END IF;
+  SELECT doc_count FROM bq_collection_counts
+  WHERE schema_name = current_schema()
+  AND collection_name = i_coll
+  INTO o_value;
+  IF NOT FOUND
+  THEN
+    RAISE EXCEPTION 'Collection "%" has no cached count', i_coll
+    USING HINT = 'Call bq_set_cached_count to keep a count of the collection';
+  END IF;
+ELSIF i_mode = 'estimated'
+THEN
+  IF i_doc::jsonb = '{}'
+  THEN
+    -- scale the tuple density from the last ANALYZE up to the current
+    -- size, in the same way as the planner does
+    SELECT round(c.reltuples / c.relpages
+                 * (pg_relation_size(c.oid) / current_setting('block_size')::int))
+    FROM pg_class c
+    WHERE c.oid = quote_ident(i_coll)::regclass
+    AND c.reltuples >= 0 AND c.relpages > 0
+    INTO o_value;
+  END IF;
+  IF o_value IS NULL
+  THEN
+    -- planned with the query document inlined, rather than as a prepared
+    -- statement, which may switch to a generic plan that estimates the
+    -- same count for every query of the same shape
+    EXECUTE format(
+      'EXPLAIN (FORMAT JSON) SELECT _id from %I
+      WHERE %s',
+      i_coll,
+      bq_query_to_text(i_doc, format('%L::jsonb', i_doc))
+    ) INTO plan;
+    o_value := (plan->0->'Plan'->>'Plan Rows')::numeric;
+  END IF;
+ELSE
   EXECUTE format(
-    'SELECT COUNT(_id) from %I
-    WHERE bq_jdoc @> (%s)::jsonb',
-     i_coll,
-     quote_literal(i_doc)
+    'EXECUTE %I(%L)',
+    bq_prepared_statement(
+      format(
+        'SELECT COUNT(_id) from %I
+        WHERE %s',
+        i_coll,
+        bq_query_to_text(i_doc)),
+      'jsonb'),
+    i_doc
   ) INTO o_value;
-  RETURN o_value;
-ELSE
-  return 0;
+END IF;
+RETURN o_value;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* distinct values of a field
+ * Returns the distinct values of the (dotted) field i_path among the
+ * documents which match the query, in sort order. Documents which lack
+ * the field are skipped.
+ * When the collection has an index whose first field is i_path, as added
+ * by bq_add_index, the values are read with a loose index scan, which
+ * jumps from each value to the next in the index rather than visiting
+ * every document, so fields with few distinct values are fast to list.
+ */
+CREATE OR REPLACE FUNCTION bq_distinct(i_coll text, i_path text, i_json_query json DEFAULT '{}')
+RETURNS setof json AS $$
+DECLARE
+  field_text text = format('(bq_jdoc#>%L)', regexp_split_to_array(i_path, '\.'));
+  q text;
+BEGIN
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    IF EXISTS(SELECT 1 FROM bq_list_indexes(i_coll) AS i
+              WHERE (SELECT k FROM json_object_keys(i.index_spec) AS k LIMIT 1) = i_path)
+    THEN
+        q := format('
+          WITH RECURSIVE
+            field_values(field_value) AS
+            ((SELECT %1$s FROM %2$I
+              WHERE %1$s IS NOT NULL AND %3$s
+              ORDER BY %1$s LIMIT 1)
+             UNION ALL
+             SELECT (SELECT %1$s FROM %2$I
+                     WHERE %1$s > v.field_value AND %3$s
+                     ORDER BY %1$s LIMIT 1)
+             FROM field_values v
+             WHERE v.field_value IS NOT NULL)
+          SELECT field_value::json FROM field_values
+          WHERE field_value IS NOT NULL
+          ', field_text, i_coll, bq_query_to_text(i_json_query));
+    ELSE
+        q := format('
+          SELECT field_value::json FROM
+            (SELECT DISTINCT %1$s AS field_value FROM %2$I
+             WHERE %1$s IS NOT NULL AND %3$s) AS d
+          ORDER BY d.field_value
+          ', field_text, i_coll, bq_query_to_text(i_json_query));
+    END IF;
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L)',
+        bq_prepared_statement(q, 'jsonb'),
+        i_json_query
+    );
 END IF;
 END
 $$ LANGUAGE plpgsql;
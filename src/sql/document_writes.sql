@@ -7,28 +7,93 @@
  */
 CREATE OR REPLACE FUNCTION bq_insert(i_coll text, i_jdoc json)
 RETURNS text AS $$
+BEGIN
+RETURN bq_insert_jsonb(i_coll, i_jdoc::jsonb);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* insert document, as jsonb
+ * Like bq_insert, but takes the document as jsonb, which is stored
+ * without being converted from json text.
+ */
+CREATE OR REPLACE FUNCTION bq_insert_jsonb(i_coll text, i_jdoc jsonb)
+RETURNS text AS $$
 DECLARE
-  doc json;
+  doc jsonb;
+  range_partitioned boolean;
 BEGIN
 PERFORM bq_create_collection(i_coll);
+range_partitioned := coalesce(bq_collection_partitioning(i_coll) ? 'range', false);
 IF (select i_jdoc->'_id') is null
 THEN
-  select bq_doc_set_key(i_jdoc, '_id', (select bq_generate_id())) into doc;
+  select bq_doc_set_key(
+    i_jdoc, '_id', bq_generate_id_with(bq_collection_id_strategy(i_coll)))
+  into doc;
 ELSE
   PERFORM bq_check_id_type(i_jdoc);
+  IF range_partitioned
+  THEN
+    PERFORM bq_check_time_ids(jsonb_build_array(i_jdoc));
+  END IF;
   doc := i_jdoc;
 END IF;
+-- collections partitioned on created take it from the time in the _id,
+-- so that the (_id, created) primary key keeps _id unique
 EXECUTE format(
-    'INSERT INTO %I (_id, bq_jdoc) VALUES (%s, %s);',
-    i_coll,
-    quote_literal(doc->>'_id'),
-    quote_literal(doc)
-);
+    'INSERT INTO %I (_id, bq_jdoc, created) VALUES ($1, $2, coalesce($3, current_timestamp));',
+    i_coll
+) USING doc->>'_id', doc,
+  CASE WHEN range_partitioned THEN bq_time_id_timestamp(doc->>'_id') END;
 return doc->>'_id';
 END
 $$ LANGUAGE plpgsql;
 
 
+/* insert many documents
+ * The supplied json value should be an array of documents, which are
+ * written to the collection in a single INSERT statement. Documents which
+ * lack an '_id' field are given a generated one.
+ * Returns the _id of each document, in the same order as the input array.
+ */
+CREATE OR REPLACE FUNCTION bq_insert_many(i_coll text, i_docs json)
+RETURNS setof text AS $$
+BEGIN
+RETURN QUERY SELECT bq_insert_many_jsonb(i_coll, i_docs::jsonb);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* insert many documents, as jsonb
+ * Like bq_insert_many, but takes the array of documents as jsonb.
+ */
+CREATE OR REPLACE FUNCTION bq_insert_many_jsonb(i_coll text, i_docs jsonb)
+RETURNS setof text AS $$
+DECLARE
+  range_partitioned boolean;
+BEGIN
+PERFORM bq_create_collection(i_coll);
+range_partitioned := coalesce(bq_collection_partitioning(i_coll) ? 'range', false);
+IF range_partitioned
+THEN
+  PERFORM bq_check_time_ids(i_docs);
+END IF;
+RETURN QUERY EXECUTE format('
+  WITH
+    docs AS
+    (SELECT doc_index, doc FROM bq_docs_with_ids($1, $2)),
+    inserted AS
+    (INSERT INTO %I (_id, bq_jdoc, created)
+     SELECT doc->>''_id'', doc,
+       CASE WHEN $3 THEN bq_time_id_timestamp(doc->>''_id'') ELSE current_timestamp END
+     FROM docs ORDER BY doc_index
+     RETURNING _id)
+  SELECT doc->>''_id'' FROM docs ORDER BY doc_index
+  ', i_coll) USING i_docs, bq_collection_id_strategy(i_coll), range_partitioned;
+END
+$$ LANGUAGE plpgsql;
+
+
 /* remove documents
  */
 CREATE OR REPLACE FUNCTION bq_remove(i_coll text, i_jdoc json)
@@ -36,13 +101,18 @@ RETURNS setof integer AS $$
 BEGIN
 IF (SELECT bq_collection_exists(i_coll))
 THEN
-    RETURN QUERY EXECUTE format('
-    WITH
-      deleted AS
-      (DELETE FROM %I WHERE bq_jdoc @> (%s)::jsonb RETURNING _id)
-    SELECT count(*)::integer FROM deleted
-    ', i_coll, quote_literal(i_jdoc));
-
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L)',
+        bq_prepared_statement(
+            format('
+            WITH
+              deleted AS
+              (DELETE FROM %I WHERE %s RETURNING _id)
+            SELECT count(*)::integer FROM deleted
+            ', i_coll, bq_query_to_text(i_jdoc)),
+            'jsonb'),
+        i_jdoc
+    );
 ELSE
     RETURN QUERY SELECT 0;
 END IF;
@@ -57,14 +127,20 @@ RETURNS setof integer AS $$
 BEGIN
 IF (SELECT bq_collection_exists(i_coll))
 THEN
-    RETURN QUERY EXECUTE format('
-      WITH
-        candidates AS
-        (SELECT _id from %1$I WHERE bq_jdoc @> (%2s)::jsonb LIMIT 1),
-        deleted AS
-        (DELETE FROM %1$I WHERE _id IN (select _id from candidates) RETURNING _id)
-      SELECT count(*)::integer FROM deleted
-    ', i_coll, quote_literal(i_jdoc));
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L)',
+        bq_prepared_statement(
+            format('
+              WITH
+                candidates AS
+                (SELECT _id from %1$I WHERE %2$s LIMIT 1),
+                deleted AS
+                (DELETE FROM %1$I WHERE _id IN (select _id from candidates) RETURNING _id)
+              SELECT count(*)::integer FROM deleted
+            ', i_coll, bq_query_to_text(i_jdoc)),
+            'jsonb'),
+        i_jdoc
+    );
 ELSE
     RETURN QUERY SELECT 0;
 END IF;
@@ -92,22 +168,212 @@ END
 $$ LANGUAGE plpgsql;
 
 
+/* remove expired documents
+ * Removes a batch of up to i_batch_size documents which have expired, as
+ * set by bq_set_ttl, oldest first. The batch is found through the expiry
+ * index, and documents which other transactions hold locks on are
+ * skipped, so each call is a short transaction which writes a bounded
+ * amount, and can run alongside other writes without waiting on them.
+ * Call it regularly, or repeatedly until it removes fewer documents than
+ * the batch size.
+ * Returns the number of documents removed.
+ */
+CREATE OR REPLACE FUNCTION bq_purge_expired(i_coll text, i_batch_size integer DEFAULT 1000)
+RETURNS integer AS $$
+DECLARE
+  ttl jsonb = (SELECT options->'ttl' FROM bq_collections
+               WHERE schema_name = current_schema()
+               AND collection_name = i_coll);
+  o_value int;
+BEGIN
+IF ttl IS NULL
+THEN
+  RAISE EXCEPTION 'Collection "%" has no ttl', i_coll
+  USING HINT = 'Call bq_set_ttl to set when documents expire';
+END IF;
+EXECUTE format(
+  'EXECUTE %I(%L, %L)',
+  bq_prepared_statement(
+    format('
+      WITH
+        expired AS
+        (SELECT _id FROM %1$I
+         WHERE %2$s <= current_timestamp - $1 * interval ''1 second''
+         ORDER BY %2$s
+         LIMIT $2
+         FOR UPDATE SKIP LOCKED),
+        deleted AS
+        (DELETE FROM %1$I WHERE _id IN (SELECT _id FROM expired) RETURNING _id)
+      SELECT count(*)::integer FROM deleted
+      ', i_coll, bq_ttl_expiry_text(ttl)),
+    'integer, integer'),
+  ttl->>'seconds',
+  i_batch_size
+) INTO o_value;
+RETURN o_value;
+END
+$$ LANGUAGE plpgsql;
+
+
 /* save document
+ * Inserts the document, or replaces the existing document with the
+ * same _id if there is one.
  */
 CREATE OR REPLACE FUNCTION bq_save(i_coll text, i_jdoc json)
 RETURNS text AS $$
+BEGIN
+RETURN bq_save_jsonb(i_coll, i_jdoc::jsonb);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* save document, as jsonb
+ * Like bq_save, but takes the document as jsonb.
+ */
+CREATE OR REPLACE FUNCTION bq_save_jsonb(i_coll text, i_jdoc jsonb)
+RETURNS text AS $$
 DECLARE
   o_id text;
-  existing_id_count integer;
 BEGIN
-  SELECT bq_insert(i_coll, i_jdoc) INTO o_id;
-  RETURN o_id;
-EXCEPTION WHEN unique_violation THEN
-  EXECUTE format('
-    UPDATE %I SET bq_jdoc = %s::jsonb WHERE _id = %s returning _id',
-    i_coll,
-    quote_literal(i_jdoc),
-    quote_literal(i_jdoc->>'_id')) INTO o_id;
+  SELECT bq_save_many_jsonb(i_coll, jsonb_build_array(i_jdoc)) INTO o_id;
   RETURN o_id;
 END
 $$ LANGUAGE plpgsql;
+
+
+/* save many documents
+ * The supplied json value should be an array of documents, which are
+ * upserted into the collection in a single INSERT ... ON CONFLICT statement.
+ * Documents which lack an '_id' field are given a generated one, and
+ * existing documents are replaced, with their 'updated' timestamp refreshed.
+ * If the same _id appears more than once, the last such document wins.
+ * Returns the _id of each document, in the same order as the input array.
+ */
+CREATE OR REPLACE FUNCTION bq_save_many(i_coll text, i_docs json)
+RETURNS setof text AS $$
+BEGIN
+RETURN QUERY SELECT bq_save_many_jsonb(i_coll, i_docs::jsonb);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* save many documents, as jsonb
+ * Like bq_save_many, but takes the array of documents as jsonb.
+ */
+CREATE OR REPLACE FUNCTION bq_save_many_jsonb(i_coll text, i_docs jsonb)
+RETURNS setof text AS $$
+BEGIN
+PERFORM bq_create_collection(i_coll);
+IF coalesce(bq_collection_partitioning(i_coll) ? 'range', false)
+THEN
+  -- the primary key includes created, which is the time in the _id, so
+  -- a document conflicts with the existing one of the same _id
+  PERFORM bq_check_time_ids(i_docs);
+  RETURN QUERY EXECUTE format('
+    WITH
+      docs AS
+      (SELECT doc_index, doc FROM bq_docs_with_ids($1, $2)),
+      saved AS
+      (INSERT INTO %I (_id, bq_jdoc, created)
+       SELECT DISTINCT ON (doc->>''_id'')
+         doc->>''_id'', doc, bq_time_id_timestamp(doc->>''_id'')
+       FROM docs ORDER BY doc->>''_id'', doc_index DESC
+       ON CONFLICT (_id, created) DO UPDATE
+       SET bq_jdoc = excluded.bq_jdoc, updated = current_timestamp
+       RETURNING _id)
+    SELECT doc->>''_id'' FROM docs ORDER BY doc_index
+    ', i_coll) USING i_docs, bq_collection_id_strategy(i_coll);
+  RETURN;
+END IF;
+RETURN QUERY EXECUTE format('
+  WITH
+    docs AS
+    (SELECT doc_index, doc FROM bq_docs_with_ids($1, $2)),
+    saved AS
+    (INSERT INTO %I (_id, bq_jdoc)
+     SELECT DISTINCT ON (doc->>''_id'') doc->>''_id'', doc
+     FROM docs ORDER BY doc->>''_id'', doc_index DESC
+     ON CONFLICT (_id) DO UPDATE
+     SET bq_jdoc = excluded.bq_jdoc, updated = current_timestamp
+     RETURNING _id)
+  SELECT doc->>''_id'' FROM docs ORDER BY doc_index
+  ', i_coll) USING i_docs, bq_collection_id_strategy(i_coll);
+END
+$$ LANGUAGE plpgsql;
+
+
+/* update documents
+ * Applies the update document i_update to every document which matches
+ * the query, in a single UPDATE statement, without the documents leaving
+ * the server. The update document maps update operators to fields, which
+ * may be dotted paths:
+ * - {"$set": {"address.city": "Glasgow"}} : set fields to values
+ * - {"$unset": {"nickname": 1}} : remove fields
+ * - {"$inc": {"visits": 1}} : add to number fields, or set them if missing
+ * - {"$push": {"likes": "cats"}} : append values to array fields
+ * - {"$pull": {"likes": "dogs"}} : remove all copies of values from array fields
+ * The 'updated' timestamp of each changed document is refreshed.
+ * Returns the number of documents updated.
+ */
+CREATE OR REPLACE FUNCTION bq_update(i_coll text, i_json_query json, i_update json)
+RETURNS setof integer AS $$
+BEGIN
+PERFORM bq_check_update(i_update::jsonb);
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L, %L)',
+        bq_prepared_statement(
+            format('
+            WITH
+              updated AS
+              (UPDATE %I
+               SET bq_jdoc = bq_apply_update(bq_jdoc, $2),
+                   updated = current_timestamp
+               WHERE %s RETURNING _id)
+            SELECT count(*)::integer FROM updated
+            ', i_coll, bq_query_to_text(i_json_query)),
+            'jsonb, jsonb'),
+        i_json_query,
+        i_update
+    );
+ELSE
+    RETURN QUERY SELECT 0;
+END IF;
+END
+$$ LANGUAGE plpgsql;
+
+
+/* update one document
+ * Like bq_update, but updates at most one document which matches the query.
+ * Returns the number of documents updated.
+ */
+CREATE OR REPLACE FUNCTION bq_update_one(i_coll text, i_json_query json, i_update json)
+RETURNS setof integer AS $$
+BEGIN
+PERFORM bq_check_update(i_update::jsonb);
+IF (SELECT bq_collection_exists(i_coll))
+THEN
+    RETURN QUERY EXECUTE format(
+        'EXECUTE %I(%L, %L)',
+        bq_prepared_statement(
+            format('
+              WITH
+                candidates AS
+                (SELECT _id from %1$I WHERE %2$s LIMIT 1),
+                updated AS
+                (UPDATE %1$I
+                 SET bq_jdoc = bq_apply_update(bq_jdoc, $2),
+                     updated = current_timestamp
+                 WHERE _id IN (select _id from candidates) RETURNING _id)
+              SELECT count(*)::integer FROM updated
+            ', i_coll, bq_query_to_text(i_json_query)),
+            'jsonb, jsonb'),
+        i_json_query,
+        i_update
+    );
+ELSE
+    RETURN QUERY SELECT 0;
+END IF;
+END
+$$ LANGUAGE plpgsql;
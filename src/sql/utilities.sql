@@ -15,39 +15,104 @@ END
 $$ LANGUAGE plpgsql;
 
 
-/* private - Set a key in a json document.
- */
-CREATE OR REPLACE FUNCTION bq_doc_set_key(i_jdoc json, i_key text, i_val anyelement)
-RETURNS json AS $$
-BEGIN
-RETURN (
-  SELECT concat(
-      '{',
-      string_agg(to_json("key")
-        || ':'
-        || "value", ','),
-      '}'
-    )::json
-  FROM (SELECT *
-  FROM json_each(i_jdoc)
-  WHERE key <> i_key
-  UNION ALL
-  SELECT i_key, to_json(i_val)) as "fields")::json;
+/* Generate a time-ordered string ID.
+ * The same length as the ids from bq_generate_id, made up of a time in
+ * milliseconds followed by a value from the bq_id_seq sequence, both in
+ * hex. The time is the current time, unless i_time is given, which is
+ * how documents created at some other time are given ids. Ids sort by
+ * their time, and then in the order they were generated.
+ * Used in place of bq_generate_id by collections with the "time"
+ * id strategy.
+ */
+CREATE OR REPLACE FUNCTION bq_generate_time_id (i_time timestamptz DEFAULT null)
+RETURNS char(24) AS $$
+BEGIN
+RETURN CAST(
+  lpad(to_hex((extract(epoch from coalesce(i_time, clock_timestamp())) * 1000)::bigint), 12, '0')
+  || lpad(to_hex(nextval('bq_id_seq')), 12, '0')
+  as char(24));
+END
+$$ LANGUAGE plpgsql;
+
+
+/* private - Get the time at the start of an id from bq_generate_time_id,
+ * or null if the id is not of that form.
+ */
+CREATE OR REPLACE FUNCTION bq_time_id_timestamp (i_id text)
+RETURNS timestamptz AS $$
+  SELECT CASE WHEN i_id ~ '^[0-9a-f]{24}$'
+    THEN to_timestamp(('x' || lpad(left(i_id, 12), 16, '0'))::bit(64)::bigint / 1000.0)
+  END;
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+
+/* private - Generate an ID with the supplied id strategy,
+ * either "random" or "time".
+ */
+CREATE OR REPLACE FUNCTION bq_generate_id_with(i_id_strategy text)
+RETURNS char(24) AS $$
+BEGIN
+IF i_id_strategy = 'time'
+THEN
+  RETURN bq_generate_time_id();
+END IF;
+RETURN bq_generate_id();
+END
+$$ LANGUAGE plpgsql;
+
+
+/* private - Set a key in a jsonb document.
+ */
+CREATE OR REPLACE FUNCTION bq_doc_set_key(i_jdoc jsonb, i_key text, i_val anyelement)
+RETURNS jsonb AS $$
+BEGIN
+RETURN i_jdoc || jsonb_build_object(i_key, i_val);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - Expand a json array of documents into rows, in input order.
+ * Any document which lacks an '_id' field is given one generated with the
+ * supplied id strategy, and an exception is raised if any supplied '_id'
+ * is not a string.
+ */
+CREATE OR REPLACE FUNCTION bq_docs_with_ids(i_docs jsonb, i_id_strategy text)
+RETURNS table(doc_index bigint, doc jsonb) AS $$
+BEGIN
+  IF jsonb_typeof(i_docs) != 'array'
+  THEN
+    RAISE EXCEPTION
+    'Invalid documents parameter json type "%"', jsonb_typeof(i_docs)
+    USING HINT = 'The documents parameter should be a json array';
+  END IF;
+  PERFORM bq_check_id_type(d.elem)
+  FROM jsonb_array_elements(i_docs) AS d(elem)
+  WHERE d.elem->'_id' IS NOT NULL;
+  RETURN QUERY
+  SELECT d.elem_index,
+         CASE WHEN d.elem->'_id' IS NULL
+           THEN bq_doc_set_key(d.elem, '_id', bq_generate_id_with(i_id_strategy))
+           ELSE d.elem
+         END
+  FROM jsonb_array_elements(i_docs) WITH ORDINALITY AS d(elem, elem_index);
 END
 $$ LANGUAGE plpgsql;
 
 
 /* Check if a collection exists.
- * Currently does a simple check for a table with the specified name.
+ * Looks the collection up in the bq_collections registry, within the
+ * current schema.
  */
 CREATE OR REPLACE FUNCTION bq_collection_exists (i_coll text)
 RETURNS boolean AS $$
 BEGIN
 RETURN EXISTS (
-    SELECT relname FROM pg_class WHERE relname = format('%s', i_coll)
+    SELECT 1 FROM bq_collections
+    WHERE schema_name = current_schema()
+    AND collection_name = i_coll
 );
 END
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE plpgsql STABLE;
 
 
 /* private - Ensure the _id field of the supplied json document
@@ -55,10 +120,10 @@ $$ LANGUAGE plpgsql;
  * If it's not, an exception is raised. Ideally, the client should validate
  * this is the case before submitting to the server.
  */
-CREATE OR REPLACE FUNCTION bq_check_id_type(i_jdoc json)
+CREATE OR REPLACE FUNCTION bq_check_id_type(i_jdoc jsonb)
 RETURNS VOID AS $$
 BEGIN
-  IF (SELECT json_typeof(i_jdoc->'_id')) <> 'string'
+  IF (SELECT jsonb_typeof(i_jdoc->'_id')) <> 'string'
   THEN
     RAISE EXCEPTION 'The _id field is not a string: % ', i_jdoc->'_id'
     USING HINT = 'The _id field must be a string';
@@ -67,6 +132,34 @@ END
 $$ LANGUAGE plpgsql;
 
 
+/* private - Check that each document in a json array which has a string
+ * _id has one from bq_generate_time_id, as collections partitioned on
+ * 'created' require.
+ */
+CREATE OR REPLACE FUNCTION bq_check_time_ids(i_docs jsonb)
+RETURNS VOID AS $$
+DECLARE
+  bad_id jsonb;
+BEGIN
+  -- anything but an array is rejected by bq_docs_with_ids
+  IF jsonb_typeof(i_docs) != 'array'
+  THEN
+    RETURN;
+  END IF;
+  SELECT d.elem->'_id' INTO bad_id
+  FROM jsonb_array_elements(i_docs) AS d(elem)
+  WHERE jsonb_typeof(d.elem->'_id') = 'string'
+  AND bq_time_id_timestamp(d.elem->>'_id') IS NULL
+  LIMIT 1;
+  IF FOUND
+  THEN
+    RAISE EXCEPTION 'The _id field is not a time id: %', bad_id
+    USING HINT = 'Documents in a collection partitioned on created need an _id from bq_generate_time_id, or none at all';
+  END IF;
+END
+$$ LANGUAGE plpgsql;
+
+
 /* private - Check if a dotted path exists in a document
  */
 CREATE OR REPLACE FUNCTION bq_path_exists(i_path text, i_jdoc jsonb)
@@ -109,42 +202,550 @@ END
 $$ language plpgsql;
 
 
-/* private - transform a json sort spec into an 'ORDER BY...' string
+/* private - expand a json sort spec into its sort keys, in order.
+ * Each key is the path array of a (possibly dotted) field,
+ * and a direction of either 'ASC' or 'DESC'.
  */
-CREATE OR REPLACE FUNCTION bq_sort_to_text(i_sort json)
-RETURNS text AS $$
+CREATE OR REPLACE FUNCTION bq_sort_keys(i_sort json)
+RETURNS table(sort_path text[], sort_direction text) AS $$
 DECLARE
   sort_spec json;
   pair RECORD;
-  dotted_path text;
-  path_array text[];
-  direction text = 'ASC';
-  o_query text;
 BEGIN
-  o_query := 'order by ';
   for sort_spec in select value from json_array_elements(i_sort) loop
     for pair in select * from json_each(sort_spec) limit 1 loop
-      dotted_path := pair.key;
       if (pair.value::text = '-1')
       then
-        direction := 'DESC';
+        sort_direction := 'DESC';
       elsif (pair.value::text = '1')
       then
-        direction := 'ASC';
+        sort_direction := 'ASC';
       else
         raise exception 'Invalid sort direction "%s"', pair.value::text
         using hint = 'sort direction must be either 1 (ascending) or -1 (descending)';
       end if;
-      path_array := regexp_split_to_array(dotted_path, '\.');
-      o_query := o_query || format(' bq_jdoc#>''%s'' %s, ', path_array, direction);
+      sort_path := regexp_split_to_array(pair.key, '\.');
+      return next;
     end loop;
   end loop;
-  o_query := o_query || ' updated ';
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - transform a json sort spec into an 'ORDER BY...' string
+ * The _id column is always the final sort key, so that documents which
+ * tie on every other key still come back in a stable order.
+ */
+CREATE OR REPLACE FUNCTION bq_sort_to_text(i_sort json)
+RETURNS text AS $$
+DECLARE
+  sort_key RECORD;
+  o_query text;
+BEGIN
+  o_query := 'order by ';
+  for sort_key in select * from bq_sort_keys(i_sort) loop
+    o_query := o_query || format(' bq_jdoc#>%L %s, ',
+                                 sort_key.sort_path,
+                                 sort_key.sort_direction);
+  end loop;
+  o_query := o_query || ' _id ';
   return o_query;
 END
 $$ LANGUAGE plpgsql;
 
 
+/* private - check whether a value in a query document is an operator
+ * clause, such as {"$gt": 4}, rather than a value to match.
+ * An object which mixes operators and plain keys is an error.
+ */
+CREATE OR REPLACE FUNCTION bq_is_operator_clause(i_value jsonb)
+RETURNS boolean AS $$
+DECLARE
+  operator_count int;
+  key_count int;
+BEGIN
+  IF jsonb_typeof(i_value) <> 'object'
+  THEN
+    RETURN false;
+  END IF;
+  SELECT count(*) FILTER (WHERE key LIKE '$%'), count(*)
+  INTO operator_count, key_count
+  FROM jsonb_object_keys(i_value) AS key;
+  IF operator_count > 0 AND operator_count < key_count
+  THEN
+    RAISE EXCEPTION 'Invalid query clause %', i_value
+    USING HINT = 'A query clause should contain either only operators, or no operators';
+  END IF;
+  RETURN operator_count > 0;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+
+/* private - merge two jsonb values, recursively merging any objects
+ * found at the same key in both. Otherwise the second value wins.
+ */
+CREATE OR REPLACE FUNCTION bq_jsonb_merge(i_left jsonb, i_right jsonb)
+RETURNS jsonb AS $$
+BEGIN
+  IF jsonb_typeof(i_left) = 'object' AND jsonb_typeof(i_right) = 'object'
+  THEN
+    RETURN i_left || (
+      SELECT coalesce(jsonb_object_agg(
+               r.key,
+               CASE WHEN i_left ? r.key
+                 THEN bq_jsonb_merge(i_left->r.key, r.value)
+                 ELSE r.value
+               END), '{}')
+      FROM jsonb_each(i_right) AS r);
+  END IF;
+  RETURN i_right;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+
+/* private - get the containment document for a query document.
+ * That is the query without its operator clauses, and with dotted
+ * paths expanded into nested objects, ready for the @> operator.
+ */
+CREATE OR REPLACE FUNCTION bq_query_containment(i_json_query jsonb)
+RETURNS jsonb AS $$
+DECLARE
+  field RECORD;
+  o_doc jsonb = '{}';
+BEGIN
+  FOR field IN SELECT key, value FROM jsonb_each(i_json_query) LOOP
+    CONTINUE WHEN bq_is_operator_clause(field.value);
+    o_doc := bq_jsonb_merge(
+      o_doc,
+      bq_path_to_object(regexp_split_to_array(field.key, '\.'), field.value));
+  END LOOP;
+  RETURN o_doc;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+
+/* private - wrap a value in nested objects along a path, so that
+ * ARRAY['a', 'b'] and 1 give {"a": {"b": 1}}.
+ */
+CREATE OR REPLACE FUNCTION bq_path_to_object(i_path text[], i_value jsonb)
+RETURNS jsonb AS $$
+DECLARE
+  o_doc jsonb = i_value;
+BEGIN
+  FOR i IN REVERSE array_length(i_path, 1)..1 LOOP
+    o_doc := jsonb_build_object(i_path[i], o_doc);
+  END LOOP;
+  RETURN o_doc;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+
+/* private - transform a query operator on a document path into
+ * a predicate. The i_param parameter is the SQL expression for the
+ * operand, taken from the query document.
+ * Comparisons are made between jsonb values, as in bq_find sorts and
+ * bq_add_index indexes, and only between values of the same json type.
+ */
+CREATE OR REPLACE FUNCTION bq_operator_to_text(i_path text[], i_operator text, i_operand jsonb, i_param text)
+RETURNS text AS $$
+DECLARE
+  field text = format('bq_jdoc#>%L', i_path);
+BEGIN
+  CASE i_operator
+  WHEN '$gt', '$gte', '$lt', '$lte' THEN
+    RETURN format(
+      '(%1$s %2$s %3$s AND jsonb_typeof(%1$s) = jsonb_typeof(%3$s))',
+      field,
+      CASE i_operator
+        WHEN '$gt' THEN '>' WHEN '$gte' THEN '>='
+        WHEN '$lt' THEN '<' ELSE '<='
+      END,
+      i_param);
+  WHEN '$ne' THEN
+    RETURN format('%s IS DISTINCT FROM %s', field, i_param);
+  WHEN '$in', '$nin' THEN
+    IF jsonb_typeof(i_operand) <> 'array'
+    THEN
+      RAISE EXCEPTION 'Invalid % operand %', i_operator, i_operand
+      USING HINT = 'The operand of $in and $nin should be a json array';
+    END IF;
+    IF i_operator = '$in'
+    THEN
+      RETURN format(
+        '%s = ANY(ARRAY(SELECT jsonb_array_elements(%s)))',
+        field, i_param);
+    END IF;
+    RETURN format(
+      'NOT coalesce(%s = ANY(ARRAY(SELECT jsonb_array_elements(%s))), false)',
+      field, i_param);
+  WHEN '$exists' THEN
+    IF jsonb_typeof(i_operand) <> 'boolean'
+    THEN
+      RAISE EXCEPTION 'Invalid $exists operand %', i_operand
+      USING HINT = 'The operand of $exists should be true or false';
+    END IF;
+    IF i_operand = 'true'
+    THEN
+      RETURN format('%s IS NOT NULL', field);
+    END IF;
+    RETURN format('%s IS NULL', field);
+  ELSE
+    RAISE EXCEPTION 'Invalid query operator "%"', i_operator
+    USING HINT = 'Supported operators are $gt, $gte, $lt, $lte, $in, $nin, $ne and $exists';
+  END CASE;
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - transform a json query document into a 'WHERE...' predicate.
+ * The predicate refers to the query document as the parameter $1, so it
+ * depends only on the shape of the query, and not on the values in it.
+ * An empty query matches everything, and is kept apart from other queries
+ * so that its plan never involves the containment index.
+ * Plain values are matched by containment, and operator clauses, such as
+ * {"age": {"$gt": 30}}, are each compiled into a predicate of their own.
+ * Field names may be dotted paths into nested objects.
+ * A string _id is also matched against the _id column, so that the
+ * primary key can serve the query.
+ * The query document is referred to as i_param, if supplied, rather than $1.
+ */
+CREATE OR REPLACE FUNCTION bq_query_to_text(i_json_query json, i_param text DEFAULT '$1')
+RETURNS text AS $$
+DECLARE
+  query jsonb = i_json_query::jsonb;
+  field RECORD;
+  operator RECORD;
+  predicates text[] = '{}';
+  plain boolean = true;
+  has_equality boolean = false;
+BEGIN
+  IF query = '{}'::jsonb
+  THEN
+    RETURN ' true ';
+  END IF;
+  FOR field IN SELECT key, value FROM jsonb_each(query) LOOP
+    IF NOT bq_is_operator_clause(field.value)
+    THEN
+      has_equality := true;
+      plain := plain AND field.key NOT LIKE '%.%';
+      CONTINUE;
+    END IF;
+    plain := false;
+    FOR operator IN SELECT key, value FROM jsonb_each(field.value) LOOP
+      predicates := predicates || bq_operator_to_text(
+        regexp_split_to_array(field.key, '\.'),
+        operator.key,
+        operator.value,
+        format('(%s#>%L)', i_param, ARRAY[field.key, operator.key]));
+    END LOOP;
+  END LOOP;
+  IF plain
+  THEN
+    predicates := ARRAY[format('bq_jdoc @> %s', i_param)];
+  ELSIF has_equality
+  THEN
+    predicates := format('bq_jdoc @> bq_query_containment(%s)', i_param) || predicates;
+  END IF;
+  IF jsonb_typeof(query->'_id') = 'string'
+  THEN
+    predicates := predicates || format('_id = (%s->>''_id'')', i_param);
+  END IF;
+  RETURN format(' %s ', array_to_string(predicates, ' AND '));
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - transform a json projection into the expression for the
+ * documents a query returns, raising an exception if it is invalid.
+ * A projection either includes fields, like {"name": 1, "address.city": 1},
+ * or excludes them, like {"likes": 0}. The _id field is included unless
+ * it is excluded explicitly, and may be excluded in either kind. On its
+ * own, {"_id": 1} includes just the _id.
+ */
+CREATE OR REPLACE FUNCTION bq_projection_to_text(i_projection json)
+RETURNS text AS $$
+DECLARE
+  projection jsonb = i_projection::jsonb;
+BEGIN
+  IF projection IS NULL OR projection = '{}'::jsonb
+  THEN
+    RETURN 'bq_jdoc';
+  END IF;
+  IF jsonb_typeof(projection) <> 'object'
+  THEN
+    RAISE EXCEPTION
+    'Invalid projection parameter json type "%"', jsonb_typeof(projection)
+    USING HINT = 'The projection should be a json object';
+  END IF;
+  IF EXISTS(SELECT 1 FROM jsonb_each(projection)
+            WHERE value::text NOT IN ('0', '1', 'true', 'false'))
+  THEN
+    RAISE EXCEPTION 'Invalid projection %', projection
+    USING HINT = 'Fields in a projection should be 1 (include) or 0 (exclude)';
+  END IF;
+  IF (SELECT count(DISTINCT value::text IN ('1', 'true'))
+      FROM jsonb_each(projection) WHERE key <> '_id') > 1
+  THEN
+    RAISE EXCEPTION 'Invalid projection %', projection
+    USING HINT = 'A projection should either include or exclude fields, but not both';
+  END IF;
+  RETURN format('bq_project(bq_jdoc, %L::jsonb)', projection);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - apply a projection to a document,
+ * as described in bq_projection_to_text.
+ */
+CREATE OR REPLACE FUNCTION bq_project(i_jdoc jsonb, i_projection jsonb)
+RETURNS jsonb AS $$
+DECLARE
+  field RECORD;
+  path text[];
+  field_value jsonb;
+  o_doc jsonb;
+BEGIN
+  -- fields are included if any field is, and no field but _id is excluded,
+  -- so that {"_id": 1} includes the _id alone
+  IF EXISTS(SELECT 1 FROM jsonb_each(i_projection) AS p
+            WHERE p.value::text IN ('1', 'true'))
+     AND NOT EXISTS(SELECT 1 FROM jsonb_each(i_projection) AS p
+                    WHERE p.key <> '_id' AND p.value::text IN ('0', 'false'))
+  THEN
+    o_doc := '{}';
+    FOR field IN SELECT key, value FROM jsonb_each(i_projection) LOOP
+      CONTINUE WHEN field.value::text IN ('0', 'false');
+      path := regexp_split_to_array(field.key, '\.');
+      field_value := i_jdoc #> path;
+      CONTINUE WHEN field_value IS NULL;
+      o_doc := bq_jsonb_merge(o_doc, bq_path_to_object(path, field_value));
+    END LOOP;
+    IF NOT i_projection ? '_id'
+    THEN
+      o_doc := jsonb_build_object('_id', i_jdoc->'_id') || o_doc;
+    END IF;
+  ELSE
+    o_doc := i_jdoc;
+    FOR field IN SELECT key, value FROM jsonb_each(i_projection) LOOP
+      CONTINUE WHEN field.value::text IN ('1', 'true');
+      o_doc := o_doc #- regexp_split_to_array(field.key, '\.');
+    END LOOP;
+  END IF;
+  RETURN o_doc;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+
+/* private - build the query behind bq_find.
+ * The query takes the query document, limit and skip
+ * as the parameters $1, $2 and $3, and returns documents,
+ * with the projection applied, of the type i_doc_type,
+ * either 'json' or 'jsonb'.
+ */
+CREATE OR REPLACE FUNCTION bq_find_to_text(i_coll text, i_json_query json, i_sort json, i_projection json, i_doc_type text)
+RETURNS text AS $$
+DECLARE
+  q text;
+BEGIN
+  IF json_typeof(i_sort) != 'array'
+  THEN
+    RAISE EXCEPTION
+    'Invalid sort parameter json type "%s"', json_typeof(i_sort)
+    USING HINT = 'The i_sort parameter to bq_find should be a json array';
+  END IF;
+  -- query match
+  q := format('select %s::%s AS bq_jdoc from %I where %s ',
+              bq_projection_to_text(i_projection),
+              i_doc_type,
+              i_coll,
+              bq_query_to_text(i_json_query));
+  -- sort
+  IF (i_sort IS NOT NULL)
+  THEN
+    q := q || format(' %s ', bq_sort_to_text(i_sort));
+  END IF;
+  -- skip and limit
+  q := q || ' limit $2 offset $3 ';
+  RETURN q;
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - raise an exception if an update document is invalid.
+ * An update document maps update operators to objects of paths and values,
+ * as in {"$set": {"address.city": "Glasgow"}, "$inc": {"visits": 1}}.
+ */
+CREATE OR REPLACE FUNCTION bq_check_update(i_update jsonb)
+RETURNS VOID AS $$
+DECLARE
+  operator RECORD;
+  field RECORD;
+BEGIN
+  IF jsonb_typeof(i_update) <> 'object' OR i_update = '{}'::jsonb
+  THEN
+    RAISE EXCEPTION 'Invalid update %', i_update
+    USING HINT = 'The update should be a json object of update operators';
+  END IF;
+  FOR operator IN SELECT key, value FROM jsonb_each(i_update) LOOP
+    IF operator.key NOT IN ('$set', '$unset', '$inc', '$push', '$pull')
+    THEN
+      RAISE EXCEPTION 'Invalid update operator "%"', operator.key
+      USING HINT = 'Supported operators are $set, $unset, $inc, $push and $pull. To replace a whole document, use bq_save';
+    END IF;
+    IF jsonb_typeof(operator.value) <> 'object'
+    THEN
+      RAISE EXCEPTION 'Invalid % operand %', operator.key, operator.value
+      USING HINT = 'The operand of an update operator should be a json object of fields';
+    END IF;
+    FOR field IN SELECT key, value FROM jsonb_each(operator.value) LOOP
+      IF field.key = '_id' OR field.key LIKE '\_id.%'
+      THEN
+        RAISE EXCEPTION 'The _id field cannot be updated'
+        USING HINT = 'To change the _id of a document, remove it and insert it again';
+      END IF;
+      IF operator.key = '$inc' AND jsonb_typeof(field.value) <> 'number'
+      THEN
+        RAISE EXCEPTION 'Invalid $inc value % for field "%"', field.value, field.key
+        USING HINT = 'The values of $inc should be numbers';
+      END IF;
+    END LOOP;
+  END LOOP;
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - set the value at a path in a jsonb document, creating any
+ * objects along the path which are missing.
+ */
+CREATE OR REPLACE FUNCTION bq_jsonb_set_path(i_jdoc jsonb, i_path text[], i_value jsonb)
+RETURNS jsonb AS $$
+DECLARE
+  o_doc jsonb = i_jdoc;
+  parent jsonb;
+BEGIN
+  FOR i IN 1..array_length(i_path, 1) - 1 LOOP
+    parent := o_doc #> i_path[1:i];
+    IF parent IS NULL
+    THEN
+      o_doc := jsonb_set(o_doc, i_path[1:i], '{}');
+    ELSIF jsonb_typeof(parent) NOT IN ('object', 'array')
+    THEN
+      RAISE EXCEPTION 'Cannot set "%", as "%" is not an object',
+        array_to_string(i_path, '.'), array_to_string(i_path[1:i], '.')
+      USING HINT = 'Unset the field first, to replace it with an object';
+    END IF;
+  END LOOP;
+  RETURN jsonb_set(o_doc, i_path, i_value);
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - apply an update document to a jsonb document,
+ * which should already have been checked with bq_check_update.
+ */
+CREATE OR REPLACE FUNCTION bq_apply_update(i_jdoc jsonb, i_update jsonb)
+RETURNS jsonb AS $$
+DECLARE
+  operator RECORD;
+  field RECORD;
+  path text[];
+  current_value jsonb;
+  o_doc jsonb = i_jdoc;
+BEGIN
+  FOR operator IN SELECT key, value FROM jsonb_each(i_update) LOOP
+    FOR field IN SELECT key, value FROM jsonb_each(operator.value) LOOP
+      path := regexp_split_to_array(field.key, '\.');
+      current_value := o_doc #> path;
+      CASE operator.key
+      WHEN '$set' THEN
+        o_doc := bq_jsonb_set_path(o_doc, path, field.value);
+      WHEN '$unset' THEN
+        o_doc := o_doc #- path;
+      WHEN '$inc' THEN
+        IF current_value IS NULL
+        THEN
+          o_doc := bq_jsonb_set_path(o_doc, path, field.value);
+        ELSIF jsonb_typeof(current_value) = 'number'
+        THEN
+          o_doc := jsonb_set(o_doc, path, to_jsonb(
+            (current_value#>>'{}')::numeric + (field.value#>>'{}')::numeric));
+        ELSE
+          RAISE EXCEPTION 'Cannot $inc "%", as it is not a number', field.key
+          USING HINT = 'Only number fields can be incremented';
+        END IF;
+      WHEN '$push' THEN
+        IF current_value IS NULL
+        THEN
+          o_doc := bq_jsonb_set_path(o_doc, path, jsonb_build_array(field.value));
+        ELSIF jsonb_typeof(current_value) = 'array'
+        THEN
+          o_doc := jsonb_set(o_doc, path, current_value || jsonb_build_array(field.value));
+        ELSE
+          RAISE EXCEPTION 'Cannot $push to "%", as it is not an array', field.key
+          USING HINT = 'Only array fields can be pushed to';
+        END IF;
+      WHEN '$pull' THEN
+        IF jsonb_typeof(current_value) = 'array'
+        THEN
+          o_doc := jsonb_set(o_doc, path, (
+            SELECT coalesce(jsonb_agg(e.elem ORDER BY e.elem_index), '[]')
+            FROM jsonb_array_elements(current_value)
+                 WITH ORDINALITY AS e(elem, elem_index)
+            WHERE e.elem <> field.value));
+        END IF;
+      END CASE;
+    END LOOP;
+  END LOOP;
+  RETURN o_doc;
+END
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+/* private - Get the name of a prepared statement for the supplied query,
+ * preparing it in the current session if that has not been done already.
+ * Statements are named after a hash of the query text and parameter types,
+ * so every call with the same query shape reuses the same plan.
+ * At most bedquilt.max_prepared_statements of them (100 unless set) are
+ * kept, and the oldest are deallocated to make room, which keeps the
+ * lookups in pg_prepared_statements short. That view is the only record
+ * of what is prepared, as PREPARE and DEALLOCATE are not rolled back
+ * with the transaction that ran them.
+ * Prepared statements take their arguments in the text of EXECUTE, as
+ * they can't be passed to it with EXECUTE ... USING.
+ */
+CREATE OR REPLACE FUNCTION bq_prepared_statement(i_query text, i_param_types text)
+RETURNS text AS $$
+DECLARE
+  statement_name text = 'bq_' || md5(i_param_types || ':' || i_query);
+  names text[];
+  max_prepared integer;
+BEGIN
+  IF EXISTS(SELECT 1 FROM pg_prepared_statements p
+            WHERE p.name = statement_name)
+  THEN
+    RETURN statement_name;
+  END IF;
+  max_prepared := greatest(coalesce(
+    nullif(current_setting('bedquilt.max_prepared_statements', true), '')::integer,
+    100), 1);
+  SELECT coalesce(array_agg(p.name ORDER BY p.prepare_time, p.name), '{}')
+  INTO names
+  FROM pg_prepared_statements p
+  WHERE p.name ~ '^bq_[0-9a-f]{32}$';
+  WHILE cardinality(names) >= max_prepared LOOP
+    EXECUTE format('DEALLOCATE %I', names[1]);
+    names := names[2:];
+  END LOOP;
+  EXECUTE format(
+    'PREPARE %I(%s) AS %s',
+    statement_name,
+    i_param_types,
+    i_query);
+  RETURN statement_name;
+END
+$$ LANGUAGE plpgsql;
+
+
 /* private - raise an exception if the extension version is less than
  * the supplied version.
  */
@@ -0,0 +1,151 @@
+import testutils
+import json
+import psycopg2
+
+
+class TestAggregate(testutils.BedquiltTestCase):
+
+    def populate(self):
+        docs = [
+            {"_id": "a", "city": "Glasgow", "amount": 5, "item": "tea"},
+            {"_id": "b", "city": "Glasgow", "amount": 7, "item": "cake"},
+            {"_id": "c", "city": "Edinburgh", "amount": 2, "item": "tea"},
+            {"_id": "d", "city": "Edinburgh", "amount": "lots",
+             "item": "cake"},
+            {"_id": "e", "city": "Dublin", "amount": 11, "item": "tea"},
+            {"_id": "f", "amount": 1}
+        ]
+        for doc in docs:
+            self._insert('sales', doc)
+
+    def _aggregate(self, pipeline):
+        self.cur.execute("""
+        select bq_aggregate('sales', %s)
+        """, (json.dumps(pipeline),))
+        result = self.cur.fetchall()
+        self.conn.commit()
+        return [row[0] for row in result]
+
+    def test_on_non_existant_collection(self):
+        self.assertEqual(self._aggregate([{"$limit": 1}]), [])
+
+    def test_empty_pipeline(self):
+        self.populate()
+        self.assertEqual(len(self._aggregate([])), 6)
+
+    def test_group_with_accumulators(self):
+        self.populate()
+        result = self._aggregate([
+            {"$match": {"city": {"$exists": True}}},
+            {"$group": {"_id": "$city",
+                        "total": {"$sum": "$amount"},
+                        "average": {"$avg": "$amount"},
+                        "smallest": {"$min": "$amount"},
+                        "largest": {"$max": "$amount"},
+                        "sales": {"$count": {}}}},
+            {"$sort": [{"_id": 1}]}
+        ])
+        self.assertEqual(
+            [(d['_id'], d['total'], d['average'], d['sales']) for d in result],
+            [("Dublin", 11, 11, 1),
+             ("Edinburgh", 2, 2, 2),
+             ("Glasgow", 12, 6, 2)])
+        # strings sort before numbers, as in bq_find
+        self.assertEqual(
+            [(d['smallest'], d['largest']) for d in result],
+            [(11, 11), ("lots", 2), (5, 7)])
+
+    def test_group_on_compound_and_constant_keys(self):
+        self.populate()
+        result = self._aggregate([
+            {"$match": {"item": "tea"}},
+            {"$group": {"_id": {"item": "$item"}, "n": {"$sum": 1}}}
+        ])
+        self.assertEqual(result, [{"_id": {"item": "tea"}, "n": 3}])
+
+        result = self._aggregate([
+            {"$group": {"_id": None, "n": {"$count": {}}}}
+        ])
+        self.assertEqual(result, [{"_id": None, "n": 6}])
+
+    def test_sort_skip_limit_and_project(self):
+        self.populate()
+        result = self._aggregate([
+            {"$match": {"amount": {"$gte": 2}}},
+            {"$sort": [{"amount": -1}]},
+            {"$skip": 1},
+            {"$limit": 2},
+            {"$project": {"amount": 1, "_id": 0}}
+        ])
+        self.assertEqual(result, [{"amount": 7}, {"amount": 5}])
+
+        # a limit before a skip applies first
+        result = self._aggregate([
+            {"$sort": [{"amount": 1}]},
+            {"$limit": 3},
+            {"$skip": 2}
+        ])
+        self.assertEqual([d['_id'] for d in result], ["c"])
+
+    def test_stages_after_group(self):
+        self.populate()
+        result = self._aggregate([
+            {"$group": {"_id": "$item", "total": {"$sum": "$amount"}}},
+            {"$match": {"total": {"$gt": 10}}},
+            {"$sort": [{"total": -1}]},
+            {"$limit": 1}
+        ])
+        self.assertEqual(result, [{"_id": "tea", "total": 18}])
+
+    def test_plans_are_cached(self):
+        self.populate()
+        self._aggregate([{"$match": {"item": "tea"}}, {"$limit": 1}])
+        before = self._query("""
+        select count(*) from pg_prepared_statements where name like 'bq_%'
+        """)
+        result = self._aggregate([{"$match": {"item": "cake"}},
+                                  {"$limit": 2}])
+        self.assertEqual(len(result), 2)
+        after = self._query("""
+        select count(*) from pg_prepared_statements where name like 'bq_%'
+        """)
+        self.assertEqual(before, after)
+
+    def test_min_max_run_in_parallel(self):
+        self.cur.execute("select bq_insert_many('sales', %s)",
+                         (json.dumps([{"amount": i} for i in range(1000)]),))
+        self.conn.commit()
+        self.cur.execute("""
+        set local parallel_setup_cost = 0;
+        set local parallel_tuple_cost = 0;
+        set local min_parallel_table_scan_size = 0;
+        explain select bq_jsonb_min(bq_jdoc->'amount'),
+                       bq_jsonb_max(bq_jdoc->'amount')
+        from sales
+        """)
+        plan = '\n'.join(row[0] for row in self.cur.fetchall())
+        self.assertIn('Partial Aggregate', plan)
+        self.cur.execute("""
+        select bq_jsonb_min(bq_jdoc->'amount'), bq_jsonb_max(bq_jdoc->'amount')
+        from sales
+        """)
+        self.assertEqual(self.cur.fetchall(), [(0, 999)])
+        self.conn.commit()
+
+    def test_invalid_pipelines(self):
+        self.populate()
+        pipelines = [
+            {"$limit": 1},
+            [{"$limit": 1, "$skip": 1}],
+            [{"$unwind": "$items"}],
+            [{"$limit": -1}],
+            [{"$group": {"total": {"$sum": "$amount"}}}],
+            [{"$group": {"_id": "$city", "total": {"$first": "$amount"}}}],
+            [{"$sort": {"amount": 1}}]
+        ]
+        for pipeline in pipelines:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute("""
+                select bq_aggregate('sales', %s)
+                """, (json.dumps(pipeline),))
+            self.conn.rollback()
@@ -731,3 +731,317 @@ class TestAddConstraints(testutils.BedquiltTestCase):
             'first_name': {'$type': 'string'}
         })))
         self.assertEqual(result, [(True,)])
+
+    def test_constraints_share_one_check(self):
+        self._query("""
+        select bq_add_constraints('cool_things', '{}');
+        """.format(json.dumps({
+            'name': {'$required': True, '$type': 'string'},
+            'age': {'$notnull': True}
+        })))
+        self._query("""
+        select bq_add_constraints('cool_things', '{}');
+        """.format(json.dumps({
+            'address.city': {'$type': 'string'}
+        })))
+        result = self._query("""
+        select conname::text from pg_constraint
+        where conrelid = 'cool_things'::regclass and contype = 'c'
+        order by 1
+        """)
+        self.assertEqual(result, [('bq_constraints',), ('validate_id',)])
+
+        # adding a constraint checks the existing documents
+        self._insert('cool_things', {'name': 'Sarah', 'likes': 'cats'})
+        with self.assertRaises(psycopg2.IntegrityError):
+            self._query("""
+            select bq_add_constraints('cool_things', '{}');
+            """.format(json.dumps({
+                'likes': {'$type': 'array'}
+            })))
+        self.conn.rollback()
+        result = self._query("""
+        select bq_list_constraints('cool_things')
+        """)
+        self.assertEqual(result, [('address.city:type:string',),
+                                  ('age:notnull',),
+                                  ('name:required',),
+                                  ('name:type:string',)])
+
+        # an invalid constraint is rejected
+        with self.assertRaises(psycopg2.InternalError):
+            self._query("""
+            select bq_add_constraints('cool_things', '{}');
+            """.format(json.dumps({
+                'likes': {'$unique': True}
+            })))
+        self.conn.rollback()
+
+    def test_constraints_scan_collection_once(self):
+        for i in range(10):
+            self._insert('cool_things', {'name': 'Thing {}'.format(i),
+                                         'age': i,
+                                         'likes': ['cats']})
+
+        def scans():
+            self.cur.execute("""
+            select seq_scan from pg_stat_xact_user_tables
+            where relid = 'cool_things'::regclass
+            """)
+            return self.cur.fetchall()[0][0]
+
+        # one scan for all of the constraints added
+        before = scans()
+        self.cur.execute("""
+        select bq_add_constraints('cool_things', %s)
+        """, (json.dumps({
+            'name': {'$required': True, '$notnull': True, '$type': 'string'},
+            'age': {'$required': True, '$notnull': True, '$type': 'number'},
+            'likes': {'$required': True, '$notnull': True, '$type': 'array'}
+        }),))
+        self.assertEqual(scans() - before, 1)
+        self.conn.commit()
+
+        # and none for those removed
+        before = scans()
+        self.cur.execute("""
+        select bq_remove_constraints('cool_things', %s)
+        """, (json.dumps({
+            'age': {'$notnull': True, '$type': 'number'},
+            'likes': {'$required': True, '$notnull': True, '$type': 'array'}
+        }),))
+        self.assertEqual(scans() - before, 0)
+        self.conn.commit()
+        result = self._query("""
+        select bq_list_constraints('cool_things')
+        """)
+        self.assertEqual(result, [('age:required',),
+                                  ('name:notnull',),
+                                  ('name:required',),
+                                  ('name:type:string',)])
+        with self.assertRaises(psycopg2.IntegrityError):
+            self._insert('cool_things', {'name': 'Thing', 'likes': 'dogs'})
+        self.conn.rollback()
+        self._insert('cool_things', {'name': 'Thing', 'age': 'old'})
+
+    def test_constraints_are_schema_aware(self):
+        self._query("""
+        select bq_add_constraints('cool_things', '{}');
+        """.format(json.dumps({
+            'name': {'$required': True}
+        })))
+        self.cur.execute("""
+        create schema other_things;
+        set search_path to other_things, public;
+        """)
+        try:
+            # a collection of the same name in another schema
+            result = self._query("""
+            select bq_add_constraints('cool_things', '{}');
+            """.format(json.dumps({
+                'age': {'$type': 'number'}
+            })))
+            self.assertEqual(result, [(True,)])
+            result = self._query("""
+            select bq_list_constraints('cool_things')
+            """)
+            self.assertEqual(result, [('age:type:number',)])
+        finally:
+            self.conn.rollback()
+            self.cur.execute("""
+            reset search_path;
+            drop schema if exists other_things cascade;
+            """)
+            self.conn.commit()
+        result = self._query("""
+        select bq_list_constraints('cool_things')
+        """)
+        self.assertEqual(result, [('name:required',)])
+
+    def test_constraints_survive_registry_rebuild(self):
+        self._query("""
+        select bq_add_constraints('cool_things', '{}');
+        """.format(json.dumps({
+            'name': {'$required': True, '$type': 'string'}
+        })))
+
+        # the registry loses the spec, as when the extension is recreated
+        self._query("""
+        update bq_collections set options = '{}'
+        where collection_name = 'cool_things';
+        select 1;
+        """)
+        result = self._query("""
+        select bq_add_constraints('cool_things', '{}');
+        """.format(json.dumps({
+            'age': {'$notnull': True}
+        })))
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select bq_list_constraints('cool_things')
+        """)
+        self.assertEqual(result, [('age:notnull',),
+                                  ('name:required',),
+                                  ('name:type:string',)])
+        with self.assertRaises(psycopg2.IntegrityError):
+            self._insert('cool_things', {'age': 22})
+        self.conn.rollback()
+
+        # a registry which disagrees with the table is an error
+        self._query("""
+        update bq_collections
+        set options = '{"constraints": {"likes": {"$required": true}}}'
+        where collection_name = 'cool_things';
+        select 1;
+        """)
+        with self.assertRaises(psycopg2.InternalError):
+            self._query("""
+            select bq_add_constraints('cool_things', '{}');
+            """.format(json.dumps({
+                'likes': {'$type': 'array'}
+            })))
+        self.conn.rollback()
+
+
+class TestOnlineConstraints(testutils.BedquiltTestCase):
+
+    def test_add_constraints_online(self):
+        for i in range(10):
+            self._insert('people', {'_id': 'p{}'.format(i),
+                                    'name': 'Person {}'.format(i),
+                                    'age': i})
+        self._insert('people', {'_id': 'p5x', 'name': 'Fred', 'age': 'old'})
+
+        # existing documents are not checked
+        result = self._query("""
+        select bq_add_constraints('people', '{}', true);
+        """.format(json.dumps({
+            'age': {'$type': 'number'}
+        })))
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select convalidated from pg_constraint
+        where conrelid = 'people'::regclass and conname = 'bq_constraints'
+        """)
+        self.assertEqual(result, [(False,)])
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:type:number', 'validating', 0)])
+        result = self._query("""
+        select * from bq_list_constraints('people', false)
+        """)
+        self.assertEqual(result, [('age:type:number', None, None)])
+
+        # but new documents are
+        with self.assertRaises(psycopg2.IntegrityError):
+            self._insert('people', {'name': 'Jane', 'age': 'young'})
+        self.conn.rollback()
+
+        # validate in batches, in _id order
+        result = self._query("""
+        select bq_validate_constraints('people', 4)
+        """)
+        self.assertEqual(result, [(4,)])
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:type:number', 'validating', 4)])
+        with self.assertRaises(psycopg2.IntegrityError):
+            self._query("""
+            select bq_validate_constraints('people', 4)
+            """)
+        self.conn.rollback()
+
+        # fix the document and carry on
+        self._query("""
+        select bq_save('people', '{}')
+        """.format(json.dumps({'_id': 'p5x', 'name': 'Fred', 'age': 80})))
+        result = self._query("""
+        select bq_validate_constraints('people', 4)
+        """)
+        self.assertEqual(result, [(4,)])
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:type:number', 'validating', 8)])
+        result = self._query("""
+        select bq_validate_constraints('people', 4)
+        """)
+        self.assertEqual(result, [(3,)])
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:type:number', 'valid', None)])
+        result = self._query("""
+        select convalidated from pg_constraint
+        where conrelid = 'people'::regclass and conname = 'bq_constraints'
+        """)
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select bq_validate_constraints('people', 4)
+        """)
+        self.assertEqual(result, [(0,)])
+
+    def test_add_more_constraints_online(self):
+        for i in range(5):
+            self._insert('people', {'_id': 'p{}'.format(i),
+                                    'name': 'Person {}'.format(i),
+                                    'age': i})
+        self._query("""
+        select bq_add_constraints('people', '{}');
+        """.format(json.dumps({
+            'name': {'$required': True}
+        })))
+        self._query("""
+        select bq_add_constraints('people', '{}', true);
+        """.format(json.dumps({
+            'age': {'$type': 'number'}
+        })))
+        self._query("""
+        select bq_validate_constraints('people', 2)
+        """)
+
+        # adding another constraint starts again
+        self._query("""
+        select bq_add_constraints('people', '{}', true);
+        """.format(json.dumps({
+            'age': {'$notnull': True}
+        })))
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:notnull', 'validating', 0),
+                                  ('age:type:number', 'validating', 0),
+                                  ('name:required', 'valid', None)])
+
+        # removing a pending constraint leaves the rest pending
+        result = self._query("""
+        select bq_remove_constraints('people', '{}');
+        """.format(json.dumps({
+            'age': {'$notnull': True}
+        })))
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:type:number', 'validating', 0),
+                                  ('name:required', 'valid', None)])
+
+        # adding constraints without i_online checks everything
+        self._query("""
+        select bq_add_constraints('people', '{}');
+        """.format(json.dumps({
+            'age': {'$required': True}
+        })))
+        result = self._query("""
+        select * from bq_list_constraints('people', true)
+        """)
+        self.assertEqual(result, [('age:required', 'valid', None),
+                                  ('age:type:number', 'valid', None),
+                                  ('name:required', 'valid', None)])
+        result = self._query("""
+        select convalidated from pg_constraint
+        where conrelid = 'people'::regclass and conname = 'bq_constraints'
+        """)
+        self.assertEqual(result, [(True,)])
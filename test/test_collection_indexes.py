@@ -0,0 +1,176 @@
+import testutils
+import json
+import psycopg2
+
+
+class TestIndexes(testutils.BedquiltTestCase):
+
+    def test_add_list_and_remove_index(self):
+        result = self._query("""
+        select * from bq_list_indexes('people')
+        """)
+        self.assertEqual(result, [])
+
+        result = self._query("""
+        select bq_add_index('people', '{"address.city": 1, "age": -1}')
+        """)
+        self.assertEqual(result, [(True,)])
+
+        # adding the same spec again does nothing
+        result = self._query("""
+        select bq_add_index('people', '{"address.city": 1, "age": -1}')
+        """)
+        self.assertEqual(result, [(False,)])
+
+        result = self._query("""
+        select index_spec, is_unique from bq_list_indexes('people')
+        """)
+        self.assertEqual(result, [({"address.city": 1, "age": -1}, False)])
+
+        # field order matters
+        result = self._query("""
+        select bq_remove_index('people', '{"age": -1, "address.city": 1}')
+        """)
+        self.assertEqual(result, [(False,)])
+
+        result = self._query("""
+        select bq_remove_index('people', '{"address.city": 1, "age": -1}')
+        """)
+        self.assertEqual(result, [(True,)])
+
+        result = self._query("""
+        select * from bq_list_indexes('people')
+        """)
+        self.assertEqual(result, [])
+
+    def test_remove_index_on_non_existant_collection(self):
+        result = self._query("""
+        select bq_remove_index('people', '{"age": 1}')
+        """)
+        self.assertEqual(result, [(False,)])
+
+    def test_invalid_index_spec(self):
+        specs = ['{}', '[{"age": 1}]', '{"age": 2}']
+        for spec in specs:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute("""
+                select bq_add_index('people', '{}')
+                """.format(spec))
+            self.conn.rollback()
+
+    def test_unique_index(self):
+        result = self._query("""
+        select bq_add_index('people', '{"email": 1}', '{"unique": true}')
+        """)
+        self.assertEqual(result, [(True,)])
+
+        result = self._query("""
+        select index_spec, is_unique from bq_list_indexes('people')
+        """)
+        self.assertEqual(result, [({"email": 1}, True)])
+
+        self._insert('people', {'_id': 'a', 'email': 'a@example.com'})
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("""
+            select bq_insert('people', '{}')
+            """.format(json.dumps({'_id': 'b', 'email': 'a@example.com'})))
+        self.conn.rollback()
+
+    def test_add_index_statement(self):
+        result = self._query("""
+        select bq_add_index_statement('people', '{"age": -1}')
+        """)
+        statement = result[0][0]
+        self.assertTrue(statement.startswith('CREATE INDEX CONCURRENTLY'))
+
+        self.conn.autocommit = True
+        try:
+            self._query("select bq_create_collection('people')")
+            self.cur.execute(statement)
+        finally:
+            self.conn.autocommit = False
+
+        result = self._query("""
+        select index_spec from bq_list_indexes('people')
+        """)
+        self.assertEqual(result, [({"age": -1},)])
+
+        # there is nothing left to do once the index exists
+        result = self._query("""
+        select bq_add_index_statement('people', '{"age": -1}')
+        """)
+        self.assertEqual(result, [])
+
+    def test_long_collection_names(self):
+        # names which only differ after the part that fits in index names
+        prefix = 'people_' + 'x' * 40
+        for collection in [prefix + '_one', prefix + '_two']:
+            self.cur.execute("select bq_add_index(%s, '{\"age\": 1}')",
+                             (collection,))
+            self.assertEqual(self.cur.fetchall(), [(True,)])
+            self.conn.commit()
+            self.cur.execute("select index_spec from bq_list_indexes(%s)",
+                             (collection,))
+            self.assertEqual(self.cur.fetchall(), [({"age": 1},)])
+            self.conn.commit()
+
+    def test_add_index_statement_partitioned(self):
+        self._query("""
+        select bq_create_collection('people', '{"partition": {"hash": 2}}')
+        """)
+        statements = self._query("""
+        select bq_add_index_statement('people', '{"age": -1}')
+        """)
+        self.assertEqual(len(statements), 5)
+        self.assertIn('ON ONLY', statements[0][0])
+
+        self.conn.autocommit = True
+        try:
+            for (statement,) in statements:
+                self.cur.execute(statement)
+        finally:
+            self.conn.autocommit = False
+
+        result = self._query("""
+        select l.index_spec, i.indisvalid
+        from bq_list_indexes('people') l
+        join pg_index i on i.indexrelid = quote_ident(l.index_name)::regclass
+        """)
+        self.assertEqual(result, [({"age": -1}, True)])
+
+        # only the attachments are left, which do nothing once made
+        statements = self._query("""
+        select bq_add_index_statement('people', '{"age": -1}')
+        """)
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all('ATTACH PARTITION' in s for (s,) in statements))
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_add_index('people', '{"email": 1}', '{"unique": true}')
+            """)
+        self.conn.rollback()
+
+    def test_sorted_find_uses_index(self):
+        for i in range(20):
+            self._insert('people', {'name': 'p{}'.format(i),
+                                    'address': {'city': 'c{}'.format(i % 3)},
+                                    'age': i})
+        self._query("""
+        select bq_add_index('people', '{"address.city": 1, "age": -1}')
+        """)
+        sort = '[{"address.city": 1}, {"age": -1}]'
+        self.cur.execute("set enable_seqscan = off")
+        try:
+            result = self._query("""
+            select bq_sort_to_text('{}')
+            """.format(sort))
+            plan = self._query("""
+            explain (format json) select bq_jdoc from people {}
+            """.format(result[0][0]))[0][0]
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            self.assertEqual(plan[0]['Plan']['Node Type'], 'Index Scan')
+        finally:
+            self.conn.rollback()
+            self.cur.execute("reset enable_seqscan")
+            self.conn.commit()
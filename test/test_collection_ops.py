@@ -1,5 +1,6 @@
 import testutils
 import json
+import re
 import psycopg2
 
 
@@ -43,6 +44,388 @@ class TestCreateCollection(testutils.BedquiltTestCase):
         self.assertEqual(result[0], False)
 
 
+class TestCollectionGinIndex(testutils.BedquiltTestCase):
+
+    def _gin_opclass(self, collection):
+        return self._query("""
+        select opc.opcname::text
+        from pg_index i
+        join pg_opclass opc on opc.oid = i.indclass[0]
+        join pg_am am on am.oid = opc.opcmethod
+        where i.indrelid = '{}'::regclass
+        and am.amname = 'gin'
+        """.format(collection))
+
+    def test_default_gin_index(self):
+        self._query("select bq_create_collection('testone')")
+        self.assertEqual(self._gin_opclass('testone'),
+                         [('jsonb_path_ops',)])
+
+    def test_gin_options(self):
+        self._query("""
+        select bq_create_collection('testone', '{"gin": "jsonb_ops"}')
+        """)
+        self.assertEqual(self._gin_opclass('testone'), [('jsonb_ops',)])
+
+        self._query("""
+        select bq_create_collection('testtwo', '{"gin": false}')
+        """)
+        self.assertEqual(self._gin_opclass('testtwo'), [])
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_create_collection('testthree', '{"gin": "btree"}')
+            """)
+        self.conn.rollback()
+
+    def test_set_gin_index(self):
+        self._insert('testone', {'_id': 'a', 'name': 'Sarah'})
+
+        result = self._query("""
+        select bq_set_gin_index('testone', 'jsonb_path_ops')
+        """)
+        self.assertEqual(result, [(False,)])
+
+        result = self._query("""
+        select bq_set_gin_index('testone', 'jsonb_ops')
+        """)
+        self.assertEqual(result, [(True,)])
+        self.assertEqual(self._gin_opclass('testone'), [('jsonb_ops',)])
+
+        result = self._query("""
+        select bq_set_gin_index('testone', null)
+        """)
+        self.assertEqual(result, [(True,)])
+        self.assertEqual(self._gin_opclass('testone'), [])
+
+        result = self._query("""
+        select bq_set_gin_index('testone', 'jsonb_path_ops')
+        """)
+        self.assertEqual(result, [(True,)])
+        self.assertEqual(self._gin_opclass('testone'), [('jsonb_path_ops',)])
+
+        result = self._query("""
+        select bq_find('testone', '{"name": "Sarah"}')
+        """)
+        self.assertEqual(result, [({'_id': 'a', 'name': 'Sarah'},)])
+
+    def test_set_gin_index_statements(self):
+        self._query("select bq_create_collection('testone')")
+        statements = self._query("""
+        select bq_set_gin_index_statements('testone', 'jsonb_ops')
+        """)
+        self.assertEqual(len(statements), 3)
+
+        self.conn.autocommit = True
+        try:
+            for (statement,) in statements:
+                self.cur.execute(statement)
+        finally:
+            self.conn.autocommit = False
+        self.assertEqual(self._gin_opclass('testone'), [('jsonb_ops',)])
+
+    def test_set_gin_index_statements_after_failed_build(self):
+        self._insert('testone', {'_id': 'a', 'n': 0})
+        [(index_name,)] = self._query("""
+        select bq_gin_index_name('testone')
+        """)
+        # a concurrent build which fails leaves an invalid index behind
+        self.conn.autocommit = True
+        try:
+            with self.assertRaises(psycopg2.DataError):
+                self.cur.execute("""
+                create index concurrently {}_new
+                on testone ((1 / (bq_jdoc->>'n')::int))
+                """.format(index_name))
+        finally:
+            self.conn.autocommit = False
+        result = self._query("""
+        select indisvalid from pg_index
+        where indexrelid = '{}_new'::regclass
+        """.format(index_name))
+        self.assertEqual(result, [(False,)])
+
+        statements = self._query("""
+        select bq_set_gin_index_statements('testone', 'jsonb_ops')
+        """)
+        self.assertEqual(len(statements), 4)
+        self.conn.autocommit = True
+        try:
+            for (statement,) in statements:
+                self.cur.execute(statement)
+        finally:
+            self.conn.autocommit = False
+        self.assertEqual(self._gin_opclass('testone'), [('jsonb_ops',)])
+        result = self._query("""
+        select c.relname, i.indisvalid from pg_index i
+        join pg_class c on c.oid = i.indexrelid
+        where i.indrelid = 'testone'::regclass and c.relname like '%bq_jdoc%'
+        """)
+        self.assertEqual(result, [(index_name, True)])
+
+    def test_gin_index_names_of_long_collections(self):
+        # names whose GIN indexes were once cut to the same 63 bytes
+        prefix = 'a_collection_with_a_long_name_which_is_shared_by_two_others_'
+        for suffix in ['one', 'two']:
+            self._query("""
+            select bq_create_collection('{}{}')
+            """.format(prefix, suffix))
+            self.assertEqual(self._gin_opclass(prefix + suffix),
+                             [('jsonb_path_ops',)])
+        for suffix in ['one', 'two']:
+            result = self._query("""
+            select bq_set_gin_index('{}{}', 'jsonb_ops')
+            """.format(prefix, suffix))
+            self.assertEqual(result, [(True,)])
+            self.assertEqual(self._gin_opclass(prefix + suffix),
+                             [('jsonb_ops',)])
+
+    def test_set_gin_index_statements_partitioned(self):
+        self._query("""
+        select bq_create_collection('testone', '{"partition": {"hash": 2}}')
+        """)
+        self._insert('testone', {'_id': 'a', 'name': 'Sarah'})
+        for opclass in ['jsonb_ops', 'jsonb_path_ops']:
+            self.cur.execute("""
+            select bq_set_gin_index_statements('testone', %s)
+            """, (opclass,))
+            statements = self.cur.fetchall()
+            self.conn.commit()
+            # the index on each partition is built concurrently
+            self.assertEqual(
+                len([s for (s,) in statements if 'CONCURRENTLY' in s]), 2)
+
+            self.conn.autocommit = True
+            try:
+                for (statement,) in statements:
+                    self.cur.execute(statement)
+            finally:
+                self.conn.autocommit = False
+            self.assertEqual(self._gin_opclass('testone'), [(opclass,)])
+
+        result = self._query("""
+        select count(*), bool_and(i.indisvalid)
+        from pg_index i join pg_inherits p on p.inhrelid = i.indrelid
+        where p.inhparent = 'testone'::regclass
+        and pg_get_indexdef(i.indexrelid) like '%gin%'
+        """)
+        self.assertEqual(result, [(2, True)])
+        result = self._query("""
+        select bq_find('testone', '{"name": "Sarah"}')
+        """)
+        self.assertEqual(result, [({'_id': 'a', 'name': 'Sarah'},)])
+
+
+class TestCollectionIdStrategy(testutils.BedquiltTestCase):
+
+    def _insert_ids(self, collection, count):
+        self.cur.execute("""
+        select bq_insert_many('{}', %s)
+        """.format(collection), (json.dumps([{'n': i} for i in range(count)]),))
+        result = self.cur.fetchall()
+        self.conn.commit()
+        return [row[0] for row in result]
+
+    def test_time_ids_are_ordered(self):
+        self._query("""
+        select bq_create_collection('testone', '{"id": "time"}')
+        """)
+        ids = self._insert_ids('testone', 50)
+        ids.append(self._query("""
+        select bq_insert('testone', '{"n": 50}')
+        """)[0][0])
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 51)
+        self.assertTrue(all(len(_id) == 24 for _id in ids))
+
+    def test_default_and_invalid_strategy(self):
+        self._query("select bq_create_collection('testone')")
+        self.assertEqual(self._query("""
+        select options->>'id' from bq_collections
+        where collection_name = 'testone'
+        """), [('random',)])
+        ids = self._insert_ids('testone', 3)
+        self.assertTrue(all(len(_id) == 24 for _id in ids))
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_create_collection('testtwo', '{"id": "uuid"}')
+            """)
+        self.conn.rollback()
+
+    def test_set_id_strategy(self):
+        self._query("select bq_create_collection('testone')")
+        result = self._query("""
+        select bq_set_id_strategy('testone', 'random')
+        """)
+        self.assertEqual(result, [(False,)])
+
+        result = self._query("""
+        select bq_set_id_strategy('testone', 'time')
+        """)
+        self.assertEqual(result, [(True,)])
+        ids = self._insert_ids('testone', 10)
+        self.assertEqual(ids, sorted(ids))
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_set_id_strategy('testone', 'uuid')
+            """)
+        self.conn.rollback()
+
+class TestPartitionedCollection(testutils.BedquiltTestCase):
+
+    def _insert_many(self, collection, docs):
+        self.cur.execute("select bq_insert_many(%s, %s)",
+                         (collection, json.dumps(docs)))
+        self.conn.commit()
+
+    def test_hash_partitioned_collection(self):
+        result = self._query("""
+        select bq_create_collection('testone', '{"partition": {"hash": 4}}')
+        """)
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select partition_name from bq_list_partitions('testone')
+        """)
+        self.assertEqual(result, [('testone_p0',), ('testone_p1',),
+                                  ('testone_p2',), ('testone_p3',)])
+        result = self._query("select bq_list_collections()")
+        self.assertEqual(result, [('testone',)])
+
+        self._insert_many('testone', [{'_id': str(i), 'n': i}
+                                      for i in range(100)])
+        self._query("select bq_save('testone', '{\"_id\": \"7\", \"n\": 700}')")
+        result = self._query("select bq_count('testone', '{}')")
+        self.assertEqual(result, [(100,)])
+        result = self._query("select bq_find_one_by_id('testone', '7')")
+        self.assertEqual(result, [({'_id': '7', 'n': 700},)])
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("select bq_insert('testone', '{\"_id\": \"7\"}')")
+        self.conn.rollback()
+
+        # lookups by _id only visit one partition
+        plan = '\n'.join(row[0] for row in self._query("""
+        explain select * from testone where _id = '7'
+        """))
+        self.assertEqual(len(set(re.findall(r'testone_p\d', plan))), 1)
+
+    def test_range_partitioned_collection(self):
+        self._query("""
+        select bq_create_collection('testone', '{"partition": {"range": "created"}}')
+        """)
+        result = self._query("""
+        select bq_add_partition('testone', '2016-01-01', '2016-02-01'),
+               bq_add_partition('testone', '2016-02-01', '2016-03-01'),
+               bq_add_partition('testone', '2016-02-01', '2016-03-01')
+        """)
+        self.assertEqual(result, [(True, True, False)])
+
+        # documents take their created timestamp from the time in the _id
+        ids = [row[0] for row in self._query("""
+        select bq_generate_time_id('2016-01-15'::timestamptz + n * interval '1 day')
+        from generate_series(0, 19) n
+        """)]
+        self._insert_many('testone', [{'_id': ids[i], 'n': i}
+                                      for i in range(20)])
+        self._insert_many('testone', [{'n': i} for i in range(20, 30)])
+        self.cur.execute("select bq_save('testone', %s)",
+                         (json.dumps({'_id': ids[3], 'n': 300}),))
+        self.cur.execute("""
+        select created, bq_jdoc from testone where _id = %s
+        """, (ids[3],))
+        result = self.cur.fetchall()
+        self.conn.commit()
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0][0].year, 2016)
+        self.assertEqual(result[0][1], {'_id': ids[3], 'n': 300})
+        result = self._query("""
+        select partition_name, partition_to from bq_list_partitions('testone')
+        """)
+        self.assertEqual([row[0] for row in result],
+                         ['testone_20160101T000000', 'testone_20160201T000000',
+                          'testone_default'])
+        self.assertIsNone(result[2][1])
+
+        result = self._query("""
+        select bq_drop_partitions_before('testone', '2016-02-01')
+        """)
+        self.assertEqual(result, [(1,)])
+        result = self._query("select bq_count('testone', '{}')")
+        self.assertEqual(result, [(13,)])
+        self.cur.execute("select bq_find_one_by_id('testone', %s)",
+                         (ids[3],))
+        self.assertEqual(self.cur.fetchall(), [])
+        self.conn.commit()
+        result = self._query("select bq_find_one('testone', '{\"n\": 25}')")
+        self.assertEqual(len(result), 1)
+
+    def test_range_partitioned_ids_are_unique(self):
+        self._query("""
+        select bq_create_collection('testone', '{"partition": {"range": "created"}}'),
+               bq_add_partition('testone', '2016-01-01', '2016-02-01')
+        """)
+        doc_id = self._query("""
+        select bq_generate_time_id('2016-01-15')
+        """)[0][0]
+        doc = json.dumps({'_id': doc_id, 'n': 1})
+        self.cur.execute("select bq_insert('testone', %s)", (doc,))
+        self.conn.commit()
+
+        # the same _id cannot be inserted again, in any partition
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("select bq_insert('testone', %s)", (doc,))
+        self.conn.rollback()
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("""
+            insert into testone (_id, bq_jdoc, created)
+            values (%s, %s, current_timestamp)
+            """, (doc_id, doc))
+        self.conn.rollback()
+
+        # saving replaces the existing document rather than adding another
+        self.cur.execute("select bq_save('testone', %s)",
+                         (json.dumps({'_id': doc_id, 'n': 2}),))
+        self.cur.execute("select bq_save_many('testone', %s)",
+                         (json.dumps([{'_id': doc_id, 'n': 3}]),))
+        self.conn.commit()
+        result = self._query("select _id, bq_jdoc->'n' from testone")
+        self.assertEqual(result, [(doc_id, 3)])
+
+        # ids which do not carry a time are rejected
+        for query in ["select bq_insert('testone', '{\"_id\": \"a\"}')",
+                      "select bq_insert_many('testone', '[{\"_id\": \"a\"}]')",
+                      "select bq_save('testone', '{\"_id\": \"a\"}')"]:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute(query)
+            self.conn.rollback()
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("select bq_set_id_strategy('testone', 'random')")
+        self.conn.rollback()
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_create_collection('testtwo', '{"id": "random", "partition": {"range": "created"}}')
+            """)
+        self.conn.rollback()
+
+    def test_invalid_partition_options(self):
+        for options in ['{"partition": {"hash": 0}}',
+                        '{"partition": {"hash": 2, "range": "created"}}',
+                        '{"partition": {"range": "updated"}}',
+                        '{"partition": "hash"}']:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute("select bq_create_collection('testone', %s)",
+                                 (options,))
+            self.conn.rollback()
+
+        self._query("select bq_create_collection('testone')")
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_add_partition('testone', '2016-01-01', '2016-02-01')
+            """)
+        self.conn.rollback()
+
+
 class TestListCollections(testutils.BedquiltTestCase):
 
     def test_list_collections_empty_instance(self):
@@ -69,6 +452,48 @@ class TestListCollections(testutils.BedquiltTestCase):
                          ['c_one', 'c_two', 'c_three', 'c_four'])
 
 
+class TestCollectionStats(testutils.BedquiltTestCase):
+
+    def test_stats_empty_instance(self):
+        result = self._query("select * from bq_collection_stats()")
+        self.assertEqual(result, [])
+
+    def test_collection_stats(self):
+        self._query("""
+        select bq_create_collection('c_one');
+        select bq_create_collection('c_two', '{"partition": {"hash": 2}}');
+        """)
+        for i in range(10):
+            self._insert('c_one', {'n': i, 'padding': 'x' * 100})
+        for i in range(6):
+            self._insert('c_two', {'n': i})
+        self.cur.execute("analyze c_one; analyze c_two;")
+        self.conn.commit()
+
+        result = self._query("""
+        select collection_name, approximate_count,
+               heap_bytes > 0, toast_bytes, index_bytes > 0,
+               average_document_bytes > 0,
+               last_vacuum is null, last_analyze is not null
+        from bq_collection_stats()
+        """)
+        self.assertEqual(result, [
+            ('c_one', 10, True, 0, True, True, True, True),
+            # counted over its partitions
+            ('c_two', 6, True, 0, True, True, True, True)
+        ])
+
+        result = self._query("""
+        select collection_name, approximate_count
+        from bq_collection_stats('c_two')
+        """)
+        self.assertEqual(result, [('c_two', 6)])
+        result = self._query("""
+        select collection_name from bq_collection_stats('c_three')
+        """)
+        self.assertEqual(result, [])
+
+
 class TestDeleteCollection(testutils.BedquiltTestCase):
 
     def test_delete_non_existant_collection(self):
@@ -88,3 +513,199 @@ class TestDeleteCollection(testutils.BedquiltTestCase):
 
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0], True)
+
+
+class TestCollectionExists(testutils.BedquiltTestCase):
+
+    def test_collection_exists(self):
+        result = self._query("select bq_collection_exists('one');")
+        self.assertEqual(result, [(False,)])
+
+        self._query("select bq_create_collection('one');")
+        result = self._query("select bq_collection_exists('one');")
+        self.assertEqual(result, [(True,)])
+
+        self._query("select bq_delete_collection('one');")
+        result = self._query("select bq_collection_exists('one');")
+        self.assertEqual(result, [(False,)])
+
+    def test_other_relations_are_not_collections(self):
+        self._query("select bq_create_collection('one');")
+        result = self._query("select bq_collection_exists('one_pkey');")
+        self.assertEqual(result, [(False,)])
+
+    def test_collection_dropped_as_table(self):
+        self._query("select bq_create_collection('one');")
+        self.cur.execute("drop table one;")
+        self.conn.commit()
+        result = self._query("select bq_collection_exists('one');")
+        self.assertEqual(result, [(False,)])
+
+        result = self._query("select bq_create_collection('one');")
+        self.assertEqual(result, [(True,)])
+
+    def test_collection_exists_is_schema_aware(self):
+        self._query("select bq_create_collection('one');")
+        self.cur.execute("""
+        create schema other_things;
+        set search_path to other_things, public;
+        """)
+        try:
+            result = self._query("select bq_collection_exists('one');")
+            self.assertEqual(result, [(False,)])
+            result = self._query("select bq_list_collections();")
+            self.assertEqual(result, [])
+        finally:
+            self.conn.rollback()
+            self.cur.execute("""
+            reset search_path;
+            drop schema if exists other_things cascade;
+            """)
+            self.conn.commit()
+
+
+    def test_drop_table_outside_search_path(self):
+        self._query("select bq_create_collection('one');")
+        self.cur.execute("""
+        create schema other_things;
+        set search_path to other_things;
+        create table other_things.unrelated (x int);
+        """)
+        self.conn.commit()
+        try:
+            # dropping any table runs the registry's event trigger
+            self.cur.execute("drop table other_things.unrelated;")
+            self.conn.commit()
+            self.cur.execute("drop table public.one;")
+            self.conn.commit()
+        finally:
+            self.conn.rollback()
+            self.cur.execute("""
+            reset search_path;
+            drop schema if exists other_things cascade;
+            """)
+            self.conn.commit()
+        result = self._query("select bq_collection_exists('one');")
+        self.assertEqual(result, [(False,)])
+
+
+class TestMigrateCollection(testutils.BedquiltTestCase):
+
+    def test_id_must_match_document(self):
+        self._query("select bq_create_collection('testone')")
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("""
+            insert into testone (_id, bq_jdoc) values ('a', '{"_id": "b"}')
+            """)
+        self.conn.rollback()
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("""
+            insert into testone (_id, bq_jdoc) values ('a', '{}')
+            """)
+        self.conn.rollback()
+
+    def test_migrate_collection_with_id_index(self):
+        self._query("select bq_create_collection('testone')")
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(False,)])
+
+        # the layout of collections from earlier versions
+        self.cur.execute("""
+        alter table testone
+          drop constraint validate_id,
+          add constraint validate_id check ((bq_jdoc->>'_id') is not null);
+        create unique index idx_testone_bq_jdoc_id
+          on testone ((bq_jdoc->>'_id'));
+        """)
+        self.conn.commit()
+        self._insert('testone', {'_id': 'a', 'name': 'Sarah'})
+
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(True,)])
+
+        result = self._query("""
+        select count(*) from pg_index where indrelid = 'testone'::regclass
+        """)
+        self.assertEqual(result, [(2,)])
+        result = self._query("select bq_find_one_by_id('testone', 'a')")
+        self.assertEqual(result, [({'_id': 'a', 'name': 'Sarah'},)])
+
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(False,)])
+
+    def test_migrate_collection_with_legacy_gin_index(self):
+        self._query("select bq_create_collection('testone')")
+        # the name earlier versions gave the GIN index
+        self.cur.execute("""
+        alter index {} rename to idx_testone_bq_jdoc
+        """.format(self._query("select bq_gin_index_name('testone')")[0][0]))
+        self.conn.commit()
+
+        # which is still replaced by bq_set_gin_index
+        result = self._query("""
+        select bq_set_gin_index('testone', 'jsonb_ops')
+        """)
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select count(*) from pg_index where indrelid = 'testone'::regclass
+        """)
+        self.assertEqual(result, [(2,)])
+        self.cur.execute("""
+        alter index {} rename to idx_testone_bq_jdoc
+        """.format(self._query("select bq_gin_index_name('testone')")[0][0]))
+        self.conn.commit()
+
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select c.relname::text = bq_gin_index_name('testone')
+        from pg_index i join pg_class c on c.oid = i.indexrelid
+        where i.indrelid = 'testone'::regclass and c.relname like '%bq_jdoc%'
+        """)
+        self.assertEqual(result, [(True,)])
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(False,)])
+
+    def test_migrate_collection_with_legacy_constraints(self):
+        self._query("""
+        select bq_add_constraints('testone', '{"name": {"$required": true}}')
+        """)
+        # the constraints of earlier versions
+        self.cur.execute("""
+        alter table testone
+          add constraint "bqcn:age:notnull"
+            check (jsonb_typeof(bq_jdoc#>'{age}') <> 'null'),
+          add constraint "bqcn:age:type:number"
+            check (jsonb_typeof(bq_jdoc#>'{age}') in ('number', 'null')),
+          add constraint "bqcn:address.city:required"
+            check (bq_path_exists('address.city', bq_jdoc));
+        """)
+        self.conn.commit()
+
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(True,)])
+        result = self._query("select bq_list_constraints('testone')")
+        self.assertEqual(result, [('address.city:required',),
+                                  ('age:notnull',),
+                                  ('age:type:number',),
+                                  ('name:required',)])
+        result = self._query("""
+        select conname::text from pg_constraint
+        where conrelid = 'testone'::regclass and contype = 'c'
+        order by 1
+        """)
+        self.assertEqual(result, [('bq_constraints',), ('validate_id',)])
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("""
+            select bq_insert('testone',
+                             '{"name": "Sarah", "address": {"city": "Glasgow"},
+                               "age": "old"}')
+            """)
+        self.conn.rollback()
+
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(False,)])
+
+    def test_migrate_non_existant_collection(self):
+        result = self._query("select bq_migrate_collection('testone')")
+        self.assertEqual(result, [(False,)])
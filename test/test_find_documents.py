@@ -81,6 +81,155 @@ class TestCollectionCount(testutils.BedquiltTestCase):
         """)
         self.assertEqual(result, [(2,)])
 
+    def test_estimated_count(self):
+        self.cur.execute("select bq_insert_many('things', %s)",
+                         (json.dumps([{'a': i % 4} for i in range(1000)]),))
+        self.cur.execute("analyze things")
+        self.conn.commit()
+
+        result = self._query("""
+        select bq_count('things', '{}', 'estimated')
+        """)
+        self.assertEqual(result, [(1000,)])
+
+    def test_estimated_count_follows_query_values(self):
+        self.cur.execute("select bq_insert_many('things', %s)",
+                         (json.dumps([{'city': 'rare' if i % 20 == 0
+                                       else 'common'}
+                                      for i in range(1000)]),))
+        self.cur.execute("analyze things")
+        self.conn.commit()
+
+        # more times than it takes for a prepared statement to switch
+        # to a generic plan, which would estimate both the same
+        for _ in range(8):
+            rare, common = [
+                self._query("""
+                select bq_count('things', '{}', 'estimated')
+                """.format(json.dumps({'city': city})))[0][0]
+                for city in ['rare', 'common']]
+            self.assertTrue(0 < rare < 200, rare)
+            self.assertTrue(800 < common <= 1000, common)
+
+    def test_cached_count(self):
+        self._query("""
+        select bq_create_collection('things', '{"cached_count": true}')
+        """)
+        self.cur.execute("select bq_insert_many('things', %s)",
+                         (json.dumps([{'_id': str(i), 'a': i % 4}
+                                      for i in range(100)]),))
+        self.conn.commit()
+        self._query("""
+        select bq_save('things', '{"_id": "1", "a": 5}');
+        select bq_save('things', '{"_id": "new", "a": 5}');
+        select bq_remove('things', '{"a": 2}');
+        select bq_remove_one_by_id('things', '3');
+        """)
+        result = self._query("""
+        select bq_count('things', '{}', 'cached')
+        """)
+        self.assertEqual(result, [(75,)])
+        self.assertEqual(result, self._query("""
+        select bq_count('things', '{}')
+        """))
+
+        self.cur.execute("truncate things")
+        self.conn.commit()
+        result = self._query("""
+        select bq_count('things', '{}', 'cached')
+        """)
+        self.assertEqual(result, [(0,)])
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_count('things', '{"a": 1}', 'cached')
+            """)
+        self.conn.rollback()
+
+    def test_cached_count_after_dropping_partitions(self):
+        self._query("""
+        select bq_create_collection('things', '{"cached_count": true,
+                                                "partition": {"range": "created"}}');
+        select bq_add_partition('things', '2016-01-01', '2016-02-01');
+        """)
+        self._query("""
+        select bq_insert_many('things', (
+          select jsonb_agg(jsonb_build_object('_id', bq_generate_time_id(
+                   '2016-01-01'::timestamptz + n * interval '1 day'))) as docs
+          from generate_series(0, 19) n)::json)
+        """)
+        self._query("""
+        select bq_insert('things', '{"a": 1}')
+        """)
+        result = self._query("""
+        select bq_count('things', '{}', 'cached')
+        """)
+        self.assertEqual(result, [(21,)])
+
+        # dropping a partition takes its documents off the cached count
+        self.cur.execute("""
+        select bq_drop_partitions_before('things', '2016-02-01')
+        """)
+        self.conn.commit()
+        result = self._query("""
+        select bq_count('things', '{}', 'cached')
+        """)
+        self.assertEqual(result, [(1,)])
+        self.assertEqual(result, self._query("""
+        select bq_count('things', '{}')
+        """))
+
+    def test_set_cached_count(self):
+        for i in range(10):
+            self._insert('things', {'a': i})
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_count('things', '{}', 'cached')
+            """)
+        self.conn.rollback()
+
+        result = self._query("""
+        select bq_set_cached_count('things', true)
+        """)
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select bq_set_cached_count('things', true)
+        """)
+        self.assertEqual(result, [(False,)])
+        self._insert('things', {'a': 10})
+        result = self._query("""
+        select bq_count('things', '{}', 'cached')
+        """)
+        self.assertEqual(result, [(11,)])
+
+        # null is neither enabling nor disabling
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_set_cached_count('things', null)
+            """)
+        self.conn.rollback()
+        result = self._query("""
+        select bq_count('things', '{}', 'cached')
+        """)
+        self.assertEqual(result, [(11,)])
+
+        result = self._query("""
+        select bq_set_cached_count('things', false)
+        """)
+        self.assertEqual(result, [(True,)])
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_count('things', '{}', 'cached')
+            """)
+        self.conn.rollback()
+
+    def test_invalid_count_mode(self):
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_count('things', '{}', 'roughly')
+            """)
+        self.conn.rollback()
+
 
 class TestFindDocuments(testutils.BedquiltTestCase):
 
@@ -289,3 +438,289 @@ class TestFindDocuments(testutils.BedquiltTestCase):
                              (sarah,),
                              (mike,)
                          ])
+
+
+class TestFindPlanCache(testutils.BedquiltTestCase):
+
+    def _prepared_count(self):
+        return self._query("""
+        select count(*) from pg_prepared_statements
+        where name like 'bq_%'
+        """)[0][0]
+
+    def test_repeated_queries_share_a_prepared_statement(self):
+        self._insert('people', {'_id': 'sarah', 'name': 'Sarah'})
+        self._insert('people', {'_id': 'mike', 'name': 'Mike'})
+
+        self._query("""
+        select bq_find_one('people', '{"name": "Sarah"}')
+        """)
+        before = self._prepared_count()
+
+        result = self._query("""
+        select bq_find_one('people', '{"name": "Mike"}')
+        """)
+        self.assertEqual(result, [({'_id': 'mike', 'name': 'Mike'},)])
+        self.assertEqual(self._prepared_count(), before)
+
+    def test_prepared_statement_survives_recreated_collection(self):
+        self._insert('people', {'_id': 'sarah', 'name': 'Sarah'})
+        result = self._query("""
+        select bq_find('people', '{"name": "Sarah"}')
+        """)
+        self.assertEqual(result, [({'_id': 'sarah', 'name': 'Sarah'},)])
+
+        self._query("select bq_delete_collection('people')")
+        self._insert('people', {'_id': 'mike', 'name': 'Sarah'})
+        result = self._query("""
+        select bq_find('people', '{"name": "Sarah"}')
+        """)
+        self.assertEqual(result, [({'_id': 'mike', 'name': 'Sarah'},)])
+        result = self._query("""
+        select bq_count('people', '{"name": "Sarah"}')
+        """)
+        self.assertEqual(result, [(1,)])
+
+
+    def test_prepared_statements_are_bounded(self):
+        self._insert('people', {'_id': 'sarah', 'name': 'Sarah', 'age': 30})
+        self.cur.execute("set bedquilt.max_prepared_statements = 3")
+        try:
+            # each field makes a query of a different shape
+            for field in ['name', 'age', 'city', 'likes', 'name']:
+                result = self._query("""
+                select bq_count('people', '{}')
+                """.format(json.dumps({field: {'$exists': True}})))
+                self.assertEqual(
+                    result, [(1 if field in ['name', 'age'] else 0,)])
+            self.assertEqual(self._prepared_count(), 3)
+
+            # a statement prepared in a transaction which rolls back,
+            # evicting the statement for 'city', which stays deallocated
+            self.cur.execute("""
+            select bq_count('people', '{"address": {"$exists": true}}')
+            """)
+            self.conn.rollback()
+            result = self._query("""
+            select bq_count('people', '{"city": {"$exists": true}}')
+            """)
+            self.assertEqual(result, [(0,)])
+            result = self._query("""
+            select bq_count('people', '{"address": {"$exists": true}}')
+            """)
+            self.assertEqual(result, [(0,)])
+            self.assertEqual(self._prepared_count(), 3)
+        finally:
+            self.conn.rollback()
+            self.cur.execute("reset bedquilt.max_prepared_statements")
+            self.conn.commit()
+
+
+class TestFindCursor(testutils.BedquiltTestCase):
+
+    def test_fetch_in_batches(self):
+        for i in range(10):
+            self._insert('things', {'_id': 'doc%02d' % i, 'num': i % 3})
+
+        self.cur.execute("""
+        select bq_find_cursor('things', '{}', 0, null, '[{"num": 1}]',
+                              'things_cursor')
+        """)
+        self.assertEqual(self.cur.fetchall(), [('things_cursor',)])
+
+        batches = []
+        while True:
+            self.cur.execute("fetch 4 from things_cursor")
+            rows = self.cur.fetchall()
+            if not rows:
+                break
+            batches.append([row[0]['_id'] for row in rows])
+        self.conn.commit()
+
+        self.assertEqual(map(len, batches), [4, 4, 2])
+        self.cur.execute("""
+        select bq_find('things', '{}', 0, null, '[{"num": 1}]')
+        """)
+        expected = [row[0]['_id'] for row in self.cur.fetchall()]
+        self.assertEqual(sum(batches, []), expected)
+
+    def test_query_skip_and_limit(self):
+        for i in range(10):
+            self._insert('things', {'_id': 'doc%02d' % i, 'num': i % 3})
+
+        self.cur.execute("""
+        select bq_find_cursor('things', '{"num": 1}', 1, 2, '[]')
+        """)
+        name = self.cur.fetchone()[0]
+        self.cur.execute('fetch all from "{}"'.format(name))
+        result = self.cur.fetchall()
+        self.conn.commit()
+        self.assertEqual([row[0]['_id'] for row in result],
+                         ['doc04', 'doc07'])
+
+    def test_on_non_existant_collection(self):
+        self.cur.execute("""
+        select bq_find_cursor('things', '{}', 0, null, null, 'c')
+        """)
+        _ = self.cur.fetchall()
+        self.cur.execute("fetch all from c")
+        result = self.cur.fetchall()
+        self.conn.commit()
+        self.assertEqual(result, [])
+
+
+class TestFindWithProjection(testutils.BedquiltTestCase):
+
+    def populate(self):
+        self._insert('people', {
+            '_id': 'sarah',
+            'name': 'Sarah',
+            'age': 34,
+            'address': {'city': 'Glasgow', 'street': 'Main Street'},
+            'likes': ['icecream', 'cats']
+        })
+        self._insert('people', {
+            '_id': 'mike',
+            'name': 'Mike',
+            'age': 32
+        })
+
+    def test_find_including_fields(self):
+        self.populate()
+        result = self._query("""
+        select bq_find('people', '{}', 0, null, '[{"age": 1}]',
+                       '{"name": 1, "address.city": 1}')
+        """)
+        self.assertEqual(result, [
+            ({'_id': 'mike', 'name': 'Mike'},),
+            ({'_id': 'sarah', 'name': 'Sarah',
+              'address': {'city': 'Glasgow'}},)
+        ])
+
+        result = self._query("""
+        select bq_find('people', '{"age": {"$gt": 33}}', 0, null, null,
+                       '{"name": 1, "_id": 0}')
+        """)
+        self.assertEqual(result, [({'name': 'Sarah'},)])
+
+    def test_find_including_only_id(self):
+        self.populate()
+        result = self._query("""
+        select bq_find('people', '{}', 0, null, '[{"age": 1}]', '{"_id": 1}')
+        """)
+        self.assertEqual(result, [({'_id': 'mike'},), ({'_id': 'sarah'},)])
+
+        result = self._query("""
+        select bq_find_one_by_id('people', 'sarah', '{"_id": 1, "likes": 0, "address": 0}')
+        """)
+        self.assertEqual(result, [({'_id': 'sarah', 'name': 'Sarah', 'age': 34},)])
+
+    def test_find_excluding_fields(self):
+        self.populate()
+        result = self._query("""
+        select bq_find('people', '{"name": "Sarah"}', 0, null, null,
+                       '{"likes": 0, "address.street": 0, "_id": 0}')
+        """)
+        self.assertEqual(result, [
+            ({'name': 'Sarah', 'age': 34, 'address': {'city': 'Glasgow'}},)
+        ])
+
+    def test_find_one_with_projection(self):
+        self.populate()
+        result = self._query("""
+        select bq_find_one('people', '{"name": "Sarah"}', '{"age": 1}')
+        """)
+        self.assertEqual(result, [({'_id': 'sarah', 'age': 34},)])
+
+        result = self._query("""
+        select bq_find_one_by_id('people', 'mike', '{"age": 0}')
+        """)
+        self.assertEqual(result, [({'_id': 'mike', 'name': 'Mike'},)])
+
+        result = self._query("""
+        select bq_find_one_by_id_jsonb('people', 'mike', '{"name": 1}')
+        """)
+        self.assertEqual(result, [({'_id': 'mike', 'name': 'Mike'},)])
+
+    def test_invalid_projection(self):
+        self.populate()
+        projections = [
+            '{"name": 1, "age": 0}',
+            '{"name": "yes"}',
+            '["name"]'
+        ]
+        for projection in projections:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute("""
+                select bq_find('people', '{}', 0, null, null, %s)
+                """, (projection,))
+            self.conn.rollback()
+
+
+class TestDistinct(testutils.BedquiltTestCase):
+
+    def populate(self):
+        people = [
+            {'_id': 'sarah', 'address': {'city': 'Glasgow'}, 'age': 34},
+            {'_id': 'mike', 'address': {'city': 'Edinburgh'}, 'age': 32},
+            {'_id': 'jill', 'address': {'city': 'Glasgow'}, 'age': 28},
+            {'_id': 'dave', 'address': {'city': 'Dublin'}, 'age': 34},
+            {'_id': 'anna', 'age': 41},
+            {'_id': 'tom', 'address': {'city': 42}, 'age': 19}
+        ]
+        self.cur.execute("select bq_insert_many('people', %s)",
+                         (json.dumps(people),))
+        self.conn.commit()
+
+    def _distinct(self, query):
+        return [row[0] for row in self._query(query)]
+
+    def test_distinct_values(self):
+        self.populate()
+        result = self._distinct("""
+        select bq_distinct('people', 'address.city')
+        """)
+        self.assertEqual(result, ['Dublin', 'Edinburgh', 'Glasgow', 42])
+
+        result = self._distinct("""
+        select bq_distinct('people', 'address.city', '{"age": 34}')
+        """)
+        self.assertEqual(result, ['Dublin', 'Glasgow'])
+
+        result = self._distinct("""
+        select bq_distinct('people', 'nickname')
+        """)
+        self.assertEqual(result, [])
+
+    def test_distinct_values_with_index(self):
+        self.populate()
+        self._query("""
+        select bq_add_index('people', '{"address.city": -1, "age": 1}')
+        """)
+        result = self._distinct("""
+        select bq_distinct('people', 'address.city')
+        """)
+        self.assertEqual(result, ['Dublin', 'Edinburgh', 'Glasgow', 42])
+        # read with a loose index scan
+        result = self._query("""
+        select count(*) from pg_prepared_statements
+        where statement like '%WITH RECURSIVE%'
+        """)
+        self.assertEqual(result, [(1,)])
+
+        result = self._distinct("""
+        select bq_distinct('people', 'address.city',
+                           '{"age": {"$gte": 30}}')
+        """)
+        self.assertEqual(result, ['Dublin', 'Edinburgh', 'Glasgow'])
+
+        result = self._distinct("""
+        select bq_distinct('people', 'age', '{"address.city": "Glasgow"}')
+        """)
+        self.assertEqual(result, [28, 34])
+
+    def test_on_non_existant_collection(self):
+        result = self._query("""
+        select bq_distinct('people', 'address.city')
+        """)
+        self.assertEqual(result, [])
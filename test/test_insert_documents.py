@@ -124,3 +124,164 @@ class TestInsertDocument(testutils.BedquiltTestCase):
         self.cur.execute("select count(*) from people;")
         result = self.cur.fetchone()
         self.assertEqual(result, (1,))
+
+
+class TestInsertManyDocuments(testutils.BedquiltTestCase):
+
+    def test_insert_many_into_non_existant_collection(self):
+        docs = [
+            {"_id": "sarah@example.com", "name": "Sarah"},
+            {"_id": "mike@example.com", "name": "Mike"},
+            {"_id": "jill@example.com", "name": "Jill"}
+        ]
+        result = self._query("""
+        select bq_insert_many('people', '{}');
+        """.format(json.dumps(docs)))
+
+        self.assertEqual(result,
+                         [("sarah@example.com",),
+                          ("mike@example.com",),
+                          ("jill@example.com",)])
+
+        result = self._query("""
+        select bq_find('people', '{}');
+        """)
+        self.assertEqual(result, [(doc,) for doc in docs])
+
+    def test_insert_many_without_ids(self):
+        docs = [
+            {"name": "Sarah"},
+            {"_id": "mike@example.com", "name": "Mike"},
+            {"name": "Jill"}
+        ]
+        result = self._query("""
+        select bq_insert_many('people', '{}');
+        """.format(json.dumps(docs)))
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[1], ("mike@example.com",))
+        for (_id,) in [result[0], result[2]]:
+            self.assertEqual(len(_id), 24)
+            for character in _id:
+                self.assertIn(character, string.hexdigits)
+
+        for (_id,), doc in zip(result, docs):
+            found = self._query("""
+            select bq_find_one_by_id('people', '{}');
+            """.format(_id))
+            self.assertEqual(found[0][0]['name'], doc['name'])
+            self.assertEqual(found[0][0]['_id'], _id)
+
+    def test_insert_many_empty_array(self):
+        result = self._query("""
+        select bq_insert_many('people', '[]');
+        """)
+        self.assertEqual(result, [])
+
+        result = self._query("""
+        select bq_count('people', '{}');
+        """)
+        self.assertEqual(result, [(0,)])
+
+    def test_insert_many_with_non_array(self):
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_insert_many('people', '{"name": "Sarah"}');
+            """)
+        self.conn.rollback()
+
+    def test_insert_many_with_non_string_id(self):
+        docs = [
+            {"_id": "sarah@example.com", "name": "Sarah"},
+            {"_id": 42, "name": "Penguin"}
+        ]
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_insert_many('people', '{}');
+            """.format(json.dumps(docs)))
+        self.conn.rollback()
+
+        result = self._query("""
+        select bq_count('people', '{}');
+        """)
+        self.assertEqual(result, [(0,)])
+
+    def test_insert_many_with_repeat_id(self):
+        self._insert('people', {"_id": "sarah@example.com", "name": "Sarah"})
+        docs = [
+            {"_id": "mike@example.com", "name": "Mike"},
+            {"_id": "sarah@example.com", "name": "Sarah"}
+        ]
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.cur.execute("""
+            select bq_insert_many('people', '{}');
+            """.format(json.dumps(docs)))
+        self.conn.rollback()
+
+        result = self._query("""
+        select bq_count('people', '{}');
+        """)
+        self.assertEqual(result, [(1,)])
+
+
+class TestInsertJsonbDocuments(testutils.BedquiltTestCase):
+
+    def test_insert_jsonb(self):
+        doc = {"_id": "user@example.com", "name": "Some User"}
+        self.cur.execute("""
+        select bq_insert_jsonb('people', %s::jsonb)
+        """, (json.dumps(doc),))
+        result = self.cur.fetchall()
+        self.assertEqual(result, [('user@example.com',)])
+
+        result = self._query("""
+        select bq_find_one_by_id_jsonb('people', 'user@example.com')
+        """)
+        self.assertEqual(result, [(doc,)])
+
+    def test_insert_jsonb_without_id(self):
+        result = self._query("""
+        select bq_insert_jsonb('people', '{"name": "Some User"}'::jsonb)
+        """)
+        _id = result[0][0]
+        self.assertEqual(len(_id), 24)
+
+        result = self._query("""
+        select bq_find_one_jsonb('people', '{"name": "Some User"}'::jsonb)
+        """)
+        self.assertEqual(result, [({"_id": _id, "name": "Some User"},)])
+
+    def test_insert_jsonb_with_non_string_id(self):
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_insert_jsonb('people', '{"_id": 42}'::jsonb)
+            """)
+        self.conn.rollback()
+
+    def test_insert_many_and_save_many_jsonb(self):
+        docs = [{"_id": "a", "n": 1}, {"_id": "b", "n": 2}]
+        self.cur.execute("""
+        select bq_insert_many_jsonb('things', %s::jsonb)
+        """, (json.dumps(docs),))
+        result = self.cur.fetchall()
+        self.assertEqual(result, [('a',), ('b',)])
+
+        docs = [{"_id": "b", "n": 3}, {"_id": "c", "n": 4}]
+        self.cur.execute("""
+        select bq_save_many_jsonb('things', %s::jsonb)
+        """, (json.dumps(docs),))
+        result = self.cur.fetchall()
+        self.assertEqual(result, [('b',), ('c',)])
+
+        result = self._query("""
+        select bq_save_jsonb('things', '{"_id": "a", "n": 5}'::jsonb)
+        """)
+        self.assertEqual(result, [('a',)])
+
+        result = self._query("""
+        select bq_find_jsonb('things', '{}'::jsonb, 0, null, '[{"n": 1}]')
+        """)
+        self.assertEqual(map(lambda x: x[0], result),
+                         [{"_id": "b", "n": 3},
+                          {"_id": "c", "n": 4},
+                          {"_id": "a", "n": 5}])
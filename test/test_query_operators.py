@@ -0,0 +1,141 @@
+import testutils
+import json
+import psycopg2
+
+
+class TestQueryOperators(testutils.BedquiltTestCase):
+
+    def populate(self):
+        docs = [
+            {"_id": "sarah", "age": 34, "city": "Glasgow",
+             "pet": {"species": "dog", "age": 12}},
+            {"_id": "mike", "age": 32, "city": "Edinburgh",
+             "pet": {"species": "cat", "age": 4}},
+            {"_id": "jill", "age": 28, "city": "Glasgow",
+             "pet": {"species": "cat", "age": 2}},
+            {"_id": "darren", "age": "unknown", "city": "Manchester"},
+            {"_id": "eliot", "age": None}
+        ]
+        for doc in docs:
+            self._insert('people', doc)
+
+    def _find_ids(self, query):
+        self.cur.execute("""
+        select bq_find('people', %s, 0, null, '[]')
+        """, (json.dumps(query),))
+        result = self.cur.fetchall()
+        self.conn.commit()
+        return [row[0]['_id'] for row in result]
+
+    def test_comparisons(self):
+        self.populate()
+        self.assertEqual(self._find_ids({"age": {"$gt": 30}}),
+                         ["mike", "sarah"])
+        self.assertEqual(self._find_ids({"age": {"$gte": 32}}),
+                         ["mike", "sarah"])
+        self.assertEqual(self._find_ids({"age": {"$lt": 32}}),
+                         ["jill"])
+        self.assertEqual(self._find_ids({"age": {"$lte": 32}}),
+                         ["jill", "mike"])
+        self.assertEqual(self._find_ids({"age": {"$gt": 28, "$lt": 34}}),
+                         ["mike"])
+        # strings only compare with strings
+        self.assertEqual(self._find_ids({"age": {"$gt": "a"}}),
+                         ["darren"])
+
+    def test_dotted_paths(self):
+        self.populate()
+        self.assertEqual(self._find_ids({"pet.age": {"$gte": 4}}),
+                         ["mike", "sarah"])
+        self.assertEqual(self._find_ids({"pet.species": "cat"}),
+                         ["jill", "mike"])
+        self.assertEqual(self._find_ids({"pet.species": "cat",
+                                         "pet.age": {"$gt": 2},
+                                         "city": "Edinburgh"}),
+                         ["mike"])
+
+    def test_in_and_nin(self):
+        self.populate()
+        self.assertEqual(
+            self._find_ids({"city": {"$in": ["Glasgow", "Manchester"]}}),
+            ["darren", "jill", "sarah"])
+        self.assertEqual(
+            self._find_ids({"city": {"$nin": ["Glasgow", "Manchester"]}}),
+            ["eliot", "mike"])
+        self.assertEqual(self._find_ids({"city": {"$in": []}}), [])
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_find('people', '{"city": {"$in": "Glasgow"}}')
+            """)
+        self.conn.rollback()
+
+    def test_ne_and_exists(self):
+        self.populate()
+        self.assertEqual(self._find_ids({"city": {"$ne": "Glasgow"}}),
+                         ["darren", "eliot", "mike"])
+        self.assertEqual(self._find_ids({"pet": {"$exists": True}}),
+                         ["jill", "mike", "sarah"])
+        self.assertEqual(self._find_ids({"pet": {"$exists": False}}),
+                         ["darren", "eliot"])
+        # a null value still exists
+        self.assertEqual(self._find_ids({"age": {"$exists": False}}), [])
+
+    def test_invalid_operators(self):
+        self.populate()
+        queries = [
+            {"age": {"$regex": "3"}},
+            {"age": {"$gt": 3, "plain": 4}},
+            {"age": {"$exists": 1}}
+        ]
+        for query in queries:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute("""
+                select bq_find('people', %s)
+                """, (json.dumps(query),))
+            self.conn.rollback()
+
+    def test_count_and_remove(self):
+        self.populate()
+        result = self._query("""
+        select bq_count('people', '{"age": {"$lt": 33}}')
+        """)
+        self.assertEqual(result, [(2,)])
+
+        result = self._query("""
+        select bq_remove_one('people', '{"age": {"$lt": 33}}')
+        """)
+        self.assertEqual(result, [(1,)])
+
+        result = self._query("""
+        select bq_remove('people', '{"age": {"$gte": 0}}')
+        """)
+        self.assertEqual(result, [(2,)])
+        self.assertEqual(self._find_ids({}), ["darren", "eliot"])
+
+    def test_queries_of_one_shape_share_a_plan(self):
+        self.populate()
+        self._find_ids({"age": {"$gt": 30}})
+        before = self._query("""
+        select count(*) from pg_prepared_statements where name like 'bq_%'
+        """)
+        self.assertEqual(self._find_ids({"age": {"$gt": 33}}), ["sarah"])
+        after = self._query("""
+        select count(*) from pg_prepared_statements where name like 'bq_%'
+        """)
+        self.assertEqual(before, after)
+
+    def test_range_uses_index(self):
+        self.populate()
+        self._query("select bq_add_index('people', '{\"age\": 1}')")
+        predicate = self._query("""
+        select bq_query_to_text('{"age": {"$gt": 30}}')
+        """)[0][0]
+        self.cur.execute("set local enable_seqscan = off")
+        self.cur.execute("""
+        explain select bq_jdoc from people where {}
+        """.format(predicate.replace(
+            '$1', "'{\"age\": {\"$gt\": 30}}'::jsonb")))
+        plan = '\n'.join(row[0] for row in self.cur.fetchall())
+        self.conn.rollback()
+        self.assertIn('Index Cond', plan)
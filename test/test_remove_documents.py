@@ -328,3 +328,118 @@ class TestRemoveDocumnts(testutils.BedquiltTestCase):
                              (mike,),
                              (darren,)
                          ])
+
+
+class TestPurgeExpired(testutils.BedquiltTestCase):
+
+    def _ids(self, collection):
+        return [row[0] for row in self._query("""
+        select _id from {} order by _id
+        """.format(collection))]
+
+    def test_purge_after_created(self):
+        self._query("""
+        select bq_create_collection('events', '{"ttl": {"seconds": 3600}}')
+        """)
+        self.cur.execute("select bq_insert_many('events', %s)",
+                         (json.dumps([{'_id': str(i)} for i in range(10)]),))
+        self.cur.execute("""
+        update events set created = current_timestamp - interval '2 hours'
+        where _id < '6'
+        """)
+        self.conn.commit()
+
+        result = self._query("select bq_purge_expired('events', 4)")
+        self.assertEqual(result, [(4,)])
+        result = self._query("select bq_purge_expired('events', 4)")
+        self.assertEqual(result, [(2,)])
+        result = self._query("select bq_purge_expired('events', 4)")
+        self.assertEqual(result, [(0,)])
+        self.assertEqual(self._ids('events'), ['6', '7', '8', '9'])
+
+    def test_purge_after_document_time(self):
+        self._query("select bq_create_collection('sessions')")
+        result = self._query("""
+        select bq_set_ttl('sessions', 0, 'login.expires')
+        """)
+        self.assertEqual(result, [(True,)])
+        result = self._query("""
+        select bq_set_ttl('sessions', 0, 'login.expires')
+        """)
+        self.assertEqual(result, [(False,)])
+        sessions = [
+            {'_id': 'a', 'login': {'expires': '2016-01-01T00:00:00Z'}},
+            {'_id': 'b', 'login': {'expires': '2016-01-01 12:00:00+01'}},
+            {'_id': 'c', 'login': {'expires': 1451606400}},
+            {'_id': 'd', 'login': {'expires': '2999-01-01T00:00:00'}},
+            {'_id': 'e', 'login': {'expires': '2016-13-45'}},
+            {'_id': 'f', 'login': {'expires': 'soon'}},
+            {'_id': 'g'},
+            {'_id': 'h', 'login': {'expires': '2016-02-30T00:00:00Z'}}
+        ]
+        self.cur.execute("select bq_insert_many('sessions', %s)",
+                         (json.dumps(sessions),))
+        self.conn.commit()
+
+        result = self._query("select bq_purge_expired('sessions')")
+        self.assertEqual(result, [(3,)])
+        self.assertEqual(self._ids('sessions'), ['d', 'e', 'f', 'g', 'h'])
+
+        result = self._query("select bq_set_ttl('sessions', null)")
+        self.assertEqual(result, [(True,)])
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("select bq_purge_expired('sessions')")
+        self.conn.rollback()
+
+    def test_purge_skips_locked_documents(self):
+        self._query("""
+        select bq_create_collection('events', '{"ttl": {"seconds": 0}}')
+        """)
+        self.cur.execute("select bq_insert_many('events', %s)",
+                         (json.dumps([{'_id': str(i)} for i in range(5)]),))
+        self.conn.commit()
+
+        other_conn = testutils.get_pg_connection()
+        try:
+            other_cur = other_conn.cursor()
+            other_cur.execute("select * from events where _id = '2' for update")
+            result = self._query("select bq_purge_expired('events')")
+            self.assertEqual(result, [(4,)])
+        finally:
+            other_conn.rollback()
+            other_conn.close()
+        self.assertEqual(self._ids('events'), ['2'])
+
+    def test_ttl_indexes_of_long_collections(self):
+        # names whose expiry indexes were once cut to the same 63 bytes
+        prefix = 'a_collection_with_a_long_name_which_is_shared_by_two_others_'
+        collections = [prefix + 'one', prefix + 'two']
+        for collection in collections:
+            self._query("""
+            select bq_create_collection('{}', '{{"ttl": {{"seconds": 60}}}}')
+            """.format(collection))
+
+        def ttl_indexes(collection):
+            return self._query("""
+            select count(*) from pg_index i
+            join pg_class c on c.oid = i.indexrelid
+            where i.indrelid = '{}'::regclass and c.relname like '%bq_ttl%'
+            """.format(collection))
+
+        for collection in collections:
+            self.assertEqual(ttl_indexes(collection), [(1,)])
+        result = self._query("""
+        select bq_set_ttl('{}', null)
+        """.format(collections[1]))
+        self.assertEqual(result, [(True,)])
+        self.assertEqual(ttl_indexes(collections[0]), [(1,)])
+        self.assertEqual(ttl_indexes(collections[1]), [(0,)])
+
+    def test_invalid_ttl(self):
+        self._query("select bq_create_collection('events')")
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("select bq_set_ttl('events', -1)")
+        self.conn.rollback()
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("select bq_set_ttl('nothing', 60)")
+        self.conn.rollback()
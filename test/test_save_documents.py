@@ -105,3 +105,95 @@ class TestSaveDocuments(testutils.BedquiltTestCase):
                              (dud,),
                              (doc,)
                          ])
+
+    def test_save_refreshes_updated_timestamp(self):
+        doc = {"_id": "aaa", "name": "spanner"}
+        self._query("""
+        select bq_save('things', '{}');
+        """.format(json.dumps(doc)))
+        before = self._query("""
+        select created, updated from things where _id = 'aaa';
+        """)
+
+        doc['name'] = 'wrench'
+        self._query("""
+        select bq_save('things', '{}');
+        """.format(json.dumps(doc)))
+        after = self._query("""
+        select created, updated from things where _id = 'aaa';
+        """)
+
+        self.assertEqual(after[0][0], before[0][0])
+        self.assertTrue(after[0][1] > before[0][1])
+
+
+class TestSaveManyDocuments(testutils.BedquiltTestCase):
+
+    def test_save_many_into_non_existant_collection(self):
+        docs = [
+            {"_id": "aaa", "a": 1},
+            {"_id": "bbb", "a": 2}
+        ]
+        result = self._query("""
+        select bq_save_many('things', '{}');
+        """.format(json.dumps(docs)))
+        self.assertEqual(result, [("aaa",), ("bbb",)])
+
+        result = self._query("""
+        select bq_find('things', '{}');
+        """)
+        self.assertEqual(result, [(doc,) for doc in docs])
+
+    def test_save_many_inserts_and_updates(self):
+        self._insert('things', {"_id": "aaa", "a": 1})
+        self._insert('things', {"_id": "bbb", "a": 2})
+
+        docs = [
+            {"_id": "bbb", "a": 22, "b": "fish"},
+            {"a": 3},
+            {"_id": "ccc", "a": 4}
+        ]
+        result = self._query("""
+        select bq_save_many('things', '{}');
+        """.format(json.dumps(docs)))
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0], ("bbb",))
+        self.assertEqual(len(result[1][0]), 24)
+        self.assertEqual(result[2], ("ccc",))
+
+        result = self._query("""
+        select bq_count('things', '{}');
+        """)
+        self.assertEqual(result, [(4,)])
+
+        result = self._query("""
+        select bq_find_one_by_id('things', 'bbb');
+        """)
+        self.assertEqual(result, [({"_id": "bbb", "a": 22, "b": "fish"},)])
+
+        result = self._query("""
+        select bq_find_one_by_id('things', 'aaa');
+        """)
+        self.assertEqual(result, [({"_id": "aaa", "a": 1},)])
+
+    def test_save_many_with_repeat_id_in_batch(self):
+        docs = [
+            {"_id": "aaa", "a": 1},
+            {"_id": "aaa", "a": 2}
+        ]
+        result = self._query("""
+        select bq_save_many('things', '{}');
+        """.format(json.dumps(docs)))
+        self.assertEqual(result, [("aaa",), ("aaa",)])
+
+        result = self._query("""
+        select bq_find('things', '{}');
+        """)
+        self.assertEqual(result, [({"_id": "aaa", "a": 2},)])
+
+    def test_save_many_with_non_string_id(self):
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_save_many('things', '[{"_id": 42}]');
+            """)
+        self.conn.rollback()
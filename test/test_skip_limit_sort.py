@@ -251,3 +251,88 @@ class TestSortOnTwoFields(testutils.BedquiltTestCase):
         self.assertEqual(_names(result),
                          ["yy", "jj", "aa",
                           "kk", "hh", "ff", "bb"])
+
+
+class TestFindPage(testutils.BedquiltTestCase):
+
+    def populate(self):
+        docs = [
+            {"_id": "a", "name": "aa", "b": {"c": 4}},
+            {"_id": "h", "name": "hh", "b": {"c": 1}},
+            {"_id": "b", "name": "bb", "b": {"c": 1}},
+            {"_id": "y", "name": "yy"},
+            {"_id": "j", "name": "jj", "b": {"c": 4}},
+            {"_id": "k", "name": "kk", "b": {"c": None}},
+            {"_id": "f", "name": "ff", "b": {"c": 1}},
+            {"_id": "q", "b": {"c": 2}},
+            {"_id": "z"}
+        ]
+        for doc in docs:
+            self._insert('things', doc)
+
+    def _all_pages(self, sort, page_size, query='{}'):
+        pages = []
+        cursor = None
+        while True:
+            self.cur.execute("""
+            select * from bq_find_page('things', %s, %s, %s, %s)
+            """, (query, sort, cursor, page_size))
+            rows = self.cur.fetchall()
+            self.conn.commit()
+            pages.append([row[0]['_id'] for row in rows])
+            if len(rows) < page_size:
+                return pages
+            cursor = rows[-1][1]
+
+    def test_pages_match_sorted_find(self):
+        self.populate()
+        sorts = [
+            '[]',
+            '[{"b.c": 1}]',
+            '[{"b.c": -1}]',
+            '[{"b.c": 1}, {"name": -1}]',
+            '[{"b.c": -1}, {"name": 1}]',
+            '[{"name": 1}, {"b.c": -1}]'
+        ]
+        for sort in sorts:
+            self.cur.execute("""
+            select bq_find('things', '{}', 0, null, %s)
+            """, (sort,))
+            expected = [row[0]['_id'] for row in self.cur.fetchall()]
+            self.conn.commit()
+            for page_size in [1, 2, 3, 20]:
+                pages = self._all_pages(sort, page_size)
+                self.assertTrue(all(len(page) <= page_size
+                                    for page in pages))
+                self.assertEqual(sum(pages, []), expected)
+
+    def test_pages_with_query(self):
+        self.populate()
+        pages = self._all_pages('[{"name": -1}]', 2,
+                                '{"b": {"c": 1}}')
+        self.assertEqual(pages, [["h", "f"], ["b"]])
+
+    def test_first_page_without_cursor(self):
+        self.populate()
+        result = self._query("""
+        select bq_jdoc from bq_find_page('things', '{}', null, null, 3)
+        """)
+        self.assertEqual([row[0]['_id'] for row in result],
+                         ["a", "b", "f"])
+
+    def test_invalid_cursor(self):
+        self.populate()
+        first = self._query("""
+        select bq_cursor from bq_find_page('things', '{}', null, null, 1)
+        """)
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_find_page('things', '{}', '[{"name": 1}]', %s, 1)
+            """, (first[0][0],))
+        self.conn.rollback()
+
+    def test_on_empty_collection(self):
+        result = self._query("""
+        select bq_find_page('things', '{}', '[{"name": 1}]', null, 5)
+        """)
+        self.assertEqual(result, [])
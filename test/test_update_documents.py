@@ -0,0 +1,129 @@
+import testutils
+import json
+import psycopg2
+
+
+class TestUpdateDocuments(testutils.BedquiltTestCase):
+
+    def populate(self):
+        self._insert('people', {
+            '_id': 'sarah',
+            'name': 'Sarah',
+            'visits': 3,
+            'likes': ['icecream', 'cats', 'dogs', 'cats'],
+            'address': {'city': 'Glasgow'}
+        })
+        self._insert('people', {
+            '_id': 'mike',
+            'name': 'Mike',
+            'likes': ['cats']
+        })
+
+    def _find_by_id(self, _id):
+        return self._query("""
+        select bq_find_one_by_id('people', '{}')
+        """.format(_id))[0][0]
+
+    def test_update_on_non_existant_collection(self):
+        result = self._query("""
+        select bq_update('people', '{}', '{"$set": {"a": 1}}')
+        """)
+        self.assertEqual(result, [(0,)])
+
+    def test_set_and_unset(self):
+        self.populate()
+        result = self._query("""
+        select bq_update('people', '{"name": "Sarah"}',
+                         '{"$set": {"address.city": "Edinburgh",
+                                    "job.title": "Engineer"},
+                           "$unset": {"visits": 1}}')
+        """)
+        self.assertEqual(result, [(1,)])
+        self.assertEqual(self._find_by_id('sarah'), {
+            '_id': 'sarah',
+            'name': 'Sarah',
+            'likes': ['icecream', 'cats', 'dogs', 'cats'],
+            'address': {'city': 'Edinburgh'},
+            'job': {'title': 'Engineer'}
+        })
+
+    def test_inc(self):
+        self.populate()
+        for i in range(3):
+            result = self._query("""
+            select bq_update('people', '{}', '{"$inc": {"visits": 2}}')
+            """)
+            self.assertEqual(result, [(2,)])
+        self.assertEqual(self._find_by_id('sarah')['visits'], 9)
+        self.assertEqual(self._find_by_id('mike')['visits'], 6)
+
+        with self.assertRaises(psycopg2.InternalError):
+            self.cur.execute("""
+            select bq_update('people', '{}', '{"$inc": {"name": 1}}')
+            """)
+        self.conn.rollback()
+
+    def test_push_and_pull(self):
+        self.populate()
+        result = self._query("""
+        select bq_update('people', '{"likes": ["cats"]}',
+                         '{"$pull": {"likes": "cats"},
+                           "$push": {"tags": "friendly"}}')
+        """)
+        self.assertEqual(result, [(2,)])
+        self.assertEqual(self._find_by_id('sarah')['likes'],
+                         ['icecream', 'dogs'])
+        self.assertEqual(self._find_by_id('mike')['likes'], [])
+        self.assertEqual(self._find_by_id('mike')['tags'], ['friendly'])
+
+        self._query("""
+        select bq_update('people', '{"_id": "mike"}',
+                         '{"$push": {"likes": {"name": "code"}}}')
+        """)
+        self.assertEqual(self._find_by_id('mike')['likes'],
+                         [{'name': 'code'}])
+
+    def test_update_one(self):
+        self.populate()
+        result = self._query("""
+        select bq_update_one('people', '{"likes": ["cats"]}',
+                             '{"$set": {"seen": true}}')
+        """)
+        self.assertEqual(result, [(1,)])
+        result = self._query("""
+        select bq_count('people', '{"seen": true}')
+        """)
+        self.assertEqual(result, [(1,)])
+
+    def test_updated_timestamp_is_refreshed(self):
+        self.populate()
+        before = self._query("""
+        select updated from people where _id = 'sarah'
+        """)[0][0]
+        self._query("""
+        select bq_update('people', '{"_id": "sarah"}',
+                         '{"$inc": {"visits": 1}}')
+        """)
+        after = self._query("""
+        select updated from people where _id = 'sarah'
+        """)[0][0]
+        self.assertTrue(after > before)
+
+    def test_invalid_updates(self):
+        self.populate()
+        updates = [
+            {"name": "Sarah"},
+            {"$rename": {"name": "first_name"}},
+            {"$set": {"_id": "someone"}},
+            {"$unset": {"_id": 1}},
+            {"$set": "name"},
+            {"$set": {"name.first": "Sarah"}},
+            {}
+        ]
+        for update in updates:
+            with self.assertRaises(psycopg2.InternalError):
+                self.cur.execute("""
+                select bq_update('people', '{}', %s)
+                """, (json.dumps(update),))
+            self.conn.rollback()
+        self.assertEqual(self._find_by_id('sarah')['name'], 'Sarah')